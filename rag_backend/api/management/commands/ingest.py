@@ -0,0 +1,257 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.managers.bulk_import import BulkImporter, iter_directory_members
+from api.managers.stage_stats import StageStats
+from api.models import File
+
+STAGES = ['parse', 'context', 'embed']
+
+def _parse_stage_concurrency(value):
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition('=')
+        try:
+            limits[name.strip()] = int(limit)
+        except ValueError:
+            raise CommandError(f'無效的階段並發設定: {item}（格式為 parse=2,context=1,embed=1）')
+    return limits
+
+class Command(BaseCommand):
+    help = (
+        '離線批量攝取：導入伺服器目錄（--directory）或重新索引 File 表中的文件（--reindex），'
+        '不經過 Web 服務與攝取佇列，支持斷點續跑（--resume）並輸出各階段吞吐量'
+    )
+    # 系統檢查會載入 URLconf 並導入 api.rag_instance，創建第二個 RAGManager；本命令自行創建 RAGManager
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        queue_config = getattr(settings, 'RAG_INGESTION_QUEUE', {})
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument('--directory', help='導入並攝取此目錄下的所有支持的文件（文件會複製到上傳目錄）')
+        source.add_argument('--reindex', action='store_true', help='重新攝取 File 表中的文件')
+        parser.add_argument('--status', action='append', choices=['uploading', 'processing', 'processed', 'error'],
+                            help='--reindex 時只處理這些狀態的文件（可重複指定，默認為除 cancelled 外的全部）')
+        parser.add_argument('--limit', type=int, default=0, help='最多處理的文件數，0 表示不限制')
+        parser.add_argument('--workers', type=int, default=queue_config.get('WORKERS', 2), help='同時處理的文件數量')
+        parser.add_argument('--parse-processes', type=int, default=getattr(settings, 'RAG_PARSER', {}).get('PROCESSES', 0),
+                            help='解析子進程數量，0 表示在當前進程內解析')
+        parser.add_argument('--stage-concurrency',
+                            default=','.join(f'{k}={v}' for k, v in queue_config.get('STAGE_CONCURRENCY', {}).items()),
+                            help='各階段並發上限，例如 parse=4,context=2,embed=1')
+        parser.add_argument('--embed-batch-size', type=int, default=queue_config.get('EMBED_BATCH_SIZE', 0),
+                            help='每批嵌入並寫入向量庫的文本塊數，0 表示一次寫入整個文件')
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / 'ingest_checkpoint.json'), help='斷點文件路徑')
+        parser.add_argument('--resume', action='store_true', help='從斷點文件繼續，略過已成功處理的文件')
+        parser.add_argument('--report-interval', type=float, default=30, help='輸出進度的間隔（秒）')
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint']
+        if options['resume']:
+            checkpoint = self._load_checkpoint(checkpoint_path)
+        elif options['directory'] or options['reindex']:
+            if os.path.exists(checkpoint_path):
+                raise CommandError(f'斷點文件已存在: {checkpoint_path}，請使用 --resume 繼續或先刪除該文件')
+            checkpoint = None
+        else:
+            raise CommandError('請指定 --directory、--reindex 或 --resume')
+
+        rag_manager = self._create_rag_manager(options)
+
+        if checkpoint is None:
+            if options['directory']:
+                checkpoint = self._import_directory(rag_manager, options['directory'])
+            else:
+                checkpoint = self._select_files(options['status'])
+            self._save_checkpoint(checkpoint_path, checkpoint)
+
+        completed = set(checkpoint['completed'])
+        pending = [item for item in checkpoint['items'] if item[0] not in completed]
+        if options['limit'] > 0:
+            pending = pending[:options['limit']]
+        self.stdout.write(
+            f"共 {len(checkpoint['items'])} 個文件，已完成 {len(completed)} 個，本次處理 {len(pending)} 個"
+            f"（工作者 {options['workers']}，解析進程 {options['parse_processes']}，嵌入批量 {options['embed_batch_size']}）"
+        )
+        if not pending:
+            self._finish(checkpoint_path, checkpoint)
+            return
+
+        stage_stats = rag_manager.file_processor.stage_limiter
+        interrupted = self._run(rag_manager, pending, checkpoint, checkpoint_path, options)
+        self._report(stage_stats, checkpoint)
+        if interrupted:
+            raise CommandError(f'已中斷，進度已保存至 {checkpoint_path}，使用 --resume 繼續')
+        self._finish(checkpoint_path, checkpoint)
+
+    def _create_rag_manager(self, options):
+        # 直接創建 RAGManager 而不導入 api.rag_instance（此 RAGManager 不啟動佇列工作執行緒，文件由本命令直接處理）
+        from api.managers.rag_manager import RAGManager
+
+        chroma_dir = os.path.join(settings.BASE_DIR, 'chroma_db')
+        os.makedirs(chroma_dir, exist_ok=True)
+        rag_manager = RAGManager(
+            chroma_db_dir=chroma_dir,
+            upload_dir=str(settings.MEDIA_ROOT),
+            db_path=os.path.join(settings.BASE_DIR, 'db.sqlite3')
+        )
+        file_processor = rag_manager.file_processor
+        file_processor.stage_limiter = StageStats(_parse_stage_concurrency(options['stage_concurrency']))
+        file_processor.parser_processes = options['parse_processes']
+        file_processor.embed_batch_size = options['embed_batch_size']
+        return rag_manager
+
+    def _import_directory(self, rag_manager, directory):
+        root = os.path.realpath(directory)
+        if not os.path.isdir(root):
+            raise CommandError(f'目錄不存在: {directory}')
+        items = []
+        importer = BulkImporter(lambda batch, **kwargs: items.extend(batch) or len(batch), getattr(settings, 'RAG_BULK_IMPORT', {}))
+        started = time.perf_counter()
+        result = importer.import_members(iter_directory_members(root), 'directory', root)
+        self.stdout.write(
+            f"已導入 {result['total_files']} 個文件（略過 {result['skipped_files']} 個），"
+            f"耗時 {time.perf_counter() - started:.1f} 秒，批次 {result['batch_id']}"
+        )
+        return {'source': 'directory', 'batch_id': result['batch_id'], 'items': items, 'completed': [], 'failed': []}
+
+    def _select_files(self, statuses):
+        queryset = File.objects.exclude(status='cancelled').order_by('upload_time')
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        items = []
+        for file_obj in queryset.iterator():
+            if file_obj.file:
+                items.append([str(file_obj.id), file_obj.file.path])
+        return {'source': 'reindex', 'batch_id': None, 'items': items, 'completed': [], 'failed': []}
+
+    def _load_checkpoint(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'找不到斷點文件: {path}')
+        except ValueError as e:
+            raise CommandError(f'斷點文件無效: {e}')
+
+    def _save_checkpoint(self, path, checkpoint):
+        # 先寫入臨時文件再替換，中斷時不會留下損壞的斷點文件
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _process(self, rag_manager, file_id, file_path):
+        close_old_connections()
+        try:
+            ok = rag_manager.process_file(file_id, file_path, update_bm25=False)
+            chunks = File.objects.filter(id=file_id).values_list('chunks_count', flat=True).first() or 0
+            return ok, chunks
+        finally:
+            close_old_connections()
+
+    def _run(self, rag_manager, pending, checkpoint, checkpoint_path, options):
+        completed = checkpoint['completed']
+        failed = set(checkpoint['failed'])
+        workers = max(1, options['workers'])
+        started = time.perf_counter()
+        last_report = last_save = started
+        done = chunks_total = 0
+        remaining = iter(pending)
+        futures = {}
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        try:
+            # 最多保持 2 倍工作者數量的任務在執行中，文件列表可以非常大
+            for file_id, file_path in remaining:
+                futures[executor.submit(self._process, rag_manager, file_id, file_path)] = file_id
+                if len(futures) >= workers * 2:
+                    break
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    file_id = futures.pop(future)
+                    try:
+                        ok, chunks = future.result()
+                    except Exception as e:
+                        self.stderr.write(f'處理文件 {file_id} 時出錯: {e}')
+                        ok, chunks = False, 0
+                    done += 1
+                    if ok:
+                        completed.append(file_id)
+                        failed.discard(file_id)
+                        chunks_total += chunks
+                    else:
+                        failed.add(file_id)
+                    next_item = next(remaining, None)
+                    if next_item is not None:
+                        futures[executor.submit(self._process, rag_manager, *next_item)] = next_item[0]
+
+                now = time.perf_counter()
+                if now - last_save >= 5 or not futures:
+                    checkpoint['failed'] = sorted(failed)
+                    self._save_checkpoint(checkpoint_path, checkpoint)
+                    last_save = now
+                if now - last_report >= options['report_interval']:
+                    elapsed = now - started
+                    self.stdout.write(
+                        f'進度 {done}/{len(pending)}，失敗 {len(failed)}，'
+                        f'{done / elapsed:.2f} 文件/秒，{chunks_total / elapsed:.1f} 文本塊/秒'
+                    )
+                    last_report = now
+        except KeyboardInterrupt:
+            # 未開始的文件不再處理；正在處理的文件未記為完成，續跑時會重新處理（處理前會先清除其舊向量）
+            executor.shutdown(wait=False, cancel_futures=True)
+            checkpoint['failed'] = sorted(failed)
+            self._save_checkpoint(checkpoint_path, checkpoint)
+            return True
+        finally:
+            executor.shutdown(wait=True)
+            parser_pool = rag_manager.file_processor._parser_pool
+            if parser_pool is not None:
+                parser_pool.shutdown(wait=False)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'本次處理 {done} 個文件，失敗 {len(failed)} 個，共 {chunks_total} 個文本塊，耗時 {elapsed:.1f} 秒'
+            f'（{done / elapsed if elapsed else 0:.2f} 文件/秒，{chunks_total / elapsed if elapsed else 0:.1f} 文本塊/秒）'
+        )
+        return False
+
+    def _report(self, stage_stats, checkpoint):
+        snapshot = stage_stats.snapshot()
+        self.stdout.write('各階段吞吐量：')
+        self.stdout.write(f"  {'階段':<8}{'並發':>6}{'次數':>8}{'執行秒':>10}{'等待秒':>10}{'每槽/秒':>10}{'有效/秒':>10}")
+        for name in STAGES + sorted(set(snapshot['stages']) - set(STAGES)):
+            stats = snapshot['stages'].get(name)
+            if stats is None:
+                continue
+            self.stdout.write(
+                f"  {name:<8}{stats['concurrency'] or '-':>6}{stats['calls']:>8}"
+                f"{stats['busy_seconds']:>10.1f}{stats['wait_seconds']:>10.1f}"
+                f"{stats['per_slot_per_second']:>10.2f}{stats['effective_per_second']:>10.2f}"
+            )
+        if checkpoint['failed']:
+            self.stdout.write(self.style.WARNING(f"失敗的文件: {', '.join(checkpoint['failed'][:20])}"
+                                                 f"{' ...' if len(checkpoint['failed']) > 20 else ''}"))
+
+    def _finish(self, checkpoint_path, checkpoint):
+        if checkpoint['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"{len(checkpoint['failed'])} 個文件處理失敗，斷點文件保留於 {checkpoint_path}，可使用 --resume 重試"
+            ))
+            return
+        if len(checkpoint['completed']) < len(checkpoint['items']):
+            self.stdout.write(f'尚有未處理的文件，斷點文件保留於 {checkpoint_path}')
+            return
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS('所有文件已攝取完成'))
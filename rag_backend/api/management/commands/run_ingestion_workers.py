@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = '以專用進程執行攝取佇列的任務（Web 進程設置 RAG_INGESTION_QUEUE["AUTOSTART"] = False 時使用）'
+
+    def handle(self, *args, **options):
+        from api.rag_instance import rag_manager_singleton, start_ingestion_workers
+
+        start_ingestion_workers(force=True)
+        self.stdout.write(self.style.SUCCESS('攝取工作者已啟動，按 Ctrl+C 停止'))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            rag_manager_singleton.ingestion_queue.stop()
+            self.stdout.write('已停止（中斷的任務在租約過期後重新領取）')
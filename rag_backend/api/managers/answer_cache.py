@@ -0,0 +1,278 @@
+"""
+Answer Cache - 問答結果快取
+以 (規範化問題, 檢索相關設置, 知識庫版本) 為鍵保存回答與相關文檔，命中時跳過檢索與 LLM 調用
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_ANSWER_CACHE_CONFIG = {
+    'ENABLED': True,
+    'TTL_SECONDS': 3600,
+    'MAX_ENTRIES': 2000,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'PERSISTENT': False,
+    'PATH': 'answer_cache.sqlite3',
+    'PERSISTENT_MAX_BYTES': 256 * 1024 * 1024,
+}
+
+# 影響檢索結果或回答內容的設置，任一變更都會產生不同的快取鍵
+ANSWER_SETTING_KEYS = [
+    'embedding_model', 'llm_model', 'temperature', 'max_tokens', 'top_k',
+    'use_rag_fusion', 'use_reranking', 'use_cot', 'use_bm25', 'use_hybrid',
+]
+
+_TRAILING_PUNCTUATION = re.compile(r'[\s?？!！。.,，;；:：~～…]+$')
+
+def normalize_question(question: str) -> str:
+    """
+    規範化問題：全形轉半形（NFKC）、轉小寫、合併空白並去除結尾標點
+
+    Args:
+        question: 原始問題
+
+    Returns:
+        規範化後的問題
+    """
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = ' '.join(text.split())
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+def answer_settings_fingerprint(settings: Dict[str, Any]) -> str:
+    """
+    計算影響回答的設置指紋
+
+    Args:
+        settings: 當前設置字典
+
+    Returns:
+        指紋（sha256 十六進制字符串）
+    """
+    relevant = {key: settings.get(key) for key in ANSWER_SETTING_KEYS}
+    payload = json.dumps(relevant, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def make_answer_key(question: str, settings: Dict[str, Any], corpus_version: int) -> str:
+    """
+    計算快取鍵
+
+    Args:
+        question: 問題
+        settings: 當前設置字典
+        corpus_version: 知識庫版本
+
+    Returns:
+        快取鍵（sha256 十六進制字符串）
+    """
+    payload = json.dumps([normalize_question(question), answer_settings_fingerprint(settings), corpus_version],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class AnswerCache:
+    """問答快取類，記憶體層按條目數與大小做 LRU 淘汰，可選的 SQLite 持久層供多個進程共用"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化問答快取
+
+        Args:
+            config: 配置（見 settings.RAG_ANSWER_CACHE）
+        """
+        self.config = {**DEFAULT_ANSWER_CACHE_CONFIG, **(config or {})}
+        self.enabled = bool(self.config['ENABLED'])
+        self.persistent = self.enabled and bool(self.config['PERSISTENT'])
+        self.db_path = str(self.config['PATH'])
+        # 鍵 -> (過期時間, 大小, 回答, 相關文檔)，按訪問順序排列
+        self._entries: 'OrderedDict[str, Tuple[float, int, str, List[Dict[str, Any]]]]' = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.persistent:
+            self._initialize_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _initialize_table(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)')
+        finally:
+            conn.close()
+
+    def _store_in_memory(self, key: str, expires_at: float, size: int, answer: str,
+                         related_docs: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (expires_at, size, answer, related_docs)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.config['MAX_ENTRIES'] or self._bytes > self.config['MAX_BYTES']):
+                _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        查詢快取，先查記憶體層，未命中時查持久層並提升到記憶體層
+
+        Args:
+            key: 快取鍵（見 make_answer_key）
+
+        Returns:
+            (回答, 相關文檔列表)，未命中或已過期時返回 None
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2], entry[3]
+                del self._entries[key]
+                self._bytes -= entry[1]
+
+        if self.persistent:
+            row = None
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT payload, size, expires_at FROM answers WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                log_message(f"讀取問答快取時出錯: {str(e)}")
+            finally:
+                conn.close()
+            if row is not None:
+                payload, size, expires_at = row
+                answer, related_docs = json.loads(payload)
+                self._store_in_memory(key, expires_at, size, answer, related_docs)
+                with self._lock:
+                    self.hits += 1
+                    self.persistent_hits += 1
+                return answer, related_docs
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, answer: str, related_docs: List[Dict[str, Any]]) -> None:
+        """
+        寫入快取
+
+        Args:
+            key: 快取鍵
+            answer: 回答
+            related_docs: 相關文檔列表
+        """
+        if not self.enabled:
+            return
+        payload = json.dumps([answer, related_docs], ensure_ascii=False)
+        size = len(payload.encode('utf-8'))
+        now = time.time()
+        expires_at = now + self.config['TTL_SECONDS']
+        self._store_in_memory(key, expires_at, size, answer, related_docs)
+
+        if self.persistent:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, payload, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, expires_at, now)
+                )
+                self._evict_persistent(conn, now)
+            except sqlite3.Error as e:
+                log_message(f"寫入問答快取時出錯: {str(e)}")
+            finally:
+                conn.close()
+
+    def _evict_persistent(self, conn: sqlite3.Connection, now: float) -> None:
+        """刪除已過期的條目，仍超出 PERSISTENT_MAX_BYTES 時按 last_access 淘汰至上限的 90%"""
+        conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        if total <= self.config['PERSISTENT_MAX_BYTES']:
+            return
+        target = self.config['PERSISTENT_MAX_BYTES'] * 0.9
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM answers ORDER BY last_access"):
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM answers WHERE key = ?", to_delete)
+        with self._lock:
+            self.evictions += len(to_delete)
+
+    def clear(self) -> None:
+        """清空兩層快取與計數器"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.persistent_hits = self.misses = self.evictions = 0
+        if self.persistent:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM answers")
+            finally:
+                conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取快取統計信息
+
+        Returns:
+            包含啟用狀態、命中/未命中/淘汰次數、命中率與各層條目數的字典
+        """
+        persistent_entries = 0
+        if self.persistent:
+            conn = self._connect()
+            try:
+                persistent_entries = conn.execute(
+                    "SELECT COUNT(*) FROM answers WHERE expires_at > ?", (time.time(),)
+                ).fetchone()[0]
+            finally:
+                conn.close()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'persistent': self.persistent,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'persistent_entries': persistent_entries,
+                'ttl_seconds': self.config['TTL_SECONDS'],
+            }
@@ -0,0 +1,113 @@
+"""
+Batch Query - 批量問答
+按批次準備問題（快取查找、批量嵌入與檢索），以有界並發調用 LLM，回答完成一個即輸出一個
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_BATCH_QUERY_CONFIG = {
+    'MAX_QUESTIONS': 5000,
+    'CHUNK_SIZE': 64,
+    'LLM_CONCURRENCY': 8,
+}
+
+class BatchQueryRunner:
+    """
+    批量問答執行器類
+
+    問題按 CHUNK_SIZE 分批準備，上一批的 LLM 調用進行期間準備下一批；
+    等待 LLM 回答的問題超過一批時暫停準備，以限制記憶體中的上下文數量。
+    """
+
+    def __init__(self, prepare_batch: Callable[[List[str], bool], List[Dict[str, Any]]],
+                 finish: Callable[[str, Dict[str, Any], str], Tuple[str, List[Dict[str, Any]]]],
+                 config: Optional[Dict[str, Any]] = None):
+        """
+        初始化批量問答執行器
+
+        Args:
+            prepare_batch: 準備一批問題的函數，返回與問題順序一致的狀態（格式同 RAGManager._prepare_query）
+            finish: 處理 LLM 回答的函數（格式同 RAGManager._finish_query）
+            config: 配置（見 settings.RAG_BATCH_QUERY）
+        """
+        self.prepare_batch = prepare_batch
+        self.finish = finish
+        self.config = {**DEFAULT_BATCH_QUERY_CONFIG, **(config or {})}
+
+    def run(self, questions: List[str], use_different_strategy: bool = False,
+            max_concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        執行批量問答
+
+        Args:
+            questions: 問題列表
+            use_different_strategy: 是否使用不同的策略（與重新生成回答相同）
+            max_concurrency: 同時進行的 LLM 調用數，不超過 LLM_CONCURRENCY
+
+        Returns:
+            結果迭代器，按完成順序輸出 {'index', 'question', 'answer', 'related_docs'}，
+            單個問題失敗時輸出 {'index', 'question', 'error'}，不影響其他問題
+        """
+        concurrency = self.config['LLM_CONCURRENCY']
+        if max_concurrency:
+            concurrency = min(concurrency, int(max_concurrency))
+        concurrency = max(1, concurrency)
+        chunk_size = max(1, int(self.config['CHUNK_SIZE']))
+        started = time.perf_counter()
+        log_message(f"開始批量問答：{len(questions)} 個問題，LLM 並發數 {concurrency}")
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='rag-batch-llm')
+        # LLM 調用 -> (問題序號, 問題, 準備好的狀態)
+        pending: Dict[Future, Tuple[int, str, Dict[str, Any]]] = {}
+        try:
+            for offset in range(0, len(questions), chunk_size):
+                chunk = questions[offset:offset + chunk_size]
+                try:
+                    prepared_list = self.prepare_batch(chunk, use_different_strategy)
+                except Exception as e:
+                    log_message(f"準備第 {offset + 1}-{offset + len(chunk)} 個問題時出錯: {str(e)}")
+                    for index, question in enumerate(chunk, offset):
+                        yield {'index': index, 'question': question, 'error': str(e)}
+                    continue
+
+                for index, (question, prepared) in enumerate(zip(chunk, prepared_list), offset):
+                    if 'result' in prepared:
+                        answer, related_docs = prepared['result']
+                        yield {'index': index, 'question': question, 'answer': answer, 'related_docs': related_docs}
+                        continue
+                    future = executor.submit(
+                        prepared['chain'].invoke, {"context": prepared['context'], "question": question}
+                    )
+                    pending[future] = (index, question, prepared)
+
+                yield from self._collect(pending, block=False)
+                while len(pending) > chunk_size:
+                    yield from self._collect(pending, block=True)
+
+            while pending:
+                yield from self._collect(pending, block=True)
+        finally:
+            # 客戶端中途斷開時不等待剩餘的 LLM 調用
+            executor.shutdown(wait=False, cancel_futures=True)
+        log_message(f"批量問答完成：{len(questions)} 個問題，耗時 {time.perf_counter() - started:.1f} 秒")
+
+    def _collect(self, pending: Dict[Future, Tuple[int, str, Dict[str, Any]]],
+                 block: bool) -> Iterator[Dict[str, Any]]:
+        if block:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in pending if future.done()]
+        for future in done:
+            index, question, prepared = pending.pop(future)
+            try:
+                answer, related_docs = self.finish(question, prepared, future.result())
+                yield {'index': index, 'question': question, 'answer': answer, 'related_docs': related_docs}
+            except Exception as e:
+                log_message(f"回答第 {index + 1} 個問題時出錯: {str(e)}")
+                yield {'index': index, 'question': question, 'error': str(e)}
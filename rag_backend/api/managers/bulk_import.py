@@ -0,0 +1,292 @@
+"""
+Bulk Import - 批量導入文件
+從 zip/tar 壓縮包或伺服器目錄中逐個流式解出文件，批量創建 File 記錄並分批加入攝取佇列
+"""
+import os
+import tarfile
+import uuid
+import zipfile
+from typing import Callable, Dict, Any, IO, Iterator, List, Optional, Tuple
+
+from api.managers.document_parser import LOADERS
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_BULK_IMPORT_CONFIG = {
+    'MAX_FILES': 10000,
+    'MAX_TOTAL_BYTES': 10 * 1024 * 1024 * 1024,
+    'BULK_CREATE_SIZE': 200,
+    'ALLOWED_DIRECTORIES': [],
+}
+
+ALLOWED_EXTENSIONS = set(LOADERS)
+
+class BulkImportError(Exception):
+    """批量導入的輸入無效（壓縮包格式錯誤、目錄不允許等）"""
+
+def _extension(name: str) -> str:
+    return os.path.splitext(name)[1].lower().replace('.', '')
+
+def _is_hidden(name: str) -> bool:
+    # 略過 macOS 的 __MACOSX 資源檔與隱藏檔
+    parts = name.replace('\\', '/').split('/')
+    return any(part.startswith('.') or part == '__MACOSX' for part in parts if part)
+
+def iter_zip_members(archive: IO[bytes]) -> Iterator[Tuple[str, int, Callable[[], IO[bytes]]]]:
+    """
+    逐個列出 zip 成員（只讀取中央目錄，成員內容按需解壓）
+
+    Args:
+        archive: 可隨機存取的壓縮包文件對象
+
+    Returns:
+        (成員名稱, 解壓後大小, 打開成員的函數) 迭代器
+    """
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            yield info.filename, info.file_size, (lambda info=info: zf.open(info))
+
+def iter_tar_members(archive: IO[bytes]) -> Iterator[Tuple[str, int, Callable[[], IO[bytes]]]]:
+    """
+    以流模式逐個讀取 tar 成員（支援 gz/bz2/xz 壓縮），不需要隨機存取
+
+    Args:
+        archive: 壓縮包文件對象
+
+    Returns:
+        (成員名稱, 大小, 打開成員的函數) 迭代器；成員必須在迭代到下一個之前讀取
+    """
+    with tarfile.open(fileobj=archive, mode='r|*') as tf:
+        for member in tf:
+            # 只處理普通文件，略過目錄、符號連結與設備文件
+            if not member.isfile():
+                continue
+            yield member.name, member.size, (lambda member=member: tf.extractfile(member))
+
+def iter_directory_members(root: str) -> Iterator[Tuple[str, int, Callable[[], IO[bytes]]]]:
+    """
+    遞歸列出目錄中的文件（不跟隨符號連結）
+
+    Args:
+        root: 目錄路徑
+
+    Returns:
+        (相對路徑, 大小, 打開文件的函數) 迭代器
+    """
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=False):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            yield os.path.relpath(path, root), os.path.getsize(path), (lambda path=path: open(path, 'rb'))
+
+def open_archive_members(archive: Any, filename: str) -> Iterator[Tuple[str, int, Callable[[], IO[bytes]]]]:
+    """
+    按文件名選擇 zip 或 tar 讀取方式
+
+    Args:
+        archive: 上傳的壓縮包（Django UploadedFile 或文件對象）
+        filename: 壓縮包文件名
+
+    Returns:
+        成員迭代器
+    """
+    lower = filename.lower()
+    if lower.endswith('.zip'):
+        if not zipfile.is_zipfile(archive):
+            raise BulkImportError("無效的 zip 壓縮包")
+        archive.seek(0)
+        return iter_zip_members(archive)
+    if lower.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')):
+        return iter_tar_members(archive)
+    raise BulkImportError("只支持 zip 與 tar（.tar/.tar.gz/.tgz/.tar.bz2/.tar.xz）壓縮包")
+
+class BulkImporter:
+    """批量導入器類，負責流式保存成員文件、批量創建 File 記錄並加入攝取佇列"""
+
+    def __init__(self, enqueue_many: Callable[..., int], config: Optional[Dict[str, Any]] = None):
+        """
+        初始化批量導入器
+
+        Args:
+            enqueue_many: 批量加入攝取佇列的函數，接收 [(文件ID, 文件路徑), ...] 與關鍵字參數 owner
+            config: 配置（見 settings.RAG_BULK_IMPORT）
+        """
+        self.enqueue_many = enqueue_many
+        self.config = {**DEFAULT_BULK_IMPORT_CONFIG, **(config or {})}
+
+    def resolve_directory(self, path: str) -> str:
+        """
+        檢查目錄是否位於 ALLOWED_DIRECTORIES 之下
+
+        Args:
+            path: 伺服器端目錄路徑
+
+        Returns:
+            解析後的絕對路徑
+        """
+        allowed_roots = [os.path.realpath(str(root)) for root in self.config['ALLOWED_DIRECTORIES']]
+        if not allowed_roots:
+            raise BulkImportError("未配置允許導入的伺服器目錄（RAG_BULK_IMPORT['ALLOWED_DIRECTORIES']）")
+        resolved = os.path.realpath(path)
+        if not any(resolved == root or resolved.startswith(root + os.sep) for root in allowed_roots):
+            raise BulkImportError(f"目錄不在允許導入的範圍內: {path}")
+        if not os.path.isdir(resolved):
+            raise BulkImportError(f"目錄不存在: {path}")
+        return resolved
+
+    def import_members(self, members: Iterator[Tuple[str, int, Callable[[], IO[bytes]]]],
+                       source: str, name: str, owner: str = '') -> Dict[str, Any]:
+        """
+        導入一組成員文件
+
+        每累積 BULK_CREATE_SIZE 個文件就以 bulk_create 寫入 File 記錄並加入攝取佇列，
+        攝取在解壓仍在進行時就已開始。
+
+        Args:
+            members: 成員迭代器（見 iter_*_members）
+            source: 來源類型（archive 或 directory）
+            name: 壓縮包文件名或目錄路徑
+            owner: 提交者，用於攝取佇列的公平調度
+
+        Returns:
+            {'batch_id': 批次ID, 'total_files': 導入文件數, 'skipped_files': 略過的成員數}
+        """
+        from django.apps import apps
+        from django.core.files import File as DjangoFile
+        from django.core.files.storage import default_storage
+
+        File = apps.get_model('api', 'File')
+        IngestionBatch = apps.get_model('api', 'IngestionBatch')
+
+        batch = IngestionBatch.objects.create(source=source, name=name)
+        pending: List[Any] = []
+        total_files = 0
+        skipped_files = 0
+        total_bytes = 0
+
+        def flush() -> None:
+            if pending:
+                File.objects.bulk_create(pending)
+                self.enqueue_many(
+                    [(str(file_obj.id), default_storage.path(file_obj.file.name)) for file_obj in pending], owner=owner
+                )
+                pending.clear()
+            IngestionBatch.objects.filter(id=batch.id).update(total_files=total_files, skipped_files=skipped_files)
+
+        try:
+            for member_name, size, open_member in members:
+                basename = os.path.basename(member_name.replace('\\', '/'))
+                file_extension = _extension(basename)
+                if not basename or _is_hidden(member_name) or file_extension not in ALLOWED_EXTENSIONS:
+                    skipped_files += 1
+                    continue
+                if total_files >= self.config['MAX_FILES'] or total_bytes + size > self.config['MAX_TOTAL_BYTES']:
+                    skipped_files += 1
+                    continue
+
+                try:
+                    with open_member() as stream:
+                        content = DjangoFile(stream, name=basename)
+                        content.size = size
+                        # 以文件ID為前綴避免同名覆蓋，存儲按塊寫入，不會把整個成員讀入記憶體
+                        file_id = uuid.uuid4()
+                        stored_name = default_storage.save(f"uploads/{file_id.hex}_{basename}", content)
+                except Exception as e:
+                    log_message(f"導入成員 {member_name} 時出錯: {str(e)}")
+                    skipped_files += 1
+                    continue
+
+                total_files += 1
+                total_bytes += size
+                pending.append(File(
+                    id=file_id,
+                    original_filename=basename,
+                    file=stored_name,
+                    file_type=file_extension,
+                    file_size=size,
+                    status='processing',
+                    batch=batch
+                ))
+                if len(pending) >= self.config['BULK_CREATE_SIZE']:
+                    flush()
+        finally:
+            # 中途出錯時已解出的文件仍會寫入並處理，批次標記為解壓結束以便進度能夠完成
+            flush()
+            IngestionBatch.objects.filter(id=batch.id).update(extraction_done=True)
+
+        log_message(f"批量導入 {name} 完成：{total_files} 個文件已加入攝取佇列，略過 {skipped_files} 個")
+        return {'batch_id': str(batch.id), 'total_files': total_files, 'skipped_files': skipped_files}
+
+    def import_archive(self, archive: Any, filename: str, owner: str = '') -> Dict[str, Any]:
+        """
+        導入上傳的壓縮包
+
+        Args:
+            archive: 上傳的壓縮包（大文件由 Django 暫存於磁盤，不會整體讀入記憶體）
+            filename: 壓縮包文件名
+            owner: 提交者
+
+        Returns:
+            見 import_members
+        """
+        try:
+            return self.import_members(open_archive_members(archive, filename), 'archive', filename, owner)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise BulkImportError(f"無法讀取壓縮包: {str(e)}")
+
+    def import_directory(self, path: str, owner: str = '') -> Dict[str, Any]:
+        """
+        導入伺服器端目錄（文件會複製到上傳目錄，刪除 File 記錄不影響原始文件）
+
+        Args:
+            path: 目錄路徑，必須位於 ALLOWED_DIRECTORIES 之下
+            owner: 提交者
+
+        Returns:
+            見 import_members
+        """
+        root = self.resolve_directory(path)
+        return self.import_members(iter_directory_members(root), 'directory', root, owner)
+
+def batch_progress(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    匯總批次中各文件的處理狀態
+
+    Args:
+        batch_id: 批次ID
+
+    Returns:
+        批次進度字典，批次不存在時返回 None
+    """
+    from django.apps import apps
+    from django.db.models import Count
+
+    IngestionBatch = apps.get_model('api', 'IngestionBatch')
+    batch = IngestionBatch.objects.filter(id=batch_id).first()
+    if batch is None:
+        return None
+
+    counts = {status: 0 for status in ['uploading', 'processing', 'processed', 'cancelled', 'error']}
+    for row in batch.files.values('status').annotate(total=Count('id')):
+        counts[row['status']] = row['total']
+    finished = counts['processed'] + counts['cancelled'] + counts['error']
+    in_progress = counts['uploading'] + counts['processing']
+    return {
+        'batch_id': str(batch.id),
+        'source': batch.source,
+        'name': batch.name,
+        'total_files': batch.total_files,
+        'skipped_files': batch.skipped_files,
+        'created_at': batch.created_at,
+        **counts,
+        'extraction_done': batch.extraction_done,
+        'progress': finished / max(finished + in_progress, 1),
+        'is_complete': batch.extraction_done and in_progress == 0,
+    }
@@ -0,0 +1,110 @@
+"""
+Cancellation - 文件處理取消登記表
+以進程內事件傳遞取消信號，處理過程中的取消檢查幾乎無開銷；跨進程的取消由節流的資料庫檢查兜底
+"""
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+class CancellationRegistry:
+    """取消登記表類，為每個處理中的文件保存一個取消事件"""
+
+    def __init__(self, db_check: Optional[Callable[[str], bool]] = None, db_check_interval: float = 5.0):
+        """
+        初始化取消登記表
+
+        Args:
+            db_check: 查詢資料庫中文件是否已取消的函數，用於感知其他進程發出的取消
+            db_check_interval: 同一文件兩次資料庫檢查之間的最短間隔（秒），0 表示每次都查詢
+        """
+        self.db_check = db_check
+        self.db_check_interval = db_check_interval
+        self._events: Dict[str, threading.Event] = {}
+        self._last_db_check: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, file_id: str) -> threading.Event:
+        """
+        開始處理文件時登記，返回該文件的取消事件
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            取消事件
+        """
+        file_id = str(file_id)
+        with self._lock:
+            event = self._events.get(file_id)
+            if event is None:
+                event = threading.Event()
+                self._events[file_id] = event
+            self._last_db_check[file_id] = time.monotonic()
+            return event
+
+    def unregister(self, file_id: str) -> None:
+        """
+        文件處理結束時移除登記
+
+        Args:
+            file_id: 文件ID
+        """
+        file_id = str(file_id)
+        with self._lock:
+            self._events.pop(file_id, None)
+            self._last_db_check.pop(file_id, None)
+
+    def cancel(self, file_id: str) -> bool:
+        """
+        發出取消信號
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            文件是否正在本進程中處理
+        """
+        with self._lock:
+            event = self._events.get(str(file_id))
+        if event is None:
+            return False
+        event.set()
+        log_message(f"已向處理中的文件 {file_id} 發出取消信號")
+        return True
+
+    def is_cancelled(self, file_id: str) -> bool:
+        """
+        檢查文件是否已被取消
+
+        優先讀取進程內事件；已登記的文件距上次資料庫檢查超過 db_check_interval 時才查詢資料庫，
+        未登記的文件每次都查詢資料庫。
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            是否已取消
+        """
+        file_id = str(file_id)
+        with self._lock:
+            event = self._events.get(file_id)
+            if event is not None and event.is_set():
+                return True
+            if self.db_check is None:
+                return False
+            if event is not None:
+                now = time.monotonic()
+                if now - self._last_db_check.get(file_id, float('-inf')) < self.db_check_interval:
+                    return False
+                self._last_db_check[file_id] = now
+
+        if not self.db_check(file_id):
+            return False
+        if event is not None:
+            event.set()
+        return True
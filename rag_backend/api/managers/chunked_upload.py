@@ -0,0 +1,318 @@
+"""
+Chunked Upload - 可續傳的分片上傳
+按偏移量把分片直接寫入磁盤上的暫存文件，完成時校驗 sha256、移入上傳目錄並立即加入攝取佇列
+"""
+import hashlib
+import os
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, Any, IO, Optional
+
+from api.managers.document_parser import LOADERS
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_CHUNKED_UPLOAD_CONFIG = {
+    'TEMP_DIR': 'upload_parts',
+    'MAX_FILE_SIZE': 2 * 1024 * 1024 * 1024,
+    'MAX_PART_SIZE': 64 * 1024 * 1024,
+    'SESSION_TTL_HOURS': 24,
+}
+
+# 讀寫磁盤時每次處理的字節數，分片與校驗都不會整體讀入記憶體
+COPY_BLOCK_SIZE = 1024 * 1024
+
+class ChunkedUploadError(Exception):
+    """分片上傳請求無效（會話不存在或已結束、大小超限、校驗和不符等）"""
+
+class UploadOffsetError(ChunkedUploadError):
+    """分片偏移量超出已接收的字節數，客戶端應從 expected_offset 續傳"""
+
+    def __init__(self, message: str, expected_offset: int):
+        super().__init__(message)
+        self.expected_offset = expected_offset
+
+class ChunkedUploadManager:
+    """分片上傳管理器類，負責上傳會話的創建、分片寫入、完成與放棄"""
+
+    def __init__(self, enqueue_file: Callable[..., str], config: Optional[Dict[str, Any]] = None):
+        """
+        初始化分片上傳管理器
+
+        Args:
+            enqueue_file: 把文件加入攝取佇列的函數，接收 (文件ID, 文件路徑) 與關鍵字參數 owner
+            config: 配置（見 settings.RAG_CHUNKED_UPLOAD）
+        """
+        self.enqueue_file = enqueue_file
+        self.config = {**DEFAULT_CHUNKED_UPLOAD_CONFIG, **(config or {})}
+        self.temp_dir = str(self.config['TEMP_DIR'])
+        # 同一進程內同一會話的分片與完成操作串行執行；跨進程的並發寫入由 received_bytes 的條件更新檢測
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._session_locks[session_id] = lock
+            return lock
+
+    def _release_lock(self, session_id: str) -> None:
+        with self._locks_guard:
+            self._session_locks.pop(session_id, None)
+
+    def part_path(self, session_id: str) -> str:
+        """
+        獲取會話暫存文件的路徑
+
+        Args:
+            session_id: 會話ID
+
+        Returns:
+            暫存文件路徑
+        """
+        return os.path.join(self.temp_dir, f"{session_id}.part")
+
+    def _remove_part(self, session_id: str) -> None:
+        try:
+            os.remove(self.part_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _get_active_session(self, session_id: str) -> Any:
+        from django.apps import apps
+
+        UploadSession = apps.get_model('api', 'UploadSession')
+        session = UploadSession.objects.filter(id=session_id).first()
+        if session is None:
+            raise ChunkedUploadError("上傳會話不存在")
+        if session.status != 'active':
+            raise ChunkedUploadError(f"上傳會話已結束（{session.status}）")
+        return session
+
+    def init_session(self, filename: str, total_size: int, sha256: str = '') -> Any:
+        """
+        創建上傳會話並預先建立空的暫存文件
+
+        Args:
+            filename: 原始文件名
+            total_size: 文件總字節數
+            sha256: 預期的 sha256（可選，提供時最後一個分片寫入後自動完成）
+
+        Returns:
+            UploadSession 實例
+        """
+        from django.apps import apps
+
+        UploadSession = apps.get_model('api', 'UploadSession')
+
+        basename = os.path.basename(filename.replace('\\', '/'))
+        file_extension = os.path.splitext(basename)[1].lower().replace('.', '')
+        if file_extension not in LOADERS:
+            raise ChunkedUploadError(f"不支持的文件類型: {file_extension}")
+        if total_size <= 0 or total_size > self.config['MAX_FILE_SIZE']:
+            raise ChunkedUploadError(f"文件大小必須在 1 到 {self.config['MAX_FILE_SIZE']} 字節之間")
+
+        self.cleanup_expired()
+
+        session = UploadSession.objects.create(
+            original_filename=basename,
+            file_type=file_extension,
+            total_size=total_size,
+            sha256=(sha256 or '').lower()
+        )
+        os.makedirs(self.temp_dir, exist_ok=True)
+        open(self.part_path(str(session.id)), 'wb').close()
+        log_message(f"已創建上傳會話 {session.id}: {basename} ({total_size} 字節)")
+        return session
+
+    def append_part(self, session_id: str, offset: int, stream: IO[bytes], length: int, owner: str = '') -> Any:
+        """
+        把分片寫入暫存文件的 offset 處
+
+        offset 小於已接收字節數時視為重傳，先截斷再寫入；大於時拒絕並返回應續傳的偏移量。
+        連接中斷時已寫入的部分會被保留，客戶端可從新的 received_bytes 續傳。
+        received_bytes 只在仍等於讀取時的值時更新：多個 Web 進程同時寫入同一會話時，
+        後完成的請求收到 UploadOffsetError，由客戶端按 expected_offset 重傳（暫存文件內容在完成時以 sha256 校驗）。
+
+        Args:
+            session_id: 會話ID
+            offset: 分片在文件中的起始偏移量
+            stream: 請求體流
+            length: 分片字節數（Content-Length）
+            owner: 提交者，自動完成時用於攝取佇列的公平調度
+
+        Returns:
+            更新後的 UploadSession 實例
+
+        Raises:
+            UploadOffsetError: 偏移量無效，或會話已被另一個請求更新
+            ChunkedUploadError: 會話無效、分片大小超限或分片不完整
+        """
+        from django.apps import apps
+        from django.utils import timezone
+
+        UploadSession = apps.get_model('api', 'UploadSession')
+        session_id = str(session_id)
+        with self._lock_for(session_id):
+            session = self._get_active_session(session_id)
+            if offset < 0 or offset > session.received_bytes:
+                raise UploadOffsetError(
+                    f"偏移量 {offset} 無效，應從 {session.received_bytes} 續傳",
+                    session.received_bytes
+                )
+            if length <= 0 or length > self.config['MAX_PART_SIZE']:
+                raise ChunkedUploadError(f"分片大小必須在 1 到 {self.config['MAX_PART_SIZE']} 字節之間")
+            if offset + length > session.total_size:
+                raise ChunkedUploadError("分片超出文件總大小")
+
+            written = 0
+            try:
+                with open(self.part_path(session_id), 'r+b') as part_file:
+                    part_file.seek(offset)
+                    part_file.truncate()
+                    while written < length:
+                        block = stream.read(min(COPY_BLOCK_SIZE, length - written))
+                        if not block:
+                            break
+                        part_file.write(block)
+                        written += len(block)
+            finally:
+                updated = UploadSession.objects.filter(
+                    id=session_id, status='active', received_bytes=session.received_bytes
+                ).update(received_bytes=offset + written, updated_at=timezone.now())
+
+            if not updated:
+                current = UploadSession.objects.filter(id=session_id).values_list('received_bytes', flat=True).first()
+                raise UploadOffsetError(
+                    f"上傳會話已被另一個請求更新，應從 {current} 續傳",
+                    current or 0
+                )
+            session.received_bytes = offset + written
+            if written < length:
+                raise ChunkedUploadError(f"分片不完整：收到 {written} / {length} 字節，請從 {session.received_bytes} 續傳")
+
+            # 已提供校驗和時，最後一個分片寫入後立即完成，處理無需等待額外的請求
+            if session.received_bytes == session.total_size and session.sha256:
+                return self._finalize(session, session.sha256, owner)
+            return session
+
+    def finalize(self, session_id: str, sha256: str = '', owner: str = '') -> Any:
+        """
+        校驗並完成上傳，創建 File 記錄並加入攝取佇列
+
+        Args:
+            session_id: 會話ID
+            sha256: 文件的 sha256，未提供時使用創建會話時的值
+            owner: 提交者，用於攝取佇列的公平調度
+
+        Returns:
+            完成後的 UploadSession 實例（session.file 為創建的 File）
+        """
+        session_id = str(session_id)
+        with self._lock_for(session_id):
+            session = self._get_active_session(session_id)
+            return self._finalize(session, (sha256 or session.sha256).lower(), owner)
+
+    def _finalize(self, session: Any, expected_sha256: str, owner: str) -> Any:
+        from django.apps import apps
+        from django.core.files.storage import default_storage
+
+        File = apps.get_model('api', 'File')
+        session_id = str(session.id)
+
+        if not expected_sha256:
+            raise ChunkedUploadError("完成上傳需要提供 sha256 校驗和")
+        if session.received_bytes != session.total_size:
+            raise ChunkedUploadError(f"上傳未完成：已接收 {session.received_bytes} / {session.total_size} 字節")
+
+        digest = hashlib.sha256()
+        with open(self.part_path(session_id), 'rb') as part_file:
+            for block in iter(lambda: part_file.read(COPY_BLOCK_SIZE), b''):
+                digest.update(block)
+        if digest.hexdigest() != expected_sha256:
+            # 無法判斷是哪個分片損壞，丟棄暫存文件，客戶端需要重新上傳
+            session.status = 'failed'
+            session.error = f"sha256 不符：預期 {expected_sha256}，實際 {digest.hexdigest()}"
+            session.save(update_fields=['status', 'error', 'updated_at'])
+            self._remove_part(session_id)
+            self._release_lock(session_id)
+            raise ChunkedUploadError(session.error)
+
+        # 暫存文件與上傳目錄位於同一存儲下，直接重命名而不複製
+        stored_name = f"uploads/{session.id.hex}_{session.original_filename}"
+        final_path = default_storage.path(stored_name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(self.part_path(session_id), final_path)
+
+        file_obj = File.objects.create(
+            original_filename=session.original_filename,
+            file=stored_name,
+            file_type=session.file_type,
+            file_size=session.total_size,
+            status='processing'
+        )
+        session.status = 'completed'
+        session.sha256 = expected_sha256
+        session.file = file_obj
+        session.save(update_fields=['status', 'sha256', 'file', 'updated_at'])
+        self._release_lock(session_id)
+
+        try:
+            job_id = self.enqueue_file(str(file_obj.id), final_path, owner=owner)
+        except Exception:
+            file_obj.status = 'error'
+            file_obj.save(update_fields=['status'])
+            raise
+        log_message(f"上傳會話 {session_id} 已完成，文件 {file_obj.id} 已加入攝取佇列（任務 {job_id}）")
+        return session
+
+    def abort(self, session_id: str) -> Any:
+        """
+        放棄上傳會話並刪除暫存文件
+
+        Args:
+            session_id: 會話ID
+
+        Returns:
+            UploadSession 實例
+        """
+        session_id = str(session_id)
+        with self._lock_for(session_id):
+            session = self._get_active_session(session_id)
+            session.status = 'aborted'
+            session.save(update_fields=['status', 'updated_at'])
+            self._remove_part(session_id)
+        self._release_lock(session_id)
+        log_message(f"上傳會話 {session_id} 已放棄")
+        return session
+
+    def cleanup_expired(self) -> int:
+        """
+        放棄超過 SESSION_TTL_HOURS 未更新的會話並刪除其暫存文件
+
+        Returns:
+            清理的會話數量
+        """
+        from django.apps import apps
+        from django.utils import timezone
+
+        UploadSession = apps.get_model('api', 'UploadSession')
+        cutoff = timezone.now() - timedelta(hours=self.config['SESSION_TTL_HOURS'])
+        expired_ids = list(
+            UploadSession.objects.filter(status='active', updated_at__lt=cutoff).values_list('id', flat=True)
+        )
+        if not expired_ids:
+            return 0
+        UploadSession.objects.filter(id__in=expired_ids, status='active').update(
+            status='aborted', error='會話已過期'
+        )
+        for session_id in expired_ids:
+            self._remove_part(str(session_id))
+            self._release_lock(str(session_id))
+        log_message(f"已清理 {len(expired_ids)} 個過期的上傳會話")
+        return len(expired_ids)
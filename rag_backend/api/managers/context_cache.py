@@ -0,0 +1,202 @@
+"""
+Context Cache - 文本塊上下文持久化快取
+以 (LLM 模型, 提示版本, 窗口哈希, 文本塊哈希) 為鍵保存已生成的上下文，重新處理文件時避免重複調用 LLM
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_CACHE_CONFIG = {
+    'ENABLED': True,
+    'PATH': 'context_cache.sqlite3',
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'EVICT_TO_RATIO': 0.9,
+}
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def make_cache_key(llm_model: str, prompt_version: str, window: str, chunk: str) -> str:
+    """
+    計算快取鍵
+
+    Args:
+        llm_model: LLM 模型名稱
+        prompt_version: 提示版本（提示內容變更時需遞增）
+        window: 提供給 LLM 的文檔窗口
+        chunk: 文本塊內容
+
+    Returns:
+        快取鍵（sha256 十六進制字符串）
+    """
+    return _sha256("\0".join([llm_model or '', prompt_version, _sha256(window), _sha256(chunk)]))
+
+class ContextCache:
+    """上下文快取類，使用 SQLite 保存並按大小以最近最少使用（LRU）策略淘汰"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化上下文快取
+
+        Args:
+            config: 配置（見 settings.RAG_CONTEXT_CACHE）
+        """
+        self.config = {**DEFAULT_CACHE_CONFIG, **(config or {})}
+        self.enabled = bool(self.config['ENABLED'])
+        self.db_path = str(self.config['PATH'])
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._initialize_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _initialize_table(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_contexts (
+                key TEXT PRIMARY KEY,
+                context TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS chunk_contexts_last_access ON chunk_contexts (last_access)')
+        finally:
+            conn.close()
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """
+        批量查詢快取
+
+        Args:
+            keys: 快取鍵列表
+
+        Returns:
+            {快取鍵: 上下文}，只包含命中的鍵
+        """
+        if not self.enabled or not keys:
+            return {}
+
+        found: Dict[str, str] = {}
+        conn = self._connect()
+        try:
+            # SQLite 默認最多 999 個綁定參數，分批查詢
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, context FROM chunk_contexts WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE chunk_contexts SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+        except sqlite3.Error as e:
+            log_message(f"讀取上下文快取時出錯: {str(e)}")
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, str]]) -> None:
+        """
+        批量寫入快取，空上下文不寫入，寫入後超出大小上限時淘汰最久未使用的條目
+
+        Args:
+            entries: (快取鍵, 上下文) 的可迭代對象
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        rows = [(key, context, len(context.encode('utf-8')), now, now) for key, context in entries if context]
+        if not rows:
+            return
+
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunk_contexts (key, context, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            log_message(f"寫入上下文快取時出錯: {str(e)}")
+        finally:
+            conn.close()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """超出 MAX_BYTES 時按 last_access 淘汰，直到總大小降至 MAX_BYTES * EVICT_TO_RATIO"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunk_contexts").fetchone()[0]
+        if total <= self.config['MAX_BYTES']:
+            return
+
+        target = self.config['MAX_BYTES'] * self.config['EVICT_TO_RATIO']
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size FROM chunk_contexts ORDER BY last_access"):
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM chunk_contexts WHERE key = ?", to_delete)
+        with self._lock:
+            self.evictions += len(to_delete)
+        log_message(f"上下文快取超出大小上限，已淘汰 {len(to_delete)} 個條目")
+
+    def clear(self) -> None:
+        """清空快取與計數器"""
+        if self.enabled:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM chunk_contexts")
+            finally:
+                conn.close()
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取快取統計信息
+
+        Returns:
+            包含啟用狀態、命中/未命中/淘汰次數、命中率、條目數與總大小的字典
+        """
+        entries, size_bytes = 0, 0
+        if self.enabled:
+            conn = self._connect()
+            try:
+                entries, size_bytes = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chunk_contexts"
+                ).fetchone()
+            finally:
+                conn.close()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'size_bytes': size_bytes,
+                'max_bytes': self.config['MAX_BYTES'],
+            }
@@ -0,0 +1,502 @@
+"""
+Context Generator - 上下文嵌入生成
+以有界並發調用 LLM 為文本塊生成上下文描述，按 RPM/TPM 限流並在 429、5xx 與連接錯誤時抖動重試
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+
+from api.managers.context_cache import ContextCache, make_cache_key
+from api.managers.llm_client import LLMUnavailableError
+from api.managers.rate_limiter import TokenBucketRateLimiter
+from api.managers.token_counter import count_tokens
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_CONTEXT_CONFIG = {
+    'CONCURRENCY': 4,
+    'REQUESTS_PER_MINUTE': 500,
+    'TOKENS_PER_MINUTE': 200000,
+    'EXPECTED_OUTPUT_TOKENS': 150,
+    'MAX_RETRIES': 5,
+    'RETRY_BASE_SECONDS': 1,
+    'RETRY_MAX_SECONDS': 60,
+    'CANCEL_CHECK_SECONDS': 2,
+    'BATCH_MODE': True,
+    'BATCH_SIZE': 16,
+    'BATCH_WINDOW_CHARS': 24000,
+    'WINDOW_MARGIN_CHARS': 2000,
+}
+
+# 提示版本，修改對應提示內容時需遞增，使舊的快取條目失效
+SINGLE_PROMPT_VERSION = 'single-1'
+BATCH_PROMPT_VERSION = 'batch-1'
+
+# 與逐塊模式一致：文檔不超過此長度時直接提供完整文檔
+MAX_FULL_DOCUMENT_CHARS = 10000
+
+class ContextGenerationError(Exception):
+    """上下文生成失敗（重試次數用盡、請求被拒絕或斷路器打開），文件處理應失敗並由攝取佇列重試"""
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """判斷異常是否為 429 限流錯誤（有狀態碼時只看狀態碼，錯誤信息中的數字可能與限流無關）"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429
+    return type(error).__name__ == 'RateLimitError'
+
+def _is_retryable_error(error: Exception) -> bool:
+    """429、5xx、連接錯誤與超時可以重試；其他錯誤（如上下文過長）重試也不會成功"""
+    if _is_rate_limit_error(error):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status >= 500
+    return (isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+            or type(error).__name__ in ('APIConnectionError', 'APITimeoutError'))
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """讀取 429 響應中的 Retry-After 頭（秒）"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def group_chunks_by_window(document: str, spans: List[Tuple[int, int]], batch_size: int,
+                           window_chars: int, margin: int) -> Iterator[Tuple[int, int, List[int]]]:
+    """
+    按共享的文檔窗口將文本塊分組
+
+    文本塊按順序掃描，只要加入後窗口（首塊起點前、末塊終點後各留 margin）不超過
+    window_chars 且組內數量不超過 batch_size，就歸入同一組。
+
+    Args:
+        document: 完整文檔內容
+        spans: 每個文本塊在文檔中的 (起始位置, 結束位置)
+        batch_size: 每組最多文本塊數
+        window_chars: 窗口最大字符數
+        margin: 窗口兩端額外保留的上下文字符數
+
+    Returns:
+        (窗口起點, 窗口終點, 文本塊索引列表) 的迭代器
+    """
+    if len(document) <= MAX_FULL_DOCUMENT_CHARS:
+        for offset in range(0, len(spans), batch_size):
+            yield 0, len(document), list(range(offset, min(offset + batch_size, len(spans))))
+        return
+
+    group: List[int] = []
+    window_start = window_end = 0
+    for index, (start, end) in enumerate(spans):
+        chunk_end = min(len(document), end + margin)
+        if group and (len(group) >= batch_size or max(window_end, chunk_end) - window_start > window_chars):
+            yield window_start, window_end, group
+            group = []
+        if not group:
+            window_start = max(0, start - margin)
+            window_end = chunk_end
+        group.append(index)
+        window_end = max(window_end, chunk_end)
+    if group:
+        yield window_start, window_end, group
+
+def _parse_batch_response(response: str, indices: List[int]) -> Dict[int, str]:
+    """
+    解析批量上下文生成的 JSON 回答，只保留有效的條目
+
+    Args:
+        response: LLM 回答
+        indices: 本批文本塊索引
+
+    Returns:
+        {文本塊索引: 上下文}，缺失或無效的索引不會出現在結果中
+    """
+    start, end = response.find('{'), response.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        payload = json.loads(response[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(payload, dict):
+        return {}
+
+    contexts = {}
+    for index in indices:
+        value = payload.get(str(index))
+        if isinstance(value, str) and value.strip():
+            contexts[index] = value.strip()
+    return contexts
+
+class ContextGenerator:
+    """上下文生成器類，負責並發、限流與重試地為文本塊生成上下文"""
+
+    def __init__(self, llm_client: Optional[any], config: Optional[Dict[str, Any]] = None,
+                 cache: Optional[ContextCache] = None):
+        """
+        初始化上下文生成器
+
+        Args:
+            llm_client: 共用的 LLM 客戶端（LLMClient）
+            config: 配置（見 settings.RAG_CONTEXT_GENERATION）
+            cache: 上下文快取，為 None 時不使用快取
+        """
+        self.llm_client = llm_client
+        self.cache = cache
+        self.config = {**DEFAULT_CONTEXT_CONFIG, **(config or {})}
+        # 限流器在所有文件之間共用，因為 API 配額是全局的
+        self.rate_limiter = TokenBucketRateLimiter(
+            self.config['REQUESTS_PER_MINUTE'],
+            self.config['TOKENS_PER_MINUTE']
+        )
+
+    @property
+    def llm(self) -> Optional[any]:
+        """當前的 LLM（更新 LLM 設置後自動使用新的模型）"""
+        return self.llm_client.llm if self.llm_client is not None else None
+
+    @property
+    def _llm_without_retries(self) -> Optional[any]:
+        """不帶 SDK 重試的當前 LLM，重試只由 _predict 負責"""
+        return getattr(self.llm_client, 'llm_without_retries', None) or self.llm
+
+    def build_prompt(self, window: str, chunk: str) -> str:
+        """
+        構建上下文生成提示
+
+        Args:
+            window: 文本塊所在的文檔內容（完整文檔或其窗口）
+            chunk: 文本塊內容
+
+        Returns:
+            提示文本
+        """
+        return f"""
+        <document>
+        {window}
+        </document>
+        Here is the chunk we want to situate within the whole document
+        <chunk>
+        {chunk}
+        </chunk>
+        Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else. The context should be in Traditional Chinese.
+        """
+
+    def build_batch_prompt(self, window: str, markers: List[Tuple[int, int]]) -> str:
+        """
+        構建批量上下文生成提示，文檔窗口只發送一次
+
+        文本塊不再重複發送，而是在窗口中以 [[C<索引>]] 標記其起始位置。
+
+        Args:
+            window: 文檔窗口內容
+            markers: (窗口內起始位置, 文本塊索引) 列表，按位置排序
+
+        Returns:
+            提示文本
+        """
+        parts = []
+        last = 0
+        for position, index in markers:
+            parts.append(window[last:position])
+            parts.append(f"[[C{index}]]")
+            last = position
+        parts.append(window[last:])
+        indices = ", ".join(f'"{index}"' for _, index in markers)
+        return f"""
+        <document>
+        {"".join(parts)}
+        </document>
+        The document above contains chunk markers of the form [[C<index>]]. Each chunk starts at its marker and runs for about one chunk length, overlapping slightly with the next chunk.
+        For each chunk, give a short succinct context to situate that chunk within the overall document for the purposes of improving search retrieval of the chunk. The contexts should be in Traditional Chinese.
+        Answer only with a JSON object whose keys are the chunk indices ({indices}) and whose values are the contexts, and nothing else.
+        """
+
+    def _predict(self, prompt: str, cancel_event: Optional[threading.Event] = None,
+                 expected_output_tokens: Optional[int] = None) -> str:
+        """
+        帶限流與抖動重試的 LLM 調用
+
+        使用不帶 SDK 重試的模型，429、5xx 與連接錯誤只在此處重試；429 同時讓共用的限流器退避。
+
+        Args:
+            prompt: 提示文本
+            cancel_event: 取消事件，設置後放棄重試
+            expected_output_tokens: 預估輸出令牌數，默認為 EXPECTED_OUTPUT_TOKENS
+
+        Returns:
+            LLM 回答，被取消時返回空字符串
+
+        Raises:
+            ContextGenerationError: 重試次數用盡、錯誤不可重試或斷路器打開
+        """
+        llm = self._llm_without_retries
+        if llm is None:
+            return ""
+        if expected_output_tokens is None:
+            expected_output_tokens = self.config['EXPECTED_OUTPUT_TOKENS']
+        estimated_tokens = count_tokens(prompt) + expected_output_tokens
+        for attempt in range(self.config['MAX_RETRIES'] + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                return ""
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                return llm.predict(prompt).strip()
+            except LLMUnavailableError as e:
+                raise ContextGenerationError(str(e)) from e
+            except Exception as e:
+                if not _is_retryable_error(e) or attempt >= self.config['MAX_RETRIES']:
+                    raise ContextGenerationError(f"生成上下文時出錯: {str(e)}") from e
+                # 指數退避加完全抖動，避免並發請求同時重試
+                cap = min(self.config['RETRY_MAX_SECONDS'], self.config['RETRY_BASE_SECONDS'] * (2 ** attempt))
+                delay = _retry_after_seconds(e) or random.uniform(0, cap)
+                if _is_rate_limit_error(e):
+                    self.rate_limiter.penalize(delay)
+                    log_message(f"上下文生成觸發限流 (429)，{delay:.1f} 秒後重試（第 {attempt + 1} 次）")
+                else:
+                    log_message(f"上下文生成出錯: {str(e)}，{delay:.1f} 秒後重試（第 {attempt + 1} 次）")
+                time.sleep(delay)
+        return ""
+
+    def generate_one(self, window: str, chunk: str) -> str:
+        """
+        為單個文本塊生成上下文
+
+        Args:
+            window: 文本塊所在的文檔內容
+            chunk: 文本塊內容
+
+        Returns:
+            生成的上下文描述
+        """
+        if self.llm is None:
+            return ""
+        return self._predict_single(0, window, chunk, None)[0]
+
+    def _llm_model(self) -> str:
+        """當前 LLM 的模型名稱，用於區分快取條目"""
+        return getattr(self.llm, 'model_name', None) or getattr(self.llm, 'model', None) or ''
+
+    def _cache_get(self, keys: List[str]) -> Dict[str, str]:
+        return self.cache.get_many(keys) if self.cache is not None else {}
+
+    def _cache_put(self, entries: List[Tuple[str, str]]) -> None:
+        if self.cache is not None:
+            self.cache.put_many(entries)
+
+    def _predict_single(self, index: int, window: str, chunk: str, cancel_event: threading.Event) -> Dict[int, str]:
+        """為單個文本塊生成上下文（優先讀取快取），返回 {索引: 上下文}"""
+        key = make_cache_key(self._llm_model(), SINGLE_PROMPT_VERSION, window, chunk)
+        cached = self._cache_get([key])
+        if key in cached:
+            return {index: cached[key]}
+        context = self._predict(self.build_prompt(window, chunk), cancel_event)
+        if context:
+            self._cache_put([(key, context)])
+        return {index: context}
+
+    def _predict_batch(self, document: str, window_start: int, window_end: int, indices: List[int],
+                       spans: List[Tuple[int, int]], cancel_event: threading.Event) -> Dict[int, str]:
+        """
+        以一次調用為一組文本塊生成上下文，無效或缺失的條目回退
+
+        回答只缺少部分條目時（例如輸出被截斷），先以只含缺失標記的批量提示重試一次；
+        仍然缺失的文本塊逐塊生成，每塊只發送自身附近的有界窗口，而不是整個批量窗口。
+
+        Args:
+            document: 完整文檔內容
+            window_start: 窗口起點
+            window_end: 窗口終點
+            indices: 本組文本塊索引
+            spans: 所有文本塊的 (起始位置, 結束位置)
+            cancel_event: 取消事件
+
+        Returns:
+            {文本塊索引: 上下文}
+        """
+        window = document[window_start:window_end]
+        model = self._llm_model()
+        keys = {index: make_cache_key(model, BATCH_PROMPT_VERSION, window, document[spans[index][0]:spans[index][1]])
+                for index in indices}
+        cached = self._cache_get(list(keys.values()))
+        contexts = {index: cached[key] for index, key in keys.items() if key in cached}
+        pending = [index for index in indices if index not in contexts]
+        if not pending:
+            return contexts
+
+        generated = self._predict_markers(window, window_start, pending, spans, cancel_event)
+        missing = [index for index in pending if index not in generated]
+        if 1 < len(missing) < len(pending) and not (cancel_event is not None and cancel_event.is_set()):
+            log_message(f"批量上下文回答缺少 {len(missing)}/{len(pending)} 個文本塊，以缺失的文本塊重試一次")
+            generated.update(self._predict_markers(window, window_start, missing, spans, cancel_event))
+            missing = [index for index in pending if index not in generated]
+
+        if missing and not (cancel_event is not None and cancel_event.is_set()):
+            log_message(f"批量上下文回答缺少 {len(missing)}/{len(pending)} 個文本塊，改為逐塊生成")
+            for index in missing:
+                start, end = spans[index]
+                generated[index] = self._predict(
+                    self.build_prompt(self.window_for_span(document, start, end), document[start:end]), cancel_event
+                )
+
+        # 被取消時的空結果不寫入快取
+        self._cache_put([(keys[index], context) for index, context in generated.items() if context])
+        contexts.update(generated)
+        return contexts
+
+    def _predict_markers(self, window: str, window_start: int, indices: List[int], spans: List[Tuple[int, int]],
+                         cancel_event: threading.Event) -> Dict[int, str]:
+        """以一次批量調用為窗口中的指定文本塊生成上下文，返回有效的 {文本塊索引: 上下文}"""
+        markers = [(spans[index][0] - window_start, index) for index in indices]
+        prompt = self.build_batch_prompt(window, markers)
+        try:
+            response = self._predict(prompt, cancel_event, self.config['EXPECTED_OUTPUT_TOKENS'] * len(indices))
+        except ContextGenerationError as e:
+            cause = e.__cause__
+            # 服務故障時逐塊生成也會失敗；只有請求本身被拒絕（如批量提示過長）才回退
+            if cause is None or isinstance(cause, LLMUnavailableError) or _is_retryable_error(cause):
+                raise
+            log_message(f"批量上下文生成請求被拒絕: {str(cause)}")
+            return {}
+        return _parse_batch_response(response, indices)
+
+    def generate(self, items: Sequence[Tuple[str, str]], should_cancel: Optional[Callable[[], bool]] = None) -> Optional[List[str]]:
+        """
+        並發為多個文本塊生成上下文，輸出順序與輸入一致
+
+        同時在途的請求不超過 CONCURRENCY 的兩倍。
+
+        Args:
+            items: (文檔窗口, 文本塊) 列表
+            should_cancel: 取消檢查函數，只在調用執行緒中按 CANCEL_CHECK_SECONDS 節流調用
+
+        Returns:
+            上下文列表，被取消時返回 None
+
+        Raises:
+            ContextGenerationError: 任一文本塊生成失敗
+        """
+        tasks = ((self._predict_single, (index, window, chunk)) for index, (window, chunk) in enumerate(items))
+        return self._run(tasks, len(items), should_cancel)
+
+    def generate_for_document(self, document: str, spans: List[Tuple[int, int]],
+                              should_cancel: Optional[Callable[[], bool]] = None) -> Optional[List[str]]:
+        """
+        為同一文檔的所有文本塊生成上下文
+
+        啟用 BATCH_MODE 時按共享窗口分組，每組只發送一次文檔窗口；否則逐塊生成。
+
+        Args:
+            document: 完整文檔內容
+            spans: 每個文本塊在文檔中的 (起始位置, 結束位置)
+            should_cancel: 取消檢查函數
+
+        Returns:
+            與 spans 順序一致的上下文列表，被取消時返回 None
+
+        Raises:
+            ContextGenerationError: 任一文本塊生成失敗
+        """
+        if not self.config['BATCH_MODE']:
+            # 窗口按需截取，避免一次性構建所有提示
+            tasks = ((self._predict_single, (index, self.window_for_span(document, start, end), document[start:end]))
+                     for index, (start, end) in enumerate(spans))
+            return self._run(tasks, len(spans), should_cancel)
+
+        groups = group_chunks_by_window(
+            document, spans,
+            max(1, int(self.config['BATCH_SIZE'])),
+            self.config['BATCH_WINDOW_CHARS'],
+            self.config['WINDOW_MARGIN_CHARS']
+        )
+        tasks = ((self._predict_batch, (document, window_start, window_end, indices, spans))
+                 for window_start, window_end, indices in groups)
+        return self._run(tasks, len(spans), should_cancel)
+
+    def window_for_span(self, document: str, start: int, end: int) -> str:
+        """
+        截取逐塊生成時提供給 LLM 的文檔窗口
+
+        Args:
+            document: 完整文檔內容
+            start: 文本塊起始位置
+            end: 文本塊結束位置
+
+        Returns:
+            完整文檔（不超過 10000 字符時）或文本塊附近的窗口
+        """
+        if len(document) <= MAX_FULL_DOCUMENT_CHARS:
+            return document
+        margin = self.config['WINDOW_MARGIN_CHARS']
+        window_start = max(0, start - margin)
+        window_end = min(len(document), end + margin)
+        prefix = "..." if window_start > 0 else ""
+        suffix = " ..." if window_end < len(document) else ""
+        return prefix + document[window_start:window_end] + suffix
+
+    def _run(self, tasks: Iterable[Tuple[Callable[..., Dict[int, str]], tuple]], count: int,
+             should_cancel: Optional[Callable[[], bool]] = None) -> Optional[List[str]]:
+        """
+        以有界並發執行上下文生成任務
+
+        Args:
+            tasks: (任務函數, 參數) 的可迭代對象，任務函數返回 {文本塊索引: 上下文}
+            count: 文本塊總數，結果長度固定為此值
+            should_cancel: 取消檢查函數，只在調用執行緒中按 CANCEL_CHECK_SECONDS 節流調用
+
+        Returns:
+            按文本塊索引排序、長度為 count 的上下文列表（缺失的條目為空字符串），被取消時返回 None
+        """
+        concurrency = max(1, int(self.config['CONCURRENCY']))
+        cancel_event = threading.Event()
+        results: Dict[int, str] = {}
+        started = time.monotonic()
+        last_cancel_check = started
+        task_iter = iter(tasks)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < concurrency * 2:
+                    try:
+                        func, args = next(task_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(func, *args, cancel_event))
+
+                if pending:
+                    done, pending = wait(pending, timeout=self.config['CANCEL_CHECK_SECONDS'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            results.update(future.result())
+                        except Exception:
+                            # 一個文本塊失敗即整個文件失敗，其餘請求不再繼續
+                            cancel_event.set()
+                            for other in pending:
+                                other.cancel()
+                            raise
+
+                now = time.monotonic()
+                if should_cancel is not None and now - last_cancel_check >= self.config['CANCEL_CHECK_SECONDS']:
+                    last_cancel_check = now
+                    if should_cancel():
+                        cancel_event.set()
+                        for future in pending:
+                            future.cancel()
+                        log_message("上下文生成已取消")
+                        return None
+
+        log_message(f"已為 {len(results)} 個文本塊生成上下文，耗時 {time.monotonic() - started:.1f} 秒")
+        return [results.get(index, "") for index in range(count)]
@@ -0,0 +1,145 @@
+"""
+Context Packer - 按令牌預算打包提示上下文
+按相關性順序放入文本塊，超出預算時截斷或丟棄排名靠後的文本塊，並可去除只用於檢索的上下文前綴
+"""
+import sys
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from api.managers.token_counter import count_tokens, truncate_tokens
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_CONTEXT_PACKING_CONFIG = {
+    'ENABLED': True,
+    'MAX_CONTEXT_TOKENS': 3000,
+    'MODEL_CONTEXT_WINDOWS': {
+        'gpt-3.5-turbo': 16385,
+        'gpt-4': 8192,
+        'gpt-4-turbo': 128000,
+        'gpt-4o': 128000,
+        'gpt-4o-mini': 128000,
+    },
+    'DEFAULT_CONTEXT_WINDOW': 8192,
+    'PROMPT_OVERHEAD_TOKENS': 300,
+    'MIN_CHUNK_TOKENS': 64,
+    'STRIP_CONTEXT_PREFIX': True,
+}
+
+# 文檔 metadata 中的相關性分數鍵（融合或重排序後寫入），沒有分數時保持檢索返回的順序
+SCORE_METADATA_KEY = 'score'
+# 文檔 metadata 中上下文前綴（含分隔的空行）的字符數，由 FileProcessor 在攝取時寫入（沒有上下文時為 0）
+CONTEXT_PREFIX_METADATA_KEY = 'context_chars'
+
+def strip_context_prefix(doc: Document, use_contextual_embeddings: bool = True) -> str:
+    """
+    去除攝取時加在文本塊前的上下文描述，返回文本塊的原始內容
+
+    沒有前綴長度時，帶 start_index/end_index 的文本塊以原始長度確定前綴；
+    只有兩者都沒有的舊數據才按第一個空行分割，否則會切掉文本塊自身的第一段。
+
+    Args:
+        doc: 文檔
+        use_contextual_embeddings: 是否使用了上下文嵌入（只影響舊數據的空行分割）
+
+    Returns:
+        原始內容
+    """
+    content = doc.page_content
+    prefix_chars = doc.metadata.get(CONTEXT_PREFIX_METADATA_KEY)
+    if prefix_chars is not None:
+        return content[int(prefix_chars):]
+    start, end = doc.metadata.get('start_index'), doc.metadata.get('end_index')
+    if start is not None and end is not None:
+        return content[max(0, len(content) - (int(end) - int(start))):]
+    if use_contextual_embeddings:
+        parts = content.split("\n\n", 1)
+        if len(parts) > 1:
+            return parts[1]
+    return content
+
+class ContextPacker:
+    """上下文打包器類，在令牌預算內組裝發送給 LLM 的上下文"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化上下文打包器
+
+        Args:
+            config: 配置（見 settings.RAG_CONTEXT_PACKING）
+        """
+        self.config = {**DEFAULT_CONTEXT_PACKING_CONFIG, **(config or {})}
+
+    def budget(self, model_name: str, max_tokens: int, question: str) -> int:
+        """
+        計算上下文可用的令牌數
+
+        取 MAX_CONTEXT_TOKENS 與模型上下文窗口扣除回答（max_tokens）、提示模板和問題後剩餘令牌數中的較小值；
+        未啟用時不限制。
+
+        Args:
+            model_name: LLM 模型名稱
+            max_tokens: 回答的最大令牌數
+            question: 問題
+
+        Returns:
+            上下文令牌預算
+        """
+        if not self.config['ENABLED']:
+            return sys.maxsize
+        window = self.config['MODEL_CONTEXT_WINDOWS'].get(model_name, self.config['DEFAULT_CONTEXT_WINDOW'])
+        question_tokens = count_tokens(question, model_name)
+        available = window - int(max_tokens or 0) - self.config['PROMPT_OVERHEAD_TOKENS'] - question_tokens
+        return max(0, min(self.config['MAX_CONTEXT_TOKENS'], available))
+
+    def pack(self, documents: List[Document], file_names: Dict[str, str], model_name: str, budget: int,
+             use_contextual_embeddings: bool = True) -> Tuple[str, List[Document]]:
+        """
+        打包上下文
+
+        Args:
+            documents: 檢索到的文檔列表（按相關性排序）
+            file_names: {文件ID: 原始文件名}
+            model_name: LLM 模型名稱
+            budget: 令牌預算
+            use_contextual_embeddings: 是否使用了上下文嵌入
+
+        Returns:
+            (上下文, 實際放入上下文的文檔列表)
+        """
+        if documents and all(SCORE_METADATA_KEY in doc.metadata for doc in documents):
+            documents = sorted(documents, key=lambda doc: doc.metadata[SCORE_METADATA_KEY], reverse=True)
+
+        strip_prefix = self.config['STRIP_CONTEXT_PREFIX']
+        parts = []
+        packed = []
+        used = 0
+        for doc in documents:
+            file_name = file_names.get(doc.metadata.get('file_id', ''), "Unknown")
+            page = doc.metadata.get('page', 0) + 1
+            header = f"[文檔 {len(packed) + 1}] 來源: {file_name}, 頁碼: {page}\n"
+            content = strip_context_prefix(doc, use_contextual_embeddings) if strip_prefix else doc.page_content
+
+            # 各部分以換行連接，每部分末尾另有一個換行
+            overhead = count_tokens(header, model_name) + 2
+            remaining = budget - used - overhead
+            if remaining <= 0:
+                break
+            content_tokens = count_tokens(content, model_name)
+            if content_tokens > remaining:
+                # 剩餘預算太少時截斷後的片段價值不大，改為嘗試放入後面較短的文本塊
+                if remaining < self.config['MIN_CHUNK_TOKENS']:
+                    continue
+                content = truncate_tokens(content, remaining, model_name)
+                content_tokens = count_tokens(content, model_name)
+            parts.append(f"{header}{content}\n")
+            packed.append(doc)
+            used += overhead + content_tokens
+
+        if len(packed) < len(documents):
+            log_message(f"上下文已按 {budget} 令牌預算打包：保留 {len(packed)} / {len(documents)} 個文本塊，約 {used} 令牌")
+        return "\n".join(parts), packed
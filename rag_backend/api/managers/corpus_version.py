@@ -0,0 +1,44 @@
+"""
+Corpus Version - 知識庫版本計數器
+每次攝取或刪除文件後遞增，查詢相關快取以此版本作為鍵的一部分，知識庫變更後舊條目自然失效
+"""
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+def get_corpus_version() -> int:
+    """
+    獲取當前知識庫版本（保存在資料庫中，Web 進程、工作執行緒與管理命令共用）
+
+    Returns:
+        版本號
+    """
+    from django.apps import apps
+
+    CorpusVersion = apps.get_model('api', 'CorpusVersion')
+    version = CorpusVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    return version or 0
+
+def bump_corpus_version(reason: str = '') -> int:
+    """
+    遞增知識庫版本
+
+    Args:
+        reason: 變更原因（僅用於日誌）
+
+    Returns:
+        遞增後的版本號
+    """
+    from django.apps import apps
+    from django.db.models import F
+
+    CorpusVersion = apps.get_model('api', 'CorpusVersion')
+    if not CorpusVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        obj, created = CorpusVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+        if not created:
+            CorpusVersion.objects.filter(pk=1).update(version=F('version') + 1)
+    version = get_corpus_version()
+    log_message(f"知識庫版本已更新為 {version}{f'（{reason}）' if reason else ''}")
+    return version
@@ -0,0 +1,387 @@
+"""
+Dedup - 攝取時的近似重複文本塊檢測
+以 jieba 分詞後的詞組（shingle）計算 MinHash 簽名，並用 LSH 分桶查找候選，跨文件識別近似重複的文本塊
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_DEDUP_CONFIG = {
+    'ENABLED': True,
+    'MODE': 'downweight',
+    'THRESHOLD': 0.85,
+    'NUM_PERM': 64,
+    'BANDS': 16,
+    'SHINGLE_SIZE': 3,
+    'DOWNWEIGHT': 0.5,
+    'PATH': 'dedup_index.sqlite3',
+    'SEED': 42,
+}
+
+DEDUP_MODES = ['skip', 'link', 'downweight']
+
+# 梅森素數 2^31 - 1，保證 a * x + b 在 uint64 內不溢出
+_MERSENNE_PRIME = (1 << 31) - 1
+
+def tokenize(text: str) -> List[str]:
+    """使用 jieba 分詞，去除空白詞"""
+    import jieba
+    return [token for token in jieba.lcut(text) if token.strip()]
+
+class MinHasher:
+    """MinHash 簽名計算器"""
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 42):
+        """
+        初始化 MinHash 計算器
+
+        Args:
+            num_perm: 哈希函數（排列）數量，即簽名長度
+            shingle_size: 每個詞組包含的連續詞數
+            seed: 隨機種子，必須固定，否則已保存的簽名無法比較
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """
+        將文本轉為詞組哈希集合
+
+        Args:
+            text: 文本內容
+
+        Returns:
+            去重後的 31 位詞組哈希數組
+        """
+        tokens = tokenize(text)
+        size = self.shingle_size
+        if len(tokens) < size:
+            grams = [" ".join(tokens)] if tokens else []
+        else:
+            grams = [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+        return np.unique(np.fromiter(
+            (zlib.crc32(gram.encode('utf-8')) & _MERSENNE_PRIME for gram in grams),
+            dtype=np.uint64, count=len(grams)
+        ))
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        計算文本的 MinHash 簽名
+
+        Args:
+            text: 文本內容
+
+        Returns:
+            長度為 num_perm 的 uint32 簽名，文本沒有可用詞組時返回 None
+        """
+        hashes = self.shingles(text)
+        if hashes.size == 0:
+            return None
+        # 一次向量化計算所有排列：(num_perm, 詞組數)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+class ChunkDeduplicator:
+    """近似重複檢測器類，以 SQLite 持久化簽名與 LSH 分桶"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化近似重複檢測器
+
+        Args:
+            config: 配置（見 settings.RAG_DEDUP）
+        """
+        self.config = {**DEFAULT_DEDUP_CONFIG, **(config or {})}
+        if self.config['MODE'] not in DEDUP_MODES:
+            raise ValueError(f"不支持的去重模式: {self.config['MODE']}，可選: {', '.join(DEDUP_MODES)}")
+        if self.config['NUM_PERM'] % self.config['BANDS'] != 0:
+            raise ValueError("NUM_PERM 必須是 BANDS 的整數倍")
+
+        self.enabled = bool(self.config['ENABLED'])
+        self.db_path = str(self.config['PATH'])
+        self.rows_per_band = self.config['NUM_PERM'] // self.config['BANDS']
+        self.hasher = MinHasher(self.config['NUM_PERM'], self.config['SHINGLE_SIZE'], self.config['SEED'])
+        # 檢查與寫入必須串行，否則同時攝取的兩個重複文件會互相看不到
+        self._lock = threading.Lock()
+        if self.enabled:
+            self._initialize_tables()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _initialize_tables(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_signatures (
+                chunk_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                signature BLOB NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS chunk_signatures_file ON chunk_signatures (file_id)')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                chunk_key TEXT NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS lsh_buckets_lookup ON lsh_buckets (band, bucket)')
+            conn.execute('CREATE INDEX IF NOT EXISTS lsh_buckets_chunk ON lsh_buckets (chunk_key)')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS duplicate_chunks (
+                file_id TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                duplicate_of TEXT NOT NULL,
+                duplicate_of_file_id TEXT NOT NULL,
+                similarity REAL NOT NULL,
+                action TEXT NOT NULL,
+                chars_saved INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS duplicate_chunks_file ON duplicate_chunks (file_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS duplicate_chunks_original ON duplicate_chunks (duplicate_of_file_id)')
+        finally:
+            conn.close()
+
+    def _bands(self, signature: np.ndarray) -> List[str]:
+        """將簽名切分為 BANDS 段，每段哈希為一個桶鍵"""
+        rows = self.rows_per_band
+        return [hashlib.blake2b(signature[i * rows:(i + 1) * rows].tobytes(), digest_size=8).hexdigest()
+                for i in range(self.config['BANDS'])]
+
+    def _find_duplicate(self, conn: sqlite3.Connection, signature: np.ndarray, bands: List[str],
+                        local_buckets: Dict[Tuple[int, str], List[str]],
+                        local_signatures: Dict[str, np.ndarray]) -> Tuple[Optional[str], float]:
+        """
+        查找與簽名最相似且超過閾值的已有文本塊
+
+        Returns:
+            (重複對象的 chunk_key, 估計的 Jaccard 相似度)，沒有時返回 (None, 0.0)
+        """
+        candidates = set()
+        for band, bucket in enumerate(bands):
+            candidates.update(local_buckets.get((band, bucket), []))
+            rows = conn.execute(
+                "SELECT chunk_key FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)
+            ).fetchall()
+            candidates.update(row[0] for row in rows)
+        if not candidates:
+            return None, 0.0
+
+        best_key, best_similarity = None, 0.0
+        for key in candidates:
+            other = local_signatures.get(key)
+            if other is None:
+                row = conn.execute("SELECT signature FROM chunk_signatures WHERE chunk_key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                other = np.frombuffer(row[0], dtype=np.uint32)
+            similarity = float(np.mean(signature == other))
+            if similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+        if best_similarity >= self.config['THRESHOLD']:
+            return best_key, best_similarity
+        return None, best_similarity
+
+    def process(self, file_id: str, documents: List[Any], reset: bool = True) -> List[Any]:
+        """
+        檢測並處理一個文件的近似重複文本塊，同時登記其餘文本塊供後續文件比對
+
+        - skip: 丟棄重複塊，只在報告中計數
+        - link: 丟棄重複塊並記錄其指向的原始塊
+        - downweight: 保留重複塊，在 metadata 中標記 duplicate_of 與 dedup_weight，檢索時降低排名
+
+        Args:
+            file_id: 文件ID
+            documents: 文本塊文檔列表（metadata 需包含 chunk_id）
+            reset: 是否先移除本文件舊的簽名；分批處理同一文件時只在處理前移除一次，之後的批次傳入 False
+
+        Returns:
+            處理後保留的文檔列表
+        """
+        if not self.enabled or not documents:
+            return documents
+
+        mode = self.config['MODE']
+        file_id = str(file_id)
+        # 重新處理時先移除本文件舊的簽名，避免與自己比對
+        if reset:
+            self.remove_file(file_id, keep_links=True)
+        kept = []
+        duplicates = []
+        new_signatures = []
+        local_buckets: Dict[Tuple[int, str], List[str]] = {}
+        local_signatures: Dict[str, np.ndarray] = {}
+        started = time.monotonic()
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                for doc in documents:
+                    chunk_id = doc.metadata.get('chunk_id', len(kept) + len(duplicates))
+                    signature = self.hasher.signature(doc.page_content)
+                    if signature is None:
+                        kept.append(doc)
+                        continue
+
+                    bands = self._bands(signature)
+                    duplicate_of, similarity = self._find_duplicate(conn, signature, bands, local_buckets, local_signatures)
+                    if duplicate_of is not None:
+                        chars_saved = 0 if mode == 'downweight' else len(doc.page_content)
+                        duplicates.append((file_id, chunk_id, duplicate_of, duplicate_of.split(':', 1)[0],
+                                           similarity, mode, chars_saved, time.time()))
+                        if mode == 'downweight':
+                            doc.metadata['duplicate_of'] = duplicate_of
+                            doc.metadata['dedup_weight'] = self.config['DOWNWEIGHT']
+                            kept.append(doc)
+                        continue
+
+                    # 只有非重複塊登記為比對對象，避免重複鏈
+                    chunk_key = f"{file_id}:{chunk_id}"
+                    local_signatures[chunk_key] = signature
+                    for band, bucket in enumerate(bands):
+                        local_buckets.setdefault((band, bucket), []).append(chunk_key)
+                    new_signatures.append((chunk_key, chunk_id, signature, bands))
+                    kept.append(doc)
+
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_signatures (chunk_key, file_id, chunk_id, signature) VALUES (?, ?, ?, ?)",
+                    [(key, file_id, chunk_id, signature.tobytes()) for key, chunk_id, signature, _ in new_signatures]
+                )
+                conn.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, chunk_key) VALUES (?, ?, ?)",
+                    [(band, bucket, key) for key, _, _, bands in new_signatures for band, bucket in enumerate(bands)]
+                )
+                conn.executemany(
+                    "INSERT INTO duplicate_chunks (file_id, chunk_id, duplicate_of, duplicate_of_file_id, similarity, action, chars_saved, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    duplicates
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+        if duplicates:
+            log_message(f"文件 {file_id} 檢測到 {len(duplicates)}/{len(documents)} 個近似重複文本塊（模式: {mode}），"
+                        f"耗時 {time.monotonic() - started:.2f} 秒")
+        return kept
+
+    def remove_file(self, file_id: str, keep_links: bool = False) -> List[str]:
+        """
+        移除文件的簽名與重複記錄
+
+        文件被刪除時，重複塊被丟棄（skip 或 link 模式）而指向它的其他文件已丟失對應內容，需要重新處理；
+        文件只是重新處理時應保留這些鏈接（keep_links=True）。
+
+        Args:
+            file_id: 文件ID
+            keep_links: 是否保留其他文件指向本文件的重複記錄
+
+        Returns:
+            需要重新處理的文件ID列表（keep_links=True 時為空）
+        """
+        if not self.enabled:
+            return []
+        file_id = str(file_id)
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                dependants = []
+                if not keep_links:
+                    dependants = [row[0] for row in conn.execute(
+                        "SELECT DISTINCT file_id FROM duplicate_chunks WHERE duplicate_of_file_id = ? AND file_id != ? AND action != 'downweight'",
+                        (file_id, file_id)
+                    )]
+                    conn.execute("DELETE FROM duplicate_chunks WHERE duplicate_of_file_id = ?", (file_id,))
+                conn.execute(
+                    "DELETE FROM lsh_buckets WHERE chunk_key IN (SELECT chunk_key FROM chunk_signatures WHERE file_id = ?)",
+                    (file_id,)
+                )
+                conn.execute("DELETE FROM chunk_signatures WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM duplicate_chunks WHERE file_id = ?", (file_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        return dependants
+
+    def duplicate_count(self, file_id: str) -> int:
+        """
+        獲取文件被識別為重複的文本塊數
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            重複文本塊數
+        """
+        if not self.enabled:
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM duplicate_chunks WHERE file_id = ?", (str(file_id),)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        獲取去重報告
+
+        Returns:
+            包含模式、閾值、已登記文本塊數、重複塊數、節省的向量數與字符數，以及各文件重複統計的字典
+        """
+        result = {
+            'enabled': self.enabled,
+            'mode': self.config['MODE'],
+            'threshold': self.config['THRESHOLD'],
+            'indexed_chunks': 0,
+            'duplicate_chunks': 0,
+            'vectors_saved': 0,
+            'chars_saved': 0,
+            'files': [],
+        }
+        if not self.enabled:
+            return result
+
+        conn = self._connect()
+        try:
+            result['indexed_chunks'] = conn.execute("SELECT COUNT(*) FROM chunk_signatures").fetchone()[0]
+            result['duplicate_chunks'], result['vectors_saved'], result['chars_saved'] = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(action != 'downweight'), 0), COALESCE(SUM(chars_saved), 0) FROM duplicate_chunks"
+            ).fetchone()
+            result['files'] = [
+                {'file_id': file_id, 'duplicate_chunks': count, 'chars_saved': saved}
+                for file_id, count, saved in conn.execute(
+                    "SELECT file_id, COUNT(*), SUM(chars_saved) FROM duplicate_chunks "
+                    "GROUP BY file_id ORDER BY SUM(chars_saved) DESC LIMIT 100"
+                )
+            ]
+        finally:
+            conn.close()
+        return result
@@ -0,0 +1,616 @@
+"""
+Document Parser - 文件載入、清洗與分割
+本模組不依賴 Django，可在子進程中執行，將 CPU 密集的解析工作移出 Web 進程
+"""
+import json
+import os
+import re
+import tempfile
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import (
+    PyPDFLoader, TextLoader, Docx2txtLoader, CSVLoader, UnstructuredHTMLLoader
+)
+
+# 文檔加載器
+LOADERS = {
+    'pdf': PyPDFLoader,
+    'txt': TextLoader,
+    'docx': Docx2txtLoader,
+    'csv': CSVLoader,
+    'html': UnstructuredHTMLLoader
+}
+
+SPLITTER_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
+
+# 流式智能分割時，每個窗口最多累積約 STREAM_WINDOW_CHUNKS 個分塊大小的文本
+STREAM_WINDOW_CHUNKS = 8
+
+# 結構分割：一次線性掃描同時識別空行與三類章節標題
+# 所有分支都以換行開頭，正則引擎可直接跳到下一個換行，不在每個字符上嘗試匹配；
+# 空行分支不消耗其後的換行，以免吞掉下一行行首的標題
+_STRUCTURE_PATTERN = re.compile(
+    r'\n(?:'
+    r'(?P<blank>[^\S\n]*)(?=\n)'
+    r'|(?P<markdown>#+[^\S\n]+\S)'
+    r'|(?P<numbered>(?:\d+\.)+[^\S\n]+\S)'
+    r'|(?P<chinese>第[一二三四五六七八九十百千]+[章節部分])'
+    r')'
+)
+
+# 按優先級嘗試的標題類型
+HEADING_KINDS = ['markdown', 'numbered', 'chinese']
+
+# 段落合併後的最小分塊長度，低於此長度改用遞歸分割器
+MIN_PARAGRAPH_CHUNK = 100
+
+# 全文暫存文件中相鄰檢查點之間的最大字符數，讀取任意片段最多多解碼兩段
+SPOOL_SLICE_CHARS = 65536
+
+# 解析子進程只需要這些設置
+PARSER_SETTING_KEYS = ['chunk_size', 'chunk_overlap', 'use_intelligent_splitting', 'use_contextual_embeddings']
+
+def create_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """
+    創建遞歸字符分割器
+
+    Args:
+        chunk_size: 分塊大小
+        chunk_overlap: 分塊重疊
+
+    Returns:
+        文本分割器
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=SPLITTER_SEPARATORS
+    )
+
+def iter_pages(file_path: str) -> Iterator[Document]:
+    """
+    逐頁載入文件，不一次性讀入所有頁面
+
+    Args:
+        file_path: 文件路徑
+
+    Returns:
+        頁面文檔迭代器
+    """
+    file_extension = os.path.splitext(file_path)[1].lower().replace('.', '')
+    loader = LOADERS[file_extension](file_path)
+    return loader.lazy_load()
+
+def clean_text(text: str) -> str:
+    """
+    清洗文本：合併行內空白並把連續空行壓縮為一個空行，保留換行以供結構分割識別標題
+
+    逐行處理，每行只使用 str.split/join，整體為一次線性遍歷。
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        清洗後的文本
+    """
+    lines = []
+    pending_blank = False
+    for line in text.split('\n'):
+        line = ' '.join(line.split())
+        if not line:
+            pending_blank = True
+            continue
+        if pending_blank and lines:
+            lines.append('')
+        lines.append(line)
+        pending_blank = False
+    return '\n'.join(lines)
+
+def iter_clean_documents(documents: Iterable[Document]) -> Iterator[Document]:
+    """
+    逐頁清洗文檔
+
+    Args:
+        documents: 文檔迭代器
+
+    Returns:
+        清洗後的文檔迭代器（略過空白頁）
+    """
+    for doc in documents:
+        text = clean_text(doc.page_content)
+        if not text:
+            continue
+        yield Document(
+            page_content=text,
+            metadata=doc.metadata
+        )
+
+def clean_documents(documents: List[Document]) -> List[Document]:
+    """
+    清洗文檔
+
+    Args:
+        documents: 文檔列表
+
+    Returns:
+        清洗後的文檔列表
+    """
+    return list(iter_clean_documents(documents))
+
+def _strip_span(document: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    """去除兩端空白後的位置（與分割器的 strip_whitespace 一致），全為空白時返回 None"""
+    while start < end and document[start].isspace():
+        start += 1
+    while end > start and document[end - 1].isspace():
+        end -= 1
+    return (start, end) if end > start else None
+
+def _separator_spans(document: str, start: int, end: int, separator: str) -> List[Tuple[int, int]]:
+    """按分隔符切分 [start, end)，分隔符保留在下一段開頭（與 keep_separator=True 一致）"""
+    if not separator:
+        return [(position, position + 1) for position in range(start, end)]
+    spans = []
+    piece_start = start
+    position = document.find(separator, start, end)
+    while position != -1:
+        if position > piece_start:
+            spans.append((piece_start, position))
+        piece_start = position
+        position = document.find(separator, position + len(separator), end)
+    if end > piece_start:
+        spans.append((piece_start, end))
+    return spans
+
+def _merge_spans(document: str, splits: List[Tuple[int, int]], chunk_size: int,
+                 chunk_overlap: int) -> List[Tuple[int, int]]:
+    """將相鄰的小片段合併為不超過 chunk_size 的分塊，相鄰分塊保留不超過 chunk_overlap 的重疊"""
+    merged = []
+    current: deque = deque()
+    total = 0
+    for start, end in splits:
+        length = end - start
+        if total + length > chunk_size and current:
+            span = _strip_span(document, current[0][0], current[-1][1])
+            if span is not None:
+                merged.append(span)
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                first_start, first_end = current.popleft()
+                total -= first_end - first_start
+        current.append((start, end))
+        total += length
+    if current:
+        span = _strip_span(document, current[0][0], current[-1][1])
+        if span is not None:
+            merged.append(span)
+    return merged
+
+def _recursive_spans(document: str, start: int, end: int, separators: List[str], chunk_size: int,
+                     chunk_overlap: int) -> List[Tuple[int, int]]:
+    """與 RecursiveCharacterTextSplitter 相同的遞歸分割，直接在位置上進行"""
+    separator = separators[-1]
+    new_separators: List[str] = []
+    for index, candidate in enumerate(separators):
+        if candidate == "":
+            separator = candidate
+            break
+        if document.find(candidate, start, end) != -1:
+            separator = candidate
+            new_separators = separators[index + 1:]
+            break
+
+    spans = []
+    good_splits = []
+    for split_start, split_end in _separator_spans(document, start, end, separator):
+        if split_end - split_start < chunk_size:
+            good_splits.append((split_start, split_end))
+            continue
+        if good_splits:
+            spans.extend(_merge_spans(document, good_splits, chunk_size, chunk_overlap))
+            good_splits = []
+        if not new_separators:
+            spans.append((split_start, split_end))
+        else:
+            spans.extend(_recursive_spans(document, split_start, split_end, new_separators, chunk_size, chunk_overlap))
+    if good_splits:
+        spans.extend(_merge_spans(document, good_splits, chunk_size, chunk_overlap))
+    return spans
+
+def _splitter_spans(document: str, text_splitter: RecursiveCharacterTextSplitter, base: int = 0) -> List[Tuple[int, int]]:
+    """
+    使用遞歸字符分割器的規則分割文本，並返回每個分塊在文本中的位置
+
+    分割在位置上進行，每個分塊的位置在遞歸與合併過程中直接得到，不需要事後以子串搜尋定位；
+    分塊內容與 text_splitter.split_text 的結果相同，重複出現的短分塊也不會被定位到錯誤的位置。
+
+    Args:
+        document: 文檔內容
+        text_splitter: 文本分割器（使用其分隔符、分塊大小與重疊設置）
+        base: 加到所有位置上的偏移量
+
+    Returns:
+        [(起始位置, 結束位置), ...]
+    """
+    spans = _recursive_spans(document, 0, len(document), text_splitter._separators,
+                             text_splitter._chunk_size, text_splitter._chunk_overlap)
+    return [(base + start, base + end) for start, end in spans]
+
+def _scan_structure(document: str) -> Tuple[Dict[str, List[int]], List[Tuple[int, int]]]:
+    """
+    一次掃描文檔，收集各類標題的起始位置與空行分隔符的位置
+
+    Args:
+        document: 文檔內容
+
+    Returns:
+        ({標題類型: [起始位置, ...]}, [(分隔符起點, 分隔符終點), ...])
+    """
+    headings: Dict[str, List[int]] = {kind: [] for kind in HEADING_KINDS}
+    blanks = []
+    # 在開頭補一個換行，使文檔首行的標題也能匹配；補位後 match.start() 即為原文中換行之後的位置
+    for match in _STRUCTURE_PATTERN.finditer('\n' + document):
+        kind = match.lastgroup
+        if kind != 'blank':
+            headings[kind].append(match.start())
+            continue
+        # 分隔符從空行前的換行延伸到空行後的換行，連續空行合併為一個分隔符
+        start, end = max(0, match.start() - 1), match.end()
+        if blanks and start < blanks[-1][1]:
+            blanks[-1] = (blanks[-1][0], end)
+        else:
+            blanks.append((start, end))
+    return headings, blanks
+
+def _rstrip_end(document: str, start: int, end: int) -> int:
+    """返回去除結尾空白後的結束位置"""
+    while end > start and document[end - 1].isspace():
+        end -= 1
+    return end
+
+def _enforce_chunk_size(document: str, spans: List[Tuple[int, int]], chunk_size: int,
+                        text_splitter: RecursiveCharacterTextSplitter) -> List[Tuple[int, int]]:
+    """超過 chunk_size 的結構分塊再以遞歸分割器按 chunk_size/chunk_overlap 切分"""
+    result = []
+    for start, end in spans:
+        if end - start > chunk_size:
+            result.extend(_splitter_spans(document[start:end], text_splitter, base=start))
+        else:
+            result.append((start, end))
+    return result
+
+def improved_text_spans(document: str, chunk_size: int, text_splitter: RecursiveCharacterTextSplitter) -> List[Tuple[int, int]]:
+    """
+    改進的文本分割策略，更好地保留文檔結構，返回每個分塊在文檔中的位置
+
+    只掃描一次文檔：依序選用 Markdown 標題、數字編號章節、「第X章」標題中第一種出現兩次以上的
+    作為章節邊界；都沒有時按空行合併段落；仍無法得到合理分塊時使用遞歸分割器。
+    超過 chunk_size 的章節或段落會再按 chunk_size/chunk_overlap 切分。
+
+    Args:
+        document: 文檔內容
+        chunk_size: 分塊大小上限
+        text_splitter: 用於切分超長分塊的遞歸分割器
+
+    Returns:
+        [(起始位置, 結束位置), ...]
+    """
+    headings, blanks = _scan_structure(document)
+
+    for kind in HEADING_KINDS:
+        positions = headings[kind]
+        if len(positions) < 2:
+            continue
+        spans = []
+        # 第一個標題之前的前言單獨成塊
+        preamble_end = _rstrip_end(document, 0, positions[0])
+        if preamble_end > 0:
+            spans.append((0, preamble_end))
+        for index, start in enumerate(positions):
+            end = positions[index + 1] if index + 1 < len(positions) else len(document)
+            end = _rstrip_end(document, start, end)
+            if end > start:
+                spans.append((start, end))
+        return _enforce_chunk_size(document, spans, chunk_size, text_splitter)
+
+    spans = []
+    current_start = current_end = None
+    para_start = 0
+    for separator in blanks + [(len(document), len(document))]:
+        para_end, next_start = separator
+        if para_end > para_start and not document[para_start:para_end].isspace():
+            if current_start is None:
+                current_start, current_end = para_start, para_end
+            elif (current_end - current_start) + (para_end - para_start) < chunk_size:
+                current_end = para_end
+            else:
+                spans.append((current_start, current_end))
+                current_start, current_end = para_start, para_end
+        para_start = next_start
+
+    if current_start is not None:
+        spans.append((current_start, current_end))
+
+    if len(spans) > 1 and all(end - start >= MIN_PARAGRAPH_CHUNK for start, end in spans):
+        return _enforce_chunk_size(document, spans, chunk_size, text_splitter)
+
+    return _splitter_spans(document, text_splitter)
+
+def improved_text_splitting(document: str, chunk_size: int, text_splitter: RecursiveCharacterTextSplitter) -> List[str]:
+    """
+    改進的文本分割策略，更好地保留文檔結構
+
+    Args:
+        document: 文檔內容
+        chunk_size: 段落合併時的分塊大小上限
+        text_splitter: 無法按結構分割時使用的後備分割器
+
+    Returns:
+        分割後的文本塊列表
+    """
+    return [document[start:end] for start, end in improved_text_spans(document, chunk_size, text_splitter)]
+
+def _split_window(parts: List[Tuple[str, int]], base_offset: int, chunk_size: int,
+                  text_splitter: RecursiveCharacterTextSplitter) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """
+    分割一個窗口內的頁面文本，並以頁面起始位置的二分搜尋標註頁碼
+
+    Args:
+        parts: [(頁面文本, 頁碼), ...]
+        base_offset: 窗口首字符在完整文檔中的位置
+        chunk_size: 分塊大小
+        text_splitter: 後備分割器
+
+    Returns:
+        ([{'content': 文本, 'page': 頁碼, 'start': 起始位置, 'end': 結束位置}, ...],
+         各頁面在窗口中的起始位置)
+    """
+    window_text = "\n\n".join([text for text, _ in parts])
+
+    # 頁面起始位置已排序，包含頁面之間的 "\n\n" 分隔符，不會產生位置漂移
+    page_starts = []
+    position = 0
+    for text, _ in parts:
+        page_starts.append(position)
+        position += len(text) + 2
+
+    chunks = []
+    for start, end in improved_text_spans(window_text, chunk_size, text_splitter):
+        page_index = max(0, bisect_right(page_starts, start) - 1)
+        chunks.append({
+            'content': window_text[start:end],
+            'page': parts[page_index][1],
+            'start': base_offset + start,
+            'end': base_offset + end
+        })
+    return chunks, page_starts
+
+def iter_structured_chunks(pages: Iterable[Document], chunk_size: int,
+                           text_splitter: RecursiveCharacterTextSplitter) -> Iterator[Dict[str, Any]]:
+    """
+    以有界窗口流式執行智能分割
+
+    頁面逐一累積到窗口中，窗口超過 STREAM_WINDOW_CHUNKS 個分塊大小時進行分割，
+    輸出除最後一塊以外的所有分塊；從最後一塊起始位置開始的文本作為回看內容保留，
+    與後續頁面一起重新分割，避免跨窗口的章節被硬性截斷。記憶體佔用與窗口大小成正比，
+    與文件總長度無關。
+
+    Args:
+        pages: 清洗後的頁面迭代器
+        chunk_size: 分塊大小
+        text_splitter: 後備分割器
+
+    Returns:
+        [{'content': 文本, 'page': 頁碼, 'start': 起始位置, 'end': 結束位置}, ...] 迭代器，
+        位置為分塊在 "\n\n".join(所有頁面) 中的字符位置
+    """
+    window_size = chunk_size * STREAM_WINDOW_CHUNKS
+    parts = []
+    parts_length = 0
+    base_offset = 0
+
+    for page in pages:
+        parts.append((page.page_content, page.metadata.get('page', 0)))
+        parts_length += len(page.page_content) + 2
+        if parts_length < window_size:
+            continue
+
+        chunks, page_starts = _split_window(parts, base_offset, chunk_size, text_splitter)
+        if len(chunks) <= 1 and parts_length < window_size * 4:
+            # 整個窗口仍屬於同一章節，繼續累積（以 4 倍窗口為上限）
+            continue
+
+        yield from chunks[:-1]
+
+        # 以最後一塊的起始位置切出回看內容，保留其後各頁的頁碼資訊
+        carry_start = chunks[-1]['start'] - base_offset
+        page_index = max(0, bisect_right(page_starts, carry_start) - 1)
+        head_text = parts[page_index][0][carry_start - page_starts[page_index]:]
+        if head_text:
+            parts = [(head_text, parts[page_index][1])] + parts[page_index + 1:]
+            base_offset += carry_start
+        else:
+            parts = parts[page_index + 1:]
+            base_offset += page_starts[page_index + 1] if parts else carry_start
+        parts_length = sum(len(text) + 2 for text, _ in parts)
+
+    if parts:
+        chunks, _ = _split_window(parts, base_offset, chunk_size, text_splitter)
+        yield from chunks
+
+def iter_file_chunks(pages: Iterable[Document], settings: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    流式分割清洗後的頁面
+
+    Args:
+        pages: 清洗後的頁面迭代器
+        settings: 分割相關設置（見 PARSER_SETTING_KEYS）
+
+    Returns:
+        [{'content': 文本, 'page': 頁碼, 'start': 起始位置, 'end': 結束位置}, ...] 迭代器
+    """
+    text_splitter = create_text_splitter(settings['chunk_size'], settings['chunk_overlap'])
+    if settings.get('use_intelligent_splitting', True):
+        yield from iter_structured_chunks(pages, settings['chunk_size'], text_splitter)
+        return
+
+    page_offset = 0
+    for page in pages:
+        text = page.page_content
+        for start, end in _splitter_spans(text, text_splitter, base=page_offset):
+            yield {
+                'content': text[start - page_offset:end - page_offset],
+                'page': page.metadata.get('page', 0),
+                'start': start,
+                'end': end
+            }
+        page_offset += len(text) + 2
+
+class DocumentSpool:
+    """
+    暫存在臨時文件中的完整清洗後文本
+
+    支持 len() 與切片讀取（document[start:end]），上下文生成按窗口讀取文本，
+    不必把整份文本載入記憶體。對象只包含路徑與檢查點，可在進程之間傳遞。
+    """
+
+    def __init__(self, path: str):
+        """
+        初始化全文暫存
+
+        Args:
+            path: 臨時文件路徑
+        """
+        self.path = path
+        self.length = 0
+        self.byte_length = 0
+        # 檢查點：字符位置與對應的文件字節位置，都位於字符邊界上
+        self._char_points: List[int] = []
+        self._byte_points: List[int] = []
+
+    def append(self, handle: Any, text: str) -> None:
+        """
+        追加一段文本（調用方負責寫入頁面之間的分隔符）
+
+        Args:
+            handle: 以二進制模式打開的文件
+            text: 文本
+        """
+        for offset in range(0, len(text), SPOOL_SLICE_CHARS):
+            piece = text[offset:offset + SPOOL_SLICE_CHARS]
+            data = piece.encode('utf-8')
+            self._char_points.append(self.length)
+            self._byte_points.append(self.byte_length)
+            handle.write(data)
+            self.length += len(piece)
+            self.byte_length += len(data)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key: slice) -> str:
+        if not isinstance(key, slice):
+            raise TypeError("DocumentSpool 只支持切片讀取")
+        start, stop, step = key.indices(self.length)
+        if step != 1:
+            raise ValueError("DocumentSpool 不支持步長")
+        if start >= stop:
+            return ''
+        first = bisect_right(self._char_points, start) - 1
+        last = bisect_left(self._char_points, stop)
+        byte_start = self._byte_points[first]
+        byte_end = self._byte_points[last] if last < len(self._byte_points) else self.byte_length
+        with open(self.path, 'rb') as f:
+            f.seek(byte_start)
+            text = f.read(byte_end - byte_start).decode('utf-8')
+        base = self._char_points[first]
+        return text[start - base:stop - base]
+
+def iter_spooled_chunks(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐個讀取 parse_file 暫存的文本塊
+
+    Args:
+        path: 文本塊暫存文件路徑
+
+    Returns:
+        {'content': 文本, 'page': 頁碼, 'start': 起始位置, 'end': 結束位置} 迭代器
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+def remove_spool(parsed: Dict[str, Any]) -> None:
+    """
+    刪除 parse_file 創建的臨時文件
+
+    Args:
+        parsed: parse_file 的返回值
+    """
+    paths = [parsed.get('chunks_path')]
+    if parsed.get('document') is not None:
+        paths.append(parsed['document'].path)
+    for path in paths:
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def _spool_path(prefix: str, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix)
+    os.close(fd)
+    return path
+
+def parse_file(file_path: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    載入、清洗並分割文件，將文本塊與完整文本寫入臨時文件
+
+    此函數在解析進程池中執行。頁面以流式方式逐頁載入、清洗與分割，文本塊逐個寫入暫存文件，
+    只有啟用上下文嵌入時才另外暫存一份完整文本；返回值只包含路徑與計數，
+    進程間傳輸與兩端的記憶體佔用都與文件大小無關。調用方處理完畢後以 remove_spool 刪除臨時文件。
+
+    Args:
+        file_path: 文件路徑
+        settings: 分割相關設置（見 PARSER_SETTING_KEYS）
+
+    Returns:
+        {'chunks_path': 文本塊暫存文件（每行一個 JSON，見 iter_spooled_chunks）,
+         'chunk_count': 文本塊數,
+         'document': 完整清洗後文本的 DocumentSpool（僅在啟用上下文嵌入時返回，否則為 None）}
+    """
+    parsed: Dict[str, Any] = {
+        'chunks_path': _spool_path('rag-chunks-', '.jsonl'),
+        'chunk_count': 0,
+        'document': None,
+    }
+    document_handle = None
+    try:
+        if settings.get('use_contextual_embeddings', True):
+            parsed['document'] = DocumentSpool(_spool_path('rag-document-', '.txt'))
+            document_handle = open(parsed['document'].path, 'wb')
+
+        def pages() -> Iterator[Document]:
+            for page in iter_clean_documents(iter_pages(file_path)):
+                if document_handle is not None:
+                    # 與 "\n\n".join(所有頁面) 一致，文本塊位置可直接用於切片
+                    if len(parsed['document']):
+                        parsed['document'].append(document_handle, "\n\n")
+                    parsed['document'].append(document_handle, page.page_content)
+                yield page
+
+        with open(parsed['chunks_path'], 'w', encoding='utf-8') as chunks_handle:
+            for chunk in iter_file_chunks(pages(), settings):
+                chunks_handle.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                parsed['chunk_count'] += 1
+    except Exception:
+        if document_handle is not None:
+            document_handle.close()
+            document_handle = None
+        remove_spool(parsed)
+        raise
+    finally:
+        if document_handle is not None:
+            document_handle.close()
+    return parsed
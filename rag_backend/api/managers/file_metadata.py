@@ -0,0 +1,103 @@
+"""
+File Metadata - 文件元數據快取
+以一次批量查詢解析檢索結果引用的文件名，並在進程內快取；File 保存或刪除時由 api.signals 使條目失效
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from django.conf import settings
+
+DEFAULT_FILE_METADATA_CACHE_CONFIG = {
+    'TTL_SECONDS': 300,
+    'MAX_ENTRIES': 10000,
+}
+
+class FileMetadataCache:
+    """
+    文件元數據快取類
+
+    信號只能通知本進程，TTL_SECONDS 限制其他進程（如 ingest 管理命令或其他 Web 工作進程）修改後的過時時間。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化文件元數據快取
+
+        Args:
+            config: 配置（見 settings.RAG_FILE_METADATA_CACHE）
+        """
+        self.config = {**DEFAULT_FILE_METADATA_CACHE_CONFIG, **(config or {})}
+        # 文件ID -> (過期時間, 原始文件名)，按訪問順序排列
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filenames(self, file_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        批量解析文件名，未快取的文件以一次查詢取得
+
+        Args:
+            file_ids: 文件ID列表（可重複）
+
+        Returns:
+            {文件ID: 原始文件名}，不存在的文件不包含在內
+        """
+        from django.apps import apps
+
+        now = time.time()
+        names = {}
+        missing = set()
+        with self._lock:
+            for file_id in file_ids:
+                file_id = str(file_id)
+                if file_id in names or file_id in missing:
+                    continue
+                entry = self._entries.get(file_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(file_id)
+                    names[file_id] = entry[1]
+                else:
+                    missing.add(file_id)
+
+        # 向量庫中的 file_id 可能不是有效的 UUID，這些文件視為不存在
+        valid_ids = []
+        for file_id in missing:
+            try:
+                valid_ids.append(uuid.UUID(file_id))
+            except ValueError:
+                pass
+        if not valid_ids:
+            return names
+
+        File = apps.get_model('api', 'File')
+        fetched = {
+            str(file_id): name
+            for file_id, name in File.objects.filter(id__in=valid_ids).values_list('id', 'original_filename')
+        }
+        expires_at = now + self.config['TTL_SECONDS']
+        with self._lock:
+            for file_id, name in fetched.items():
+                self._entries[file_id] = (expires_at, name)
+                self._entries.move_to_end(file_id)
+            while len(self._entries) > self.config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+        names.update(fetched)
+        return names
+
+    def invalidate(self, file_id: Optional[str] = None) -> None:
+        """
+        使快取條目失效
+
+        Args:
+            file_id: 文件ID，為 None 時清空全部條目
+        """
+        with self._lock:
+            if file_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(file_id), None)
+
+# 進程內共用的實例，RAGManager 與信號處理函數使用同一個快取
+file_metadata_cache = FileMetadataCache(getattr(settings, 'RAG_FILE_METADATA_CACHE', {}))
@@ -1,13 +1,21 @@
 """
 文件處理器 - 負責處理各種文件格式
 """
+import itertools
 import os
-import re
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    PyPDFLoader, TextLoader, Docx2txtLoader, CSVLoader, UnstructuredHTMLLoader
+
+from api.managers.context_generator import ContextGenerator
+from api.managers.context_packer import CONTEXT_PREFIX_METADATA_KEY
+from api.managers.document_parser import (
+    LOADERS, PARSER_SETTING_KEYS, create_text_splitter, clean_documents, improved_text_splitting, iter_spooled_chunks,
+    parse_file, remove_spool
 )
 
 # 自定義日誌函數，確保輸出後立即刷新
@@ -18,7 +26,10 @@ def log_message(message):
 class FileProcessor:
     """文件處理器類，負責處理和添加文件到RAG系統"""
     
-    def __init__(self, settings: dict, embeddings: any, vector_manager: any, llm: any, chroma_db_dir: str, db_path: str):
+    def __init__(self, settings: dict, embeddings: any, vector_manager: any, llm_client: any, chroma_db_dir: str, db_path: str,
+                 stage_limiter: any = None, parser_processes: int = 0, context_config: dict = None,
+                 context_cache: any = None, cancellation: any = None, deduplicator: any = None,
+                 embed_batch_size: int = 0):
         """
         初始化文件處理器
         
@@ -26,37 +37,77 @@ class FileProcessor:
             settings: 配置設置字典
             embeddings: 嵌入模型
             vector_manager: 向量管理器對象
-            llm: LLM對象（用於生成上下文）
+            llm_client: 共用的 LLM 客戶端（LLMClient，用於生成上下文）
             chroma_db_dir: ChromaDB目錄
             db_path: SQLite數據庫路徑
+            stage_limiter: 分階段並發限制器（提供 stage(name) 上下文管理器，例如 IngestionQueue）
+            parser_processes: 解析進程池大小，0 表示在當前進程內解析
+            context_config: 上下文生成的並發與限流配置（見 settings.RAG_CONTEXT_GENERATION）
+            context_cache: 上下文快取（ContextCache），為 None 時不使用快取
+            cancellation: 取消登記表（CancellationRegistry），為 None 時每次檢查都查詢資料庫
+            deduplicator: 近似重複檢測器（ChunkDeduplicator），為 None 時不去重
+            embed_batch_size: 每批去重、生成上下文、嵌入並寫入向量庫的文本塊數，0 表示整個文件一批
         """
         self.settings = settings
         self.embeddings = embeddings
         self.vector_manager = vector_manager
-        self.llm = llm
+        self.llm_client = llm_client
         self.chroma_db_dir = chroma_db_dir
         self.db_path = db_path  # 新增：數據庫路徑
+        self.stage_limiter = stage_limiter
+        self.parser_processes = parser_processes
+        self._parser_pool = None
+        # 多個攝取工作者共用進程池，創建與損壞後的重置需串行
+        self._parser_pool_lock = threading.Lock()
+        self.context_generator = ContextGenerator(llm_client, context_config, context_cache)
+        self.cancellation = cancellation
+        self.deduplicator = deduplicator
+        self.embed_batch_size = embed_batch_size
         
         # 初始化文檔加載器
-        self.loaders = {
-            'pdf': PyPDFLoader,
-            'txt': TextLoader,
-            'docx': Docx2txtLoader,
-            'csv': CSVLoader,
-            'html': UnstructuredHTMLLoader
-        }
+        self.loaders = LOADERS
         
         # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.settings['chunk_size'],
-            chunk_overlap=self.settings['chunk_overlap'],
-            separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
-        )
+        self.text_splitter = create_text_splitter(self.settings['chunk_size'], self.settings['chunk_overlap'])
+    
+    @property
+    def llm(self) -> Optional[any]:
+        """當前的 LLM（由共用的 LLMClient 持有，更新 LLM 設置後自動使用新的模型）"""
+        return self.llm_client.llm if self.llm_client is not None else None
+    
+    def _stage(self, name: str):
+        """
+        佔用指定處理階段的並發名額，未配置限制器時不做限制
+        
+        Args:
+            name: 階段名稱（parse、context、embed）
+        """
+        if self.stage_limiter is None:
+            return nullcontext()
+        return self.stage_limiter.stage(name)
     
     def _check_cancelled(self, file_id: str) -> bool:
         """
         檢查文件是否被取消
         
+        Args:
+            file_id: 文件ID
+            
+        Returns:
+            是否被取消 (True 表示已取消)
+        """
+        if self.cancellation is not None:
+            if self.cancellation.is_cancelled(file_id):
+                log_message(f"文件 {file_id} 已被取消")
+                return True
+            return False
+        return self.is_cancelled_in_db(file_id)
+    
+    @staticmethod
+    def is_cancelled_in_db(file_id: str) -> bool:
+        """
+        查詢資料庫中文件是否已被取消
+        
         Args:
             file_id: 文件ID
             
@@ -95,63 +146,24 @@ class FileProcessor:
         Returns:
             清洗後的文檔列表
         """
-        cleaned_docs = []
-        for doc in documents:
-            text = doc.page_content.strip()
-            text = ' '.join(text.split())
-            if not text:
-                continue
-            cleaned_doc = Document(
-                page_content=text,
-                metadata=doc.metadata
-            )
-            cleaned_docs.append(cleaned_doc)
-        return cleaned_docs
+        return clean_documents(documents)
     
-    def _generate_chunk_context(self, whole_document: str, chunk: str) -> str:
+    def _generate_chunk_context(self, whole_document: str, start: int, end: int) -> str:
         """
         使用 LLM 為文本塊生成上下文描述
         
         Args:
             whole_document: 完整文檔內容
-            chunk: 文本塊內容
+            start: 文本塊在文檔中的起始位置
+            end: 文本塊在文檔中的結束位置
             
         Returns:
             生成的上下文描述
         """
         if self.llm is None:
             return ""
-        
-        max_doc_length = 10000
-        if len(whole_document) > max_doc_length:
-            chunk_pos = whole_document.find(chunk)
-            if chunk_pos != -1:
-                context_window = 2000
-                start_pos = max(0, chunk_pos - context_window)
-                end_pos = min(len(whole_document), chunk_pos + len(chunk) + context_window)
-                prefix = "..." if start_pos > 0 else ""
-                suffix = " ..." if end_pos < len(whole_document) else ""
-                whole_document = prefix + whole_document[start_pos:end_pos] + suffix
-            else:
-                whole_document = whole_document[:max_doc_length//2] + " ... " + whole_document[-max_doc_length//2:]
-        
-        prompt = f"""
-        <document> 
-        {whole_document} 
-        </document> 
-        Here is the chunk we want to situate within the whole document 
-        <chunk> 
-        {chunk} 
-        </chunk> 
-        Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else. The context should be in Traditional Chinese.
-        """
-        
-        try:
-            context = self.llm.predict(prompt)
-            return context.strip()
-        except Exception as e:
-            log_message(f"生成上下文時出錯: {str(e)}")
-            return ""
+        window = self.context_generator.window_for_span(whole_document, start, end)
+        return self.context_generator.generate_one(window, whole_document[start:end])
     
     def _improved_text_splitting(self, document: str) -> List[str]:
         """
@@ -163,205 +175,250 @@ class FileProcessor:
         Returns:
             分割後的文本塊列表
         """
-        title_pattern = r'(^|\n)#+\s+.+?(?=\n#+\s+|\Z)'
-        title_chunks = re.findall(title_pattern, document, re.DOTALL)
-        if len(title_chunks) > 1:
-            return title_chunks
-        
-        section_pattern = r'(^|\n)(?:\d+\.)+\s+.+?(?=\n(?:\d+\.)+\s+|\Z)'
-        section_chunks = re.findall(section_pattern, document, re.DOTALL)
-        if len(section_chunks) > 1:
-            return section_chunks
-        
-        cn_section_pattern = r'(^|\n)第[一二三四五六七八九十百千]+[章節部分]\s*.+?(?=\n第[一二三四五六七八九十百千]+[章節部分]|\Z)'
-        cn_section_chunks = re.findall(cn_section_pattern, document, re.DOTALL)
-        if len(cn_section_chunks) > 1:
-            return cn_section_chunks
-        
-        paragraphs = re.split(r'\n\s*\n', document)
-        min_chunk_size = 100
-        chunks = []
-        current_chunk = ""
-        
-        for para in paragraphs:
-            if not para.strip():
-                continue
-            if len(current_chunk) + len(para) < self.settings['chunk_size']:
-                current_chunk += "\n\n" + para if current_chunk else para
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = para
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        if len(chunks) > 1 and all(len(chunk) >= min_chunk_size for chunk in chunks):
-            return chunks
-        
-        return self.text_splitter.split_text(document)
+        return improved_text_splitting(document, self.settings['chunk_size'], self.text_splitter)
     
-    def _add_documents_to_vectorstore(self, documents: List[Document], file_id: str) -> None:
+    def _add_documents_to_vectorstore(self, documents: List[Document], file_id: str,
+                                      replace_existing: bool = True) -> bool:
         """
         將文檔添加到向量存儲
         
         Args:
             documents: 文檔列表
             file_id: 文件ID，用於檢查取消狀態
+            replace_existing: 是否先刪除文件現有的文檔（分批寫入時只在第一批刪除）
+            
+        Returns:
+            是否已成功寫入；文件被取消或寫入出錯時返回 False
         """
         # 最後檢查一次取消狀態
         if self._check_cancelled(file_id):
             log_message(f"文件 {file_id} 已被取消，不添加到向量庫")
-            return
+            return False
             
-        # 為確保取消行為完全生效，先嘗試刪除文件相關的任何現有文檔
         try:
-            # 獲取第一個文檔的文件路徑作為source
-            if documents and len(documents) > 0 and 'source' in documents[0].metadata:
-                source_path = documents[0].metadata['source']
-                # 先清理向量庫中可能存在的相關文檔
-                log_message(f"檢查並清理文件路徑 {source_path} 的現有文檔...")
-                self.vector_manager.delete_documents_by_source(source_path)
-            
-            # 再次嘗試直接用file_id清理
-            log_message(f"檢查並清理文件ID {file_id} 的現有文檔...")
-            self.vector_manager.delete_file(file_id)
+            # 為確保取消行為完全生效，先嘗試刪除文件相關的任何現有文檔
+            if replace_existing:
+                # 獲取第一個文檔的文件路徑作為source
+                if documents and len(documents) > 0 and 'source' in documents[0].metadata:
+                    source_path = documents[0].metadata['source']
+                    # 先清理向量庫中可能存在的相關文檔
+                    log_message(f"檢查並清理文件路徑 {source_path} 的現有文檔...")
+                    self.vector_manager.delete_documents_by_source(source_path)
+                
+                # 再次嘗試直接用file_id清理
+                log_message(f"檢查並清理文件ID {file_id} 的現有文檔...")
+                self.vector_manager.delete_file(file_id)
             
             # 最後添加新文檔到向量庫
             log_message(f"開始添加 {len(documents)} 個新文檔到向量庫...")
-            self.vector_manager.add_documents(documents)
+            with self._stage('embed'):
+                self.vector_manager.add_documents(documents, self.embed_batch_size)
             log_message(f"已成功將 {len(documents)} 個文檔添加到向量存儲")
+            return True
         except Exception as e:
             log_message(f"添加文檔到向量存儲時出錯: {str(e)}")
             import traceback
             traceback.print_exc()
+            return False
+    
+    def _get_parser_pool(self) -> ProcessPoolExecutor:
+        """
+        獲取（必要時創建）解析進程池
+        
+        使用 spawn 啟動方式，避免在多執行緒的 Web 進程中 fork 帶來的鎖狀態問題。
+        
+        Returns:
+            進程池
+        """
+        with self._parser_pool_lock:
+            if self._parser_pool is None:
+                self._parser_pool = ProcessPoolExecutor(
+                    max_workers=self.parser_processes,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                log_message(f"已啟動解析進程池，進程數: {self.parser_processes}")
+            return self._parser_pool
+    
+    def _reset_parser_pool(self, pool: ProcessPoolExecutor) -> None:
+        """
+        丟棄已損壞的解析進程池，下次解析時重建
+        
+        Args:
+            pool: 出錯的進程池；其他工作者已重建的新進程池不受影響
+        """
+        with self._parser_pool_lock:
+            if self._parser_pool is pool:
+                self._parser_pool = None
+        pool.shutdown(wait=False)
+    
+    def _parse_file(self, file_path: str) -> Dict[str, Any]:
+        """
+        在解析進程池中載入、清洗並分割文件，進程池不可用時退回當前進程
+        
+        Args:
+            file_path: 文件路徑
+            
+        Returns:
+            parse_file 返回的暫存文件信息（文本塊文件路徑、文本塊數與完整文本）
+        """
+        parser_settings = {key: self.settings[key] for key in PARSER_SETTING_KEYS if key in self.settings}
+        if self.parser_processes <= 0:
+            return parse_file(file_path, parser_settings)
+        
+        pool = self._get_parser_pool()
+        try:
+            return pool.submit(parse_file, file_path, parser_settings).result()
+        except BrokenProcessPool as e:
+            # 子進程異常退出（例如被 OOM 終止），重建進程池並在當前進程內重試一次
+            log_message(f"解析進程池已損壞: {str(e)}，改為在當前進程內解析")
+            self._reset_parser_pool(pool)
+            return parse_file(file_path, parser_settings)
     
-    def process_file(self, file_id: str, file_path: str) -> List[Document]:
+    def process_file(self, file_id: str, file_path: str, documents: Optional[List[Document]] = None) -> int:
         """
         處理文件
         
+        解析結果暫存在臨時文件中，文本塊按 embed_batch_size 分批經過去重、上下文生成與嵌入，
+        記憶體中同時只有一批文本塊；上下文生成按窗口從暫存的完整文本中讀取。
+        
         Args:
             file_id: 文件ID
             file_path: 文件路徑
+            documents: 收集寫入向量庫的文檔的列表（例如用於更新 BM25 索引），為 None 時不保留
             
         Returns:
-            分割後的文檔列表
+            寫入向量庫的文本塊數，失敗或被取消時為 0
         """
         if not os.path.exists(file_path):
             log_message(f"文件不存在: {file_path}")
-            return []
+            return 0
         
         file_extension = os.path.splitext(file_path)[1].lower().replace('.', '')
+        parsed = None
+        # 去重登記的簽名與已寫入的批次在整個文件完成之前已生效，未完成時必須撤銷，
+        # 否則後續上傳的相同內容會被誤判為重複，向量庫中也會殘留不完整的文件
+        dedup_registered = False
+        written = 0
+        completed = False
         
         try:
             if file_extension not in self.loaders:
                 log_message(f"不支持的文件類型: {file_extension}")
-                return []
+                return 0
             
             # 檢查是否取消
             if self._check_cancelled(file_id):
-                return []
+                return 0
             
-            loader = self.loaders[file_extension](file_path)
-            documents = loader.load()
+            # 載入、清洗與分割在解析進程池中執行，避免佔用 Web 進程的 GIL
+            with self._stage('parse'):
+                parsed = self._parse_file(file_path)
             
             # 檢查是否取消
             if self._check_cancelled(file_id):
-                return []
+                return 0
             
-            cleaned_documents = self._clean_documents(documents)
+            use_contexts = self.settings.get('use_contextual_embeddings', True) and parsed['document'] is not None
+            batch_size = self.embed_batch_size if self.embed_batch_size > 0 else max(1, parsed['chunk_count'])
+            if self.deduplicator is not None:
+                # 重新處理時先移除本文件舊的簽名，避免與自己比對
+                self.deduplicator.remove_file(file_id, keep_links=True)
+                dedup_registered = True
             
-            if self.settings.get('use_intelligent_splitting', True):
-                whole_document = "\n\n".join([doc.page_content for doc in cleaned_documents])
-                
-                # 檢查是否取消
-                if self._check_cancelled(file_id):
-                    return []
-                
-                chunks = self._improved_text_splitting(whole_document)
-                
-                page_map = {}
-                current_pos = 0
-                for doc in cleaned_documents:
-                    doc_length = len(doc.page_content)
-                    for i in range(current_pos, current_pos + doc_length):
-                        page_map[i] = doc.metadata.get('page', 0)
-                    current_pos += doc_length
-                
+            chunks = iter_spooled_chunks(parsed['chunks_path'])
+            for offset in range(0, parsed['chunk_count'], batch_size):
                 chunked_documents = []
-                current_pos = 0
-                for i, chunk in enumerate(chunks):
-                    # 檢查是否取消
-                    if self._check_cancelled(file_id):
-                        return []
-                    
-                    chunk_length = len(chunk)
-                    chunk_pages = set()
-                    for j in range(current_pos, min(current_pos + chunk_length, len(whole_document))):
-                        if j in page_map:
-                            chunk_pages.add(page_map[j])
-                    
-                    page_number = min(chunk_pages) if chunk_pages else 0
-                    
+                for i, chunk in enumerate(itertools.islice(chunks, batch_size), offset):
                     chunked_documents.append(Document(
-                        page_content=chunk,
+                        page_content=chunk['content'],
                         metadata={
                             'file_id': file_id,
                             'source': file_path,
-                            'page': page_number,
-                            'chunk_id': i
+                            'page': chunk['page'],
+                            'chunk_id': i,
+                            # 文本塊在完整清洗後文本中的位置，上下文窗口與定位直接使用，無需子串搜尋
+                            'start_index': chunk['start'],
+                            'end_index': chunk['end'],
+                            # 沒有生成上下文的文本塊前綴長度為 0，查詢時不會誤切文本塊自身的段落
+                            CONTEXT_PREFIX_METADATA_KEY: 0
                         }
                     ))
-                    current_pos += chunk_length
-            else:
-                # 檢查是否取消
-                if self._check_cancelled(file_id):
-                    return []
                 
-                chunked_documents = self.text_splitter.split_documents(cleaned_documents)
-                for doc in chunked_documents:
-                    doc.metadata['file_id'] = file_id
-            
-            # 檢查是否取消
-            if self._check_cancelled(file_id):
-                return []
-            
-            if self.settings.get('use_contextual_embeddings', True):
-                whole_document = "\n\n".join([doc.page_content for doc in cleaned_documents])
-                enhanced_documents = []
-                for doc in chunked_documents:
-                    # 檢查是否取消
-                    if self._check_cancelled(file_id):
-                        return []
+                # 在生成上下文與嵌入之前處理近似重複塊，重複內容不再消耗 LLM 與向量庫資源
+                if self.deduplicator is not None:
+                    chunked_documents = self.deduplicator.process(file_id, chunked_documents, reset=False)
+                    if not chunked_documents:
+                        continue
+                
+                if use_contexts and self.llm is not None:
+                    spans = [(doc.metadata['start_index'], doc.metadata['end_index']) for doc in chunked_documents]
                     
-                    context = self._generate_chunk_context(whole_document, doc.page_content)
-                    if context:
-                        enhanced_content = f"{context}\n\n{doc.page_content}"
-                        enhanced_doc = Document(
-                            page_content=enhanced_content,
-                            metadata=doc.metadata
+                    # 並發生成上下文（批量模式下同一窗口的文本塊共用一次調用），等待期間定期檢查是否取消；
+                    # 生成失敗時拋出 ContextGenerationError，文件處理失敗並由攝取佇列重試，而不是寫入沒有上下文的文本塊
+                    with self._stage('context'):
+                        contexts = self.context_generator.generate_for_document(
+                            parsed['document'], spans, lambda: self._check_cancelled(file_id)
                         )
-                        enhanced_documents.append(enhanced_doc)
-                    else:
-                        enhanced_documents.append(doc)
-                chunked_documents = enhanced_documents
-            
-            # 檢查是否取消
-            if self._check_cancelled(file_id):
-                return []
+                    if contexts is None:
+                        return 0
+                    
+                    enhanced_documents = []
+                    for doc, context in zip(chunked_documents, contexts):
+                        if context:
+                            enhanced_content = f"{context}\n\n{doc.page_content}"
+                            # 記錄前綴長度，查詢時可準確去除只用於檢索的上下文描述
+                            enhanced_doc = Document(
+                                page_content=enhanced_content,
+                                metadata={**doc.metadata, CONTEXT_PREFIX_METADATA_KEY: len(context) + 2}
+                            )
+                            enhanced_documents.append(enhanced_doc)
+                        else:
+                            enhanced_documents.append(doc)
+                    chunked_documents = enhanced_documents
+                
+                # 檢查是否取消
+                if self._check_cancelled(file_id):
+                    return 0
+                
+                if not self._add_documents_to_vectorstore(chunked_documents, file_id, replace_existing=written == 0):
+                    return 0
+                written += len(chunked_documents)
+                if documents is not None:
+                    documents.extend(chunked_documents)
             
-            self._add_documents_to_vectorstore(chunked_documents, file_id)
-            log_message(f"文件 {file_id} 處理完成，共 {len(chunked_documents)} 個文檔塊")
-            return chunked_documents
+            completed = True
+            if written == 0:
+                log_message(f"文件 {file_id} 的所有文本塊均與已有內容重複")
+                return 0
+            log_message(f"文件 {file_id} 處理完成，共 {written} 個文檔塊")
+            return written
             
         except Exception as e:
             log_message(f"處理文件 {file_id} 時出錯: {str(e)}")
-            return []
+            return 0
+        finally:
+            if parsed is not None:
+                remove_spool(parsed)
+            if not completed:
+                if dedup_registered:
+                    try:
+                        self.deduplicator.remove_file(file_id, keep_links=True)
+                    except Exception as e:
+                        log_message(f"撤銷文件 {file_id} 的去重登記時出錯: {str(e)}")
+                if written:
+                    try:
+                        self.vector_manager.delete_file(file_id)
+                    except Exception as e:
+                        log_message(f"清理文件 {file_id} 已寫入的文檔時出錯: {str(e)}")
+                if documents is not None:
+                    documents.clear()
     
     def add_document(self, file_path: str, file_id: str, original_filename: str) -> List[Document]:
         """
         添加文檔到RAG系統
         
+        與 process_file 使用相同的解析流程，文本塊位置來自分割器輸出的偏移量。
+        
         Args:
             file_path: 文件路徑
             file_id: 文件ID
@@ -370,80 +427,10 @@ class FileProcessor:
         Returns:
             分割後的文檔列表
         """
-        if not os.path.exists(file_path):
-            log_message(f"文件不存在: {file_path}")
-            return []
-        
-        file_ext = os.path.splitext(file_path)[1].lower().replace('.', '')
-        if file_ext not in self.loaders:
-            log_message(f"不支持的文件類型: {file_ext}")
-            return []
-        
-        try:
-            # 檢查是否取消
-            if self._check_cancelled(file_id):
-                return []
-            
-            loader = self.loaders[file_ext](file_path)
-            documents = loader.load()
-            whole_document = "\n\n".join([doc.page_content for doc in documents])
-            chunked_documents = []
-            
-            if self.settings.get('use_intelligent_splitting', True):
-                # 檢查是否取消
-                if self._check_cancelled(file_id):
-                    return []
-                
-                chunks = self._improved_text_splitting(whole_document)
-                for i, chunk in enumerate(chunks):
-                    # 檢查是否取消
-                    if self._check_cancelled(file_id):
-                        return []
-                    
-                    if self.settings.get('use_contextual_embeddings', True):
-                        context = self._generate_chunk_context(whole_document, chunk)
-                        enhanced_chunk = f"{context}\n\n{chunk}" if context else chunk
-                    else:
-                        enhanced_chunk = chunk
-                    chunked_documents.append(Document(
-                        page_content=enhanced_chunk,
-                        metadata={
-                            'file_id': file_id,
-                            'source': file_path,
-                            'page': 0,
-                            'chunk_id': i
-                        }
-                    ))
-            else:
-                # 檢查是否取消
-                if self._check_cancelled(file_id):
-                    return []
-                
-                cleaned_documents = self._clean_documents(documents)
-                chunked_documents = self.text_splitter.split_documents(cleaned_documents)
-                for i, doc in enumerate(chunked_documents):
-                    doc.metadata['file_id'] = file_id
-                    if self.settings.get('use_contextual_embeddings', True):
-                        # 檢查是否取消
-                        if self._check_cancelled(file_id):
-                            return []
-                        
-                        context = self._generate_chunk_context(whole_document, doc.page_content)
-                        if context:
-                            doc.page_content = f"{context}\n\n{doc.page_content}"
-            
-            # 檢查是否取消
-            if self._check_cancelled(file_id):
-                return []
-            
-            self._add_documents_to_vectorstore(chunked_documents, file_id)
+        chunked_documents = []
+        if self.process_file(file_id, file_path, chunked_documents):
             log_message(f"成功添加文件: {original_filename}, 共 {len(chunked_documents)} 個文本塊")
-            return chunked_documents
-        except Exception as e:
-            log_message(f"添加文檔時出錯: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return []
+        return chunked_documents
     
     def update_settings(self, new_settings: dict) -> None:
         """
@@ -454,8 +441,4 @@ class FileProcessor:
         """
         self.settings.update(new_settings)
         if 'chunk_size' in new_settings or 'chunk_overlap' in new_settings:
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.settings['chunk_size'],
-                chunk_overlap=self.settings['chunk_overlap'],
-                separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
-            )
\ No newline at end of file
+            self.text_splitter = create_text_splitter(self.settings['chunk_size'], self.settings['chunk_overlap'])
\ No newline at end of file
@@ -0,0 +1,865 @@
+"""
+Job Queue - 持久化文件攝取任務佇列
+以資料庫保存攝取任務，並由有界的工作執行緒池依序處理，支援重試、重啟後恢復與分階段並發限制
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+JOB_STATUSES = ['queued', 'running', 'succeeded', 'failed', 'cancelled']
+
+# 優先級類別，數值越小越先處理
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# 每次領取時考慮的候選任務數量（每種排序各取這麼多），以及參與公平調度的提交者數量上限
+CANDIDATE_LIMIT = 20
+MAX_FAIR_OWNERS = 20
+
+DEFAULT_QUEUE_CONFIG = {
+    'BACKEND': 'django',
+    'SQLITE_PATH': 'ingestion_queue.sqlite3',
+    'AUTOSTART': True,
+    'WORKERS': 2,
+    'STAGE_CONCURRENCY': {'parse': 2, 'context': 1, 'embed': 1},
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF_SECONDS': 30,
+    'LEASE_SECONDS': 300,
+    'POLL_INTERVAL_SECONDS': 2,
+    'PRIORITY_AGING_SECONDS': 600,
+    'ETA_SAMPLE_SIZE': 50,
+    'ETA_DEFAULT_OVERHEAD_SECONDS': 10,
+    'ETA_DEFAULT_BYTES_PER_SECOND': 50000,
+}
+
+def rank_candidates(candidates: List[Dict[str, Any]], running_by_owner: Dict[str, int],
+                    now: float, aging_seconds: float) -> List[Dict[str, Any]]:
+    """
+    按調度策略排序候選任務
+
+    依次比較：租約過期的執行中任務（中斷後恢復）優先；優先級類別（等待超過 aging_seconds 的任務
+    視為互動式，避免批量任務飢餓）；提交者當前執行中的任務數（少者優先，保證用戶間公平）；
+    文件大小（短任務優先）；創建時間。
+
+    Args:
+        candidates: 候選任務字典列表
+        running_by_owner: {提交者: 執行中任務數}
+        now: 當前時間戳
+        aging_seconds: 優先級老化時間（秒），0 表示不老化
+
+    Returns:
+        排序後的候選任務列表
+    """
+    def sort_key(job: Dict[str, Any]) -> Tuple:
+        priority = job['priority']
+        if aging_seconds and now - job['created_ts'] >= aging_seconds:
+            priority = min(priority, PRIORITY_INTERACTIVE)
+        return (
+            job['status'] != 'running',
+            priority,
+            running_by_owner.get(job['owner'], 0),
+            job['size_bytes'],
+            job['created_ts'],
+        )
+    return sorted(candidates, key=sort_key)
+
+def _file_size(file_path: str) -> int:
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+class DjangoJobStore:
+    """使用 Django ORM（IngestionJob 模型）保存任務"""
+
+    def _model(self):
+        from django.apps import apps
+        return apps.get_model('api', 'IngestionJob')
+
+    def _to_dict(self, job) -> Dict[str, Any]:
+        return {
+            'id': str(job.id),
+            'file_id': str(job.file_id),
+            'file_path': job.file_path,
+            'status': job.status,
+            'attempts': job.attempts,
+            'max_attempts': job.max_attempts,
+            'priority': job.priority,
+            'size_bytes': job.size_bytes,
+            'owner': job.owner,
+            'created_ts': job.created_at.timestamp(),
+            'available_ts': job.available_at.timestamp(),
+            'started_ts': job.started_at.timestamp() if job.started_at else None,
+        }
+
+    def enqueue(self, file_id: str, file_path: str, max_attempts: int,
+                priority: int = PRIORITY_INTERACTIVE, size_bytes: int = 0, owner: str = '') -> str:
+        IngestionJob = self._model()
+        job = IngestionJob.objects.create(
+            file_id=file_id, file_path=file_path, max_attempts=max_attempts,
+            priority=priority, size_bytes=size_bytes, owner=owner
+        )
+        return str(job.id)
+
+    def enqueue_many(self, items: List[Tuple[str, str, int]], max_attempts: int,
+                     priority: int = PRIORITY_BULK, owner: str = '') -> int:
+        IngestionJob = self._model()
+        jobs = [
+            IngestionJob(file_id=file_id, file_path=file_path, max_attempts=max_attempts,
+                         priority=priority, size_bytes=size_bytes, owner=owner)
+            for file_id, file_path, size_bytes in items
+        ]
+        IngestionJob.objects.bulk_create(jobs, batch_size=500)
+        return len(jobs)
+
+    def claim(self, lease_seconds: float, aging_seconds: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        領取一個可執行的任務（排隊中或租約已過期的執行中任務），順序見 rank_candidates
+
+        Args:
+            lease_seconds: 租約長度（秒）
+            aging_seconds: 優先級老化時間（秒）
+
+        Returns:
+            任務字典，沒有可執行任務時返回 None
+        """
+        from django.db.models import Count, F, Q
+        from django.utils import timezone
+
+        IngestionJob = self._model()
+        now = timezone.now()
+        available = Q(status='queued', available_at__lte=now)
+        claimable = available | Q(status='running', locked_until__lt=now)
+
+        # 候選集：租約過期的任務、按 (優先級, 大小) 最靠前的任務、等待最久的任務，以及每個提交者最靠前的任務
+        querysets = [
+            IngestionJob.objects.filter(status='running', locked_until__lt=now).order_by('locked_until')[:CANDIDATE_LIMIT],
+            IngestionJob.objects.filter(available).order_by('priority', 'size_bytes', 'created_at')[:CANDIDATE_LIMIT],
+            IngestionJob.objects.filter(available).order_by('created_at')[:CANDIDATE_LIMIT],
+        ]
+        owners = IngestionJob.objects.filter(available).order_by().values_list('owner', flat=True).distinct()[:MAX_FAIR_OWNERS]
+        for owner in owners:
+            querysets.append(
+                IngestionJob.objects.filter(available, owner=owner).order_by('priority', 'size_bytes', 'created_at')[:1]
+            )
+        candidates = {}
+        for queryset in querysets:
+            for job in queryset:
+                candidates[job.id] = self._to_dict(job)
+        if not candidates:
+            return None
+
+        running_by_owner = dict(
+            IngestionJob.objects.filter(status='running', locked_until__gte=now)
+            .order_by().values_list('owner').annotate(total=Count('id'))
+        )
+        for candidate in rank_candidates(list(candidates.values()), running_by_owner, now.timestamp(), aging_seconds):
+            job_id = candidate['id']
+            # 以條件更新實現原子領取，避免多個工作者（或多個進程）領取同一任務
+            updated = IngestionJob.objects.filter(claimable, id=job_id).update(
+                status='running',
+                attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=lease_seconds),
+                started_at=now,
+                updated_at=now,
+            )
+            if updated:
+                return self._to_dict(IngestionJob.objects.get(id=job_id))
+        return None
+
+    def extend_lease(self, job_ids: List[str], lease_seconds: float) -> None:
+        from django.utils import timezone
+
+        if not job_ids:
+            return
+        IngestionJob = self._model()
+        IngestionJob.objects.filter(id__in=job_ids, status='running').update(
+            locked_until=timezone.now() + timedelta(seconds=lease_seconds)
+        )
+
+    def finish(self, job_id: str, attempts: int, status: str, error: str = '') -> bool:
+        """
+        結束任務；只更新第 attempts 次領取，租約過期後被重新領取的任務不受舊工作者影響
+
+        Args:
+            job_id: 任務ID
+            attempts: 領取時的嘗試次數
+            status: 最終狀態
+            error: 錯誤信息
+
+        Returns:
+            是否更新成功
+        """
+        from django.utils import timezone
+
+        IngestionJob = self._model()
+        now = timezone.now()
+        return bool(IngestionJob.objects.filter(id=job_id, attempts=attempts).update(
+            status=status, last_error=error, locked_until=None, finished_at=now, updated_at=now
+        ))
+
+    def retry(self, job_id: str, attempts: int, delay_seconds: float, error: str = '') -> bool:
+        """
+        將任務放回佇列，延遲 delay_seconds 後可再次領取（與 finish 相同，只更新第 attempts 次領取）
+
+        Args:
+            job_id: 任務ID
+            attempts: 領取時的嘗試次數
+            delay_seconds: 延遲秒數
+            error: 錯誤信息
+
+        Returns:
+            是否更新成功
+        """
+        from django.utils import timezone
+
+        IngestionJob = self._model()
+        now = timezone.now()
+        return bool(IngestionJob.objects.filter(id=job_id, attempts=attempts).update(
+            status='queued',
+            last_error=error,
+            locked_until=None,
+            available_at=now + timedelta(seconds=delay_seconds),
+            updated_at=now,
+        ))
+
+    def cancel_file(self, file_id: str) -> int:
+        from django.utils import timezone
+
+        IngestionJob = self._model()
+        return IngestionJob.objects.filter(file_id=file_id, status='queued').update(
+            status='cancelled', finished_at=timezone.now()
+        )
+
+    def stats(self) -> Dict[str, int]:
+        from django.db.models import Count
+
+        IngestionJob = self._model()
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in IngestionJob.objects.values('status').annotate(total=Count('id')):
+            counts[row['status']] = row['total']
+        return counts
+
+    def file_job(self, file_id: str) -> Optional[Dict[str, Any]]:
+        job = self._model().objects.filter(file_id=file_id).order_by('-created_at').first()
+        return self._to_dict(job) if job else None
+
+    def queue_ahead(self, job: Dict[str, Any]) -> Tuple[int, int]:
+        from django.db.models import Count, Q, Sum
+
+        created_at = datetime.fromtimestamp(job['created_ts'], tz=dt_timezone.utc)
+        ahead = (
+            Q(priority__lt=job['priority'])
+            | Q(priority=job['priority'], size_bytes__lt=job['size_bytes'])
+            | Q(priority=job['priority'], size_bytes=job['size_bytes'], created_at__lt=created_at)
+        )
+        result = self._model().objects.filter(ahead, status='queued').aggregate(count=Count('id'), total=Sum('size_bytes'))
+        return result['count'], result['total'] or 0
+
+    def running_jobs(self) -> List[Dict[str, Any]]:
+        from django.utils import timezone
+
+        jobs = self._model().objects.filter(status='running', locked_until__gte=timezone.now())
+        return [self._to_dict(job) for job in jobs]
+
+    def recent_durations(self, limit: int) -> List[Tuple[int, float]]:
+        rows = (
+            self._model().objects.filter(status='succeeded', started_at__isnull=False, finished_at__isnull=False)
+            .order_by('-finished_at').values_list('size_bytes', 'started_at', 'finished_at')[:limit]
+        )
+        return [(size_bytes, (finished_at - started_at).total_seconds()) for size_bytes, started_at, finished_at in rows]
+
+class SQLiteJobStore:
+    """使用獨立 SQLite 檔案保存任務，不依賴 Django 資料庫"""
+
+    def __init__(self, db_path: str):
+        """
+        初始化 SQLite 任務存儲
+
+        Args:
+            db_path: SQLite 數據庫路徑
+        """
+        self.db_path = str(db_path)
+        self._initialize_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _initialize_table(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                last_error TEXT NOT NULL DEFAULT '',
+                available_at REAL NOT NULL,
+                locked_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL DEFAULT '',
+                started_at REAL
+            )
+            ''')
+            # 為舊版本創建的資料表補上調度相關的欄位
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(ingestion_jobs)')}
+            for column, definition in [
+                ('priority', 'INTEGER NOT NULL DEFAULT 0'),
+                ('size_bytes', 'INTEGER NOT NULL DEFAULT 0'),
+                ('owner', "TEXT NOT NULL DEFAULT ''"),
+                ('started_at', 'REAL'),
+            ]:
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE ingestion_jobs ADD COLUMN {column} {definition}')
+            conn.execute('CREATE INDEX IF NOT EXISTS ingestion_jobs_status ON ingestion_jobs (status, available_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ingestion_jobs_schedule ON ingestion_jobs (status, priority, size_bytes)')
+        finally:
+            conn.close()
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'file_id': row['file_id'],
+            'file_path': row['file_path'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'priority': row['priority'],
+            'size_bytes': row['size_bytes'],
+            'owner': row['owner'],
+            'created_ts': row['created_at'],
+            'available_ts': row['available_at'],
+            'started_ts': row['started_at'],
+        }
+
+    def enqueue(self, file_id: str, file_path: str, max_attempts: int,
+                priority: int = PRIORITY_INTERACTIVE, size_bytes: int = 0, owner: str = '') -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('''
+            INSERT INTO ingestion_jobs (id, file_id, file_path, max_attempts, priority, size_bytes, owner,
+                                        available_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, file_id, file_path, max_attempts, priority, size_bytes, owner, now, now, now))
+        finally:
+            conn.close()
+        return job_id
+
+    def enqueue_many(self, items: List[Tuple[str, str, int]], max_attempts: int,
+                     priority: int = PRIORITY_BULK, owner: str = '') -> int:
+        now = time.time()
+        rows = [
+            (str(uuid.uuid4()), file_id, file_path, max_attempts, priority, size_bytes, owner, now, now, now)
+            for file_id, file_path, size_bytes in items
+        ]
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+            INSERT INTO ingestion_jobs (id, file_id, file_path, max_attempts, priority, size_bytes, owner,
+                                        available_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def claim(self, lease_seconds: float, aging_seconds: float = 0) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 取得寫鎖，保證同一時間只有一個工作者在領取
+            conn.execute('BEGIN IMMEDIATE')
+            available = "status = 'queued' AND available_at <= ?"
+            queries = [
+                ("SELECT * FROM ingestion_jobs WHERE status = 'running' AND locked_until < ? ORDER BY locked_until LIMIT ?", (now, CANDIDATE_LIMIT)),
+                (f"SELECT * FROM ingestion_jobs WHERE {available} ORDER BY priority, size_bytes, created_at LIMIT ?", (now, CANDIDATE_LIMIT)),
+                (f"SELECT * FROM ingestion_jobs WHERE {available} ORDER BY created_at LIMIT ?", (now, CANDIDATE_LIMIT)),
+            ]
+            owners = [row['owner'] for row in conn.execute(
+                f"SELECT DISTINCT owner FROM ingestion_jobs WHERE {available} LIMIT ?", (now, MAX_FAIR_OWNERS)
+            )]
+            for owner in owners:
+                queries.append((
+                    f"SELECT * FROM ingestion_jobs WHERE {available} AND owner = ? ORDER BY priority, size_bytes, created_at LIMIT 1",
+                    (now, owner)
+                ))
+            candidates = {}
+            for sql, params in queries:
+                for row in conn.execute(sql, params):
+                    candidates[row['id']] = self._to_dict(row)
+            if not candidates:
+                conn.execute('COMMIT')
+                return None
+
+            running_by_owner = {
+                row['owner']: row['total'] for row in conn.execute(
+                    "SELECT owner, COUNT(*) AS total FROM ingestion_jobs WHERE status = 'running' AND locked_until >= ? GROUP BY owner",
+                    (now,)
+                )
+            }
+            job = rank_candidates(list(candidates.values()), running_by_owner, now, aging_seconds)[0]
+            conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'running', attempts = attempts + 1, locked_until = ?, started_at = ?, updated_at = ?
+            WHERE id = ?
+            ''', (now + lease_seconds, now, now, job['id']))
+            conn.execute('COMMIT')
+            job['status'] = 'running'
+            job['attempts'] += 1
+            job['started_ts'] = now
+            return job
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def extend_lease(self, job_ids: List[str], lease_seconds: float) -> None:
+        if not job_ids:
+            return
+        conn = self._connect()
+        try:
+            placeholders = ','.join('?' * len(job_ids))
+            conn.execute(
+                f"UPDATE ingestion_jobs SET locked_until = ? WHERE status = 'running' AND id IN ({placeholders})",
+                (time.time() + lease_seconds, *job_ids)
+            )
+        finally:
+            conn.close()
+
+    def finish(self, job_id: str, attempts: int, status: str, error: str = '') -> bool:
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = ?, last_error = ?, locked_until = NULL, finished_at = ?, updated_at = ?
+            WHERE id = ? AND attempts = ?
+            ''', (status, error, now, now, job_id, attempts))
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def retry(self, job_id: str, attempts: int, delay_seconds: float, error: str = '') -> bool:
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = 'queued', last_error = ?, locked_until = NULL, available_at = ?, updated_at = ?
+            WHERE id = ? AND attempts = ?
+            ''', (error, now + delay_seconds, now, job_id, attempts))
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def cancel_file(self, file_id: str) -> int:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE ingestion_jobs SET status = 'cancelled', finished_at = ? WHERE file_id = ? AND status = 'queued'",
+                (time.time(), file_id)
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        counts = {status: 0 for status in JOB_STATUSES}
+        conn = self._connect()
+        try:
+            for row in conn.execute('SELECT status, COUNT(*) AS total FROM ingestion_jobs GROUP BY status'):
+                counts[row['status']] = row['total']
+        finally:
+            conn.close()
+        return counts
+
+    def file_job(self, file_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT * FROM ingestion_jobs WHERE file_id = ? ORDER BY created_at DESC LIMIT 1', (file_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row) if row else None
+
+    def queue_ahead(self, job: Dict[str, Any]) -> Tuple[int, int]:
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+            SELECT COUNT(*) AS count, COALESCE(SUM(size_bytes), 0) AS total FROM ingestion_jobs
+            WHERE status = 'queued' AND (
+                priority < ? OR (priority = ? AND size_bytes < ?)
+                OR (priority = ? AND size_bytes = ? AND created_at < ?)
+            )
+            ''', (job['priority'], job['priority'], job['size_bytes'],
+                  job['priority'], job['size_bytes'], job['created_ts'])).fetchone()
+        finally:
+            conn.close()
+        return row['count'], row['total']
+
+    def running_jobs(self) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE status = 'running' AND locked_until >= ?", (time.time(),)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._to_dict(row) for row in rows]
+
+    def recent_durations(self, limit: int) -> List[Tuple[int, float]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+            SELECT size_bytes, finished_at - started_at AS seconds FROM ingestion_jobs
+            WHERE status = 'succeeded' AND started_at IS NOT NULL AND finished_at IS NOT NULL
+            ORDER BY finished_at DESC LIMIT ?
+            ''', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [(row['size_bytes'], row['seconds']) for row in rows]
+
+class IngestionQueue:
+    """攝取任務佇列，負責任務的持久化、領取、重試與分階段並發控制"""
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], str], config: Optional[Dict[str, Any]] = None,
+                 on_exhausted: Optional[Callable[[Dict[str, Any], str], None]] = None):
+        """
+        初始化攝取任務佇列
+
+        Args:
+            handler: 任務處理函數，接收任務字典並返回 'succeeded'、'failed' 或 'cancelled'
+            config: 佇列配置（見 settings.RAG_INGESTION_QUEUE）
+            on_exhausted: 任務未經 handler 直接失敗時的回調（租約過期後重新領取但已用盡重試次數，
+                例如處理進程反覆因記憶體不足退出），接收任務字典與錯誤信息
+        """
+        self.handler = handler
+        self.on_exhausted = on_exhausted
+        self.config = {**DEFAULT_QUEUE_CONFIG, **(config or {})}
+
+        if self.config['BACKEND'] == 'sqlite':
+            self.store = SQLiteJobStore(self.config['SQLITE_PATH'])
+        else:
+            self.store = DjangoJobStore()
+
+        self._stage_limits = dict(self.config['STAGE_CONCURRENCY'])
+        self._stage_semaphores = {
+            name: threading.BoundedSemaphore(max(1, int(limit)))
+            for name, limit in self._stage_limits.items()
+        }
+        self._stage_in_use = {name: 0 for name in self._stage_limits}
+        self._lock = threading.Lock()
+        self._active_jobs = set()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._duration_model = None
+        self._duration_model_at = 0.0
+
+    def start(self, force: bool = False) -> None:
+        """
+        啟動工作執行緒池與租約心跳執行緒（重複調用無副作用）
+
+        Args:
+            force: 忽略 AUTOSTART 設置
+        """
+        with self._lock:
+            if self._threads or not (force or self.config['AUTOSTART']):
+                return
+            self._stopping.clear()
+            for i in range(max(1, int(self.config['WORKERS']))):
+                thread = threading.Thread(target=self._worker_loop, name=f"ingestion-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            heartbeat = threading.Thread(target=self._heartbeat_loop, name="ingestion-heartbeat", daemon=True)
+            heartbeat.start()
+            self._threads.append(heartbeat)
+        log_message(f"攝取任務佇列已啟動，工作者數量: {self.config['WORKERS']}，後端: {self.config['BACKEND']}")
+
+    def stop(self) -> None:
+        """通知所有工作執行緒在當前任務完成後停止"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def enqueue(self, file_id: str, file_path: str, priority: int = PRIORITY_INTERACTIVE, owner: str = '') -> str:
+        """
+        將文件加入攝取佇列
+
+        Args:
+            file_id: 文件ID
+            file_path: 文件路徑
+            priority: 優先級類別（PRIORITY_INTERACTIVE 或 PRIORITY_BULK）
+            owner: 提交者，用於用戶間的公平調度
+
+        Returns:
+            任務ID
+        """
+        job_id = self.store.enqueue(
+            file_id, file_path, int(self.config['MAX_ATTEMPTS']), priority, _file_size(file_path), owner
+        )
+        log_message(f"文件 {file_id} 已加入攝取佇列，任務ID: {job_id}")
+        self._wakeup.set()
+        return job_id
+
+    def enqueue_many(self, items: List[Tuple[str, str]], priority: int = PRIORITY_BULK, owner: str = '') -> int:
+        """
+        批量將文件加入攝取佇列（單次批量寫入）
+
+        Args:
+            items: [(文件ID, 文件路徑), ...]
+            priority: 優先級類別，默認為批量
+            owner: 提交者
+
+        Returns:
+            加入的任務數量
+        """
+        if not items:
+            return 0
+        rows = [(file_id, file_path, _file_size(file_path)) for file_id, file_path in items]
+        count = self.store.enqueue_many(rows, int(self.config['MAX_ATTEMPTS']), priority, owner)
+        log_message(f"已批量加入 {count} 個攝取任務")
+        self._wakeup.set()
+        return count
+
+    def cancel_file(self, file_id: str) -> int:
+        """
+        取消文件尚未開始的排隊任務
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            被取消的任務數量
+        """
+        return self.store.cancel_file(file_id)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        佔用指定處理階段的一個並發名額，未配置的階段不做限制
+
+        Args:
+            name: 階段名稱（如 parse、context、embed）
+        """
+        semaphore = self._stage_semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        semaphore.acquire()
+        with self._lock:
+            self._stage_in_use[name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stage_in_use[name] -= 1
+            semaphore.release()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        獲取佇列狀態
+
+        Returns:
+            包含各狀態任務數、佇列深度與階段佔用情況的字典
+        """
+        counts = self.store.stats()
+        with self._lock:
+            stages_in_use = dict(self._stage_in_use)
+            active_jobs = len(self._active_jobs)
+        return {
+            **counts,
+            'queue_depth': counts['queued'] + counts['running'],
+            'workers': int(self.config['WORKERS']) if self._threads else 0,
+            'active_jobs': active_jobs,
+            'stage_concurrency': dict(self._stage_limits),
+            'stages_in_use': stages_in_use,
+        }
+
+    def _estimate_durations(self) -> Tuple[float, float]:
+        """
+        以最近成功任務的耗時擬合 耗時 = 固定開銷 + 每字節秒數 * 文件大小（結果快取 60 秒）
+
+        Returns:
+            (固定開銷秒數, 每字節秒數)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._duration_model is not None and now - self._duration_model_at < 60:
+                return self._duration_model
+
+        overhead = float(self.config['ETA_DEFAULT_OVERHEAD_SECONDS'])
+        per_byte = 1.0 / max(1.0, float(self.config['ETA_DEFAULT_BYTES_PER_SECOND']))
+        try:
+            samples = self.store.recent_durations(int(self.config['ETA_SAMPLE_SIZE']))
+        except Exception as e:
+            log_message(f"讀取攝取任務耗時時出錯: {str(e)}")
+            samples = []
+        if samples:
+            count = len(samples)
+            mean_size = sum(size for size, _ in samples) / count
+            mean_seconds = sum(seconds for _, seconds in samples) / count
+            variance = sum((size - mean_size) ** 2 for size, _ in samples)
+            slope = 0.0
+            if variance > 0:
+                slope = sum((size - mean_size) * (seconds - mean_seconds) for size, seconds in samples) / variance
+            if slope > 0 and mean_seconds - slope * mean_size >= 0:
+                overhead, per_byte = mean_seconds - slope * mean_size, slope
+            elif mean_size > 0:
+                # 樣本不足以擬合（大小相同或負相關）時按平均速度估算
+                overhead, per_byte = 0.0, mean_seconds / mean_size
+            else:
+                overhead = mean_seconds
+
+        with self._lock:
+            self._duration_model = (overhead, per_byte)
+            self._duration_model_at = now
+        return overhead, per_byte
+
+    def estimate(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        估算文件處理完成所需的時間
+
+        排在前面的任務按當前調度順序（優先級、大小、創建時間）計算，由所有工作者分擔；
+        執行中任務只計算剩餘的估計時間。未考慮公平調度與優先級老化，結果為近似值。
+
+        Args:
+            file_id: 文件ID
+
+        Returns:
+            包含任務狀態、排隊位置與估計剩餘秒數的字典，文件沒有排隊或執行中的任務時返回 None
+        """
+        job = self.store.file_job(str(file_id))
+        if job is None or job['status'] not in ('queued', 'running'):
+            return None
+
+        overhead, per_byte = self._estimate_durations()
+        now = time.time()
+        duration = overhead + per_byte * job['size_bytes']
+        if job['status'] == 'running':
+            elapsed = now - job['started_ts'] if job['started_ts'] else 0.0
+            seconds = max(0.0, duration - elapsed)
+            jobs_ahead = 0
+        else:
+            jobs_ahead, bytes_ahead = self.store.queue_ahead(job)
+            running_remaining = sum(
+                max(0.0, overhead + per_byte * running['size_bytes'] - (now - (running['started_ts'] or now)))
+                for running in self.store.running_jobs()
+            )
+            backlog = jobs_ahead * overhead + bytes_ahead * per_byte + running_remaining
+            wait_seconds = max(backlog / max(1, int(self.config['WORKERS'])), job['available_ts'] - now)
+            seconds = wait_seconds + duration
+
+        return {
+            'job_id': job['id'],
+            'status': job['status'],
+            'priority': job['priority'],
+            'jobs_ahead': jobs_ahead,
+            'estimated_seconds': seconds,
+            'estimated_ready_at': datetime.fromtimestamp(now + seconds, tz=dt_timezone.utc),
+        }
+
+    def _worker_loop(self) -> None:
+        from django.db import close_old_connections
+
+        while not self._stopping.is_set():
+            close_old_connections()
+            try:
+                job = self.store.claim(self.config['LEASE_SECONDS'], self.config['PRIORITY_AGING_SECONDS'])
+            except Exception as e:
+                log_message(f"領取攝取任務時出錯: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.config['POLL_INTERVAL_SECONDS'])
+                self._wakeup.clear()
+                continue
+
+            self._run_job(job)
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        if job['attempts'] > job['max_attempts']:
+            # 租約過期被重新領取，但已用盡重試次數；handler 不會執行，由 on_exhausted 更新文件狀態
+            error = '超過最大重試次數'
+            try:
+                if self.store.finish(job_id, job['attempts'], 'failed', error):
+                    log_message(f"攝取任務 {job_id} 已用盡重試次數，狀態: failed")
+                    if self.on_exhausted is not None:
+                        self.on_exhausted(job, error)
+            except Exception as e:
+                log_message(f"結束攝取任務 {job_id} 時出錯: {str(e)}")
+            return
+
+        with self._lock:
+            self._active_jobs.add(job_id)
+        outcome = 'failed'
+        error = ''
+        try:
+            log_message(f"開始執行攝取任務 {job_id}（文件 {job['file_id']}，第 {job['attempts']} 次嘗試）")
+            outcome = self.handler(job)
+        except Exception as e:
+            error = str(e)
+            log_message(f"攝取任務 {job_id} 執行出錯: {error}")
+        finally:
+            with self._lock:
+                self._active_jobs.discard(job_id)
+
+        try:
+            if outcome == 'failed' and job['attempts'] < job['max_attempts']:
+                delay = self.config['RETRY_BACKOFF_SECONDS'] * (2 ** (job['attempts'] - 1))
+                updated = self.store.retry(job_id, job['attempts'], delay, error)
+                message = f"攝取任務 {job_id} 失敗，將在 {delay} 秒後重試"
+            else:
+                updated = self.store.finish(job_id, job['attempts'], outcome, error)
+                message = f"攝取任務 {job_id} 結束，狀態: {outcome}"
+            if not updated:
+                # 本次執行期間租約已過期，任務已被其他工作者重新領取，保留新一次嘗試的狀態
+                message = f"攝取任務 {job_id} 已被重新領取，忽略第 {job['attempts']} 次嘗試的結果（{outcome}）"
+            log_message(message)
+        except Exception as e:
+            log_message(f"更新攝取任務 {job_id} 狀態時出錯: {str(e)}")
+
+    def _heartbeat_loop(self) -> None:
+        from django.db import close_old_connections
+
+        interval = max(1.0, self.config['LEASE_SECONDS'] / 3)
+        while not self._stopping.wait(interval):
+            with self._lock:
+                job_ids = list(self._active_jobs)
+            if not job_ids:
+                continue
+            close_old_connections()
+            try:
+                self.store.extend_lease(job_ids, self.config['LEASE_SECONDS'])
+            except Exception as e:
+                log_message(f"延長攝取任務租約時出錯: {str(e)}")
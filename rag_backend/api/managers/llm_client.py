@@ -0,0 +1,270 @@
+"""
+LLM Client - 共用的 LLM 客戶端
+所有 ChatOpenAI 實例共用同一組 HTTP 連接池（保持連接、可選 HTTP/2），統一設置超時與重試，
+並以斷路器在 LLM 服務持續出錯時快速失敗
+"""
+import importlib.util
+import threading
+import time
+from typing import Dict, Any, Optional
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_LLM_CLIENT_CONFIG = {
+    'HTTP2': True,
+    'MAX_CONNECTIONS': None,
+    'MAX_KEEPALIVE_CONNECTIONS': None,
+    'KEEPALIVE_EXPIRY_SECONDS': 60,
+    'CONNECT_TIMEOUT_SECONDS': 5,
+    'READ_TIMEOUT_SECONDS': 60,
+    'MAX_RETRIES': 2,
+    'CIRCUIT_FAILURE_THRESHOLD': 5,
+    'CIRCUIT_RESET_SECONDS': 30,
+}
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+class LLMUnavailableError(Exception):
+    """斷路器打開期間拒絕 LLM 調用"""
+
+def _is_service_failure(error: BaseException) -> bool:
+    """
+    連接錯誤、超時與 5xx 視為服務故障；4xx（如上下文過長）是請求本身的問題，
+    429 表示服務可達但超出配額，由調用方的限流器退避處理，不打開斷路器
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        return True
+    return status >= 500
+
+class CircuitBreaker(BaseCallbackHandler):
+    """
+    斷路器類，以 LangChain 回調掛在聊天模型上，鏈、查詢擴展、上下文生成等所有調用都經過它
+
+    連續 CIRCUIT_FAILURE_THRESHOLD 次調用因服務故障失敗（已包含 SDK 的重試）後打開，CIRCUIT_RESET_SECONDS 內的調用
+    直接拋出 LLMUnavailableError；之後放行一個探測調用，成功則關閉，失敗則重新打開。
+    """
+
+    # 回調中拋出的異常需要中止 LLM 調用
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        """
+        初始化斷路器
+
+        Args:
+            failure_threshold: 打開斷路器的連續失敗次數
+            reset_seconds: 打開後等待多久放行探測調用
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = float(reset_seconds)
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_run_id: Optional[UUID] = None
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self, run_id: UUID) -> None:
+        """
+        調用前檢查斷路器狀態
+
+        Args:
+            run_id: LangChain 調用ID
+
+        Raises:
+            LLMUnavailableError: 斷路器打開，或半開狀態下已有探測調用在進行
+        """
+        now = time.time()
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return
+            if self.state == CIRCUIT_OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_run_id = None
+            if self.state == CIRCUIT_HALF_OPEN:
+                # 探測調用超過 reset_seconds 仍未結束（例如被取消而沒有回調）時，允許新的探測
+                if self._probe_run_id is None or now - self._probe_started_at >= self.reset_seconds:
+                    self._probe_run_id = run_id
+                    self._probe_started_at = now
+                    return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_seconds - (now - self.opened_at))
+        raise LLMUnavailableError(f"LLM 服務暫時不可用（連續 {self.consecutive_failures} 次調用失敗），約 {retry_in:.0f} 秒後重試")
+
+    def record_success(self) -> None:
+        """記錄一次成功的調用，關閉斷路器"""
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                log_message("LLM 服務已恢復，斷路器關閉")
+            self.state = CIRCUIT_CLOSED
+            self.consecutive_failures = 0
+            self._probe_run_id = None
+
+    def record_failure(self, error: BaseException) -> None:
+        """
+        記錄一次失敗的調用
+
+        Args:
+            error: 調用拋出的異常
+        """
+        if not _is_service_failure(error):
+            # 服務可達，只是請求被拒絕
+            self.record_success()
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or (
+                self.state == CIRCUIT_CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.time()
+                self.times_opened += 1
+                self._probe_run_id = None
+                log_message(f"LLM 調用連續失敗 {self.consecutive_failures} 次，斷路器打開 {self.reset_seconds:.0f} 秒: {str(error)}")
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.before_call(run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.before_call(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.record_success()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.record_failure(error)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取斷路器狀態
+
+        Returns:
+            包含狀態、連續失敗次數、打開次數與拒絕次數的字典
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+
+class LLMClient:
+    """
+    LLM 客戶端類
+
+    持有當前的聊天模型（llm）與共用的 httpx 連接池。更新 LLM 設置時只替換模型對象，
+    連接池保留，已建立的 TLS 連接繼續重用；其他組件通過 llm 屬性取得最新的模型。
+    自行重試的調用方（上下文生成）使用 llm_without_retries，避免與 SDK 的重試疊加。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, expected_concurrency: int = 20):
+        """
+        初始化 LLM 客戶端
+
+        Args:
+            config: 配置（見 settings.RAG_LLM_CLIENT）
+            expected_concurrency: 預計同時進行的 LLM 調用數，MAX_CONNECTIONS 未設置時用作連接池上限
+        """
+        self.config = {**DEFAULT_LLM_CLIENT_CONFIG, **(config or {})}
+        self.max_connections = int(self.config['MAX_CONNECTIONS'] or expected_concurrency)
+        self.max_keepalive_connections = int(self.config['MAX_KEEPALIVE_CONNECTIONS'] or self.max_connections)
+        self.http2 = bool(self.config['HTTP2'])
+        if self.http2 and importlib.util.find_spec('h2') is None:
+            log_message("未安裝 h2，LLM 連接使用 HTTP/1.1（pip install httpx[http2] 以啟用 HTTP/2）")
+            self.http2 = False
+        self.circuit_breaker = CircuitBreaker(
+            self.config['CIRCUIT_FAILURE_THRESHOLD'],
+            self.config['CIRCUIT_RESET_SECONDS']
+        )
+        self.llm = None
+        self.llm_without_retries = None
+        self._http_client = None
+        self._http_async_client = None
+        self._lock = threading.Lock()
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.config['READ_TIMEOUT_SECONDS'], connect=self.config['CONNECT_TIMEOUT_SECONDS'])
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.config['KEEPALIVE_EXPIRY_SECONDS']
+        )
+
+    def _http_clients(self) -> tuple:
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(http2=self.http2, limits=self._limits(), timeout=self._timeout())
+                self._http_async_client = httpx.AsyncClient(http2=self.http2, limits=self._limits(),
+                                                            timeout=self._timeout())
+            return self._http_client, self._http_async_client
+
+    def _build(self, model_name: str, temperature: float, max_tokens: int, max_retries: int) -> ChatOpenAI:
+        http_client, http_async_client = self._http_clients()
+        return ChatOpenAI(
+            model_name=model_name,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=self._timeout(),
+            max_retries=max_retries,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            callbacks=[self.circuit_breaker]
+        )
+
+    def configure(self, model_name: str, temperature: float, max_tokens: int) -> ChatOpenAI:
+        """
+        以共用連接池創建聊天模型（及其不帶 SDK 重試的副本）並設為當前模型
+
+        Args:
+            model_name: 模型名稱
+            temperature: 溫度
+            max_tokens: 最大令牌數
+
+        Returns:
+            ChatOpenAI 實例；創建失敗時拋出異常，當前模型保持不變
+        """
+        # 新模型創建完成後一次替換，並發讀取 llm 的調用不會看到 None
+        llm = self._build(model_name, temperature, max_tokens, self.config['MAX_RETRIES'])
+        llm_without_retries = self._build(model_name, temperature, max_tokens, 0)
+        self.llm, self.llm_without_retries = llm, llm_without_retries
+        return llm
+
+    def clear(self) -> None:
+        """清除當前模型（LLM 設置無效時調用）"""
+        self.llm = None
+        self.llm_without_retries = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取客戶端配置與斷路器狀態
+
+        Returns:
+            狀態字典
+        """
+        return {
+            'model': getattr(self.llm, 'model_name', None),
+            'http2': self.http2,
+            'max_connections': self.max_connections,
+            'max_keepalive_connections': self.max_keepalive_connections,
+            'max_retries': self.config['MAX_RETRIES'],
+            'circuit': self.circuit_breaker.stats(),
+        }
@@ -2,71 +2,55 @@
 LLM Manager - LLM 初始化與管理
 """
 from typing import Optional
-from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
+from langchain_core.output_parsers import StrOutputParser
 from langchain.retrievers.document_compressors import LLMChainExtractor
 
 from api.managers.prompt_templates import create_standard_prompt, create_cot_prompt
+from api.managers.reranker import CrossEncoderReranker, DEFAULT_RERANKER_CONFIG
+from api.managers.llm_client import LLMClient
 
 class LLMManager:
     """LLM管理器類，負責初始化和管理LLM及其相關組件"""
     
-    def __init__(self, settings: dict, vector_manager: Optional[any] = None):
+    def __init__(self, settings: dict, vector_manager: Optional[any] = None, reranker_config: Optional[dict] = None,
+                 llm_client: Optional[LLMClient] = None):
         """
         初始化LLM管理器
         
         Args:
             settings: 配置設置字典
-            vector_manager: 向量管理器對象（用於檢索器初始化）
+            vector_manager: 向量管理器對象
+            reranker_config: 重排序器配置（見 settings.RAG_RERANKER）
+            llm_client: 共用的 LLM 客戶端（連接池、超時、重試與斷路器），為 None 時使用默認配置創建
         """
         self.settings = settings
         self.vector_manager = vector_manager
+        self.reranker_config = {**DEFAULT_RERANKER_CONFIG, **(reranker_config or {})}
+        self.llm_client = llm_client or LLMClient()
+        self._cross_encoder = None
         
         # 初始化LLM
         try:
-            self.llm = ChatOpenAI(
-                model_name=self.settings['llm_model'],
-                temperature=self.settings['temperature'],
-                max_tokens=self.settings['max_tokens']
+            self.llm_client.configure(
+                self.settings['llm_model'],
+                self.settings['temperature'],
+                self.settings['max_tokens']
             )
             
             # 初始化提示模板
             self.standard_prompt = create_standard_prompt()
             self.cot_prompt = create_cot_prompt()
             
-            # 如果有向量管理器，初始化QA鏈
-            if self.vector_manager and self.vector_manager.vectorstore:
-                retriever = self.vector_manager.vectorstore.as_retriever()
-                
-                # 初始化標準QA鏈
-                self.qa_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    retriever=retriever,
-                    chain_type="stuff",
-                    chain_type_kwargs={"prompt": self.standard_prompt}
-                )
-                
-                # 初始化思維鏈QA鏈
-                self.cot_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    retriever=retriever,
-                    chain_type="stuff",
-                    chain_type_kwargs={"prompt": self.cot_prompt}
-                )
-                
-                # 初始化重排序器
-                if self.settings['use_reranking']:
-                    self.reranker = LLMChainExtractor.from_llm(self.llm)
-                else:
-                    self.reranker = None
-            else:
-                self.qa_chain = None
-                self.cot_chain = None
-                self.reranker = None
+            # 初始化問答鏈：提示模板直接接收打包好的上下文，檢索由 RAGManager 完成
+            self.qa_chain = self.standard_prompt | self.llm | StrOutputParser()
+            self.cot_chain = self.cot_prompt | self.llm | StrOutputParser()
+            
+            # 初始化重排序器
+            self.reranker = self._create_reranker()
                 
         except Exception as e:
             print(f"初始化LLM時出錯: {str(e)}")
-            self.llm = None
+            self.llm_client.clear()
             self.qa_chain = None
             self.cot_chain = None
             self.reranker = None
@@ -77,50 +61,123 @@ class LLMManager:
         
         Args:
             new_settings: 新設置字典
-            vector_manager: 向量管理器對象（用於更新檢索器）
+            vector_manager: 向量管理器對象
         """
         self.settings.update(new_settings)
         try:
-            self.llm = ChatOpenAI(
-                model_name=self.settings['llm_model'],
-                temperature=self.settings['temperature'],
-                max_tokens=self.settings['max_tokens']
+            # 只替換模型對象，連接池保留；其他組件通過 llm_client 取得新模型
+            self.llm_client.configure(
+                self.settings['llm_model'],
+                self.settings['temperature'],
+                self.settings['max_tokens']
             )
             
             if vector_manager:
                 self.vector_manager = vector_manager
             
-            if self.vector_manager and self.vector_manager.vectorstore:
-                retriever = self.vector_manager.vectorstore.as_retriever()
-                
-                # 更新標準QA鏈
-                self.qa_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    retriever=retriever,
-                    chain_type="stuff",
-                    chain_type_kwargs={"prompt": self.standard_prompt}
-                )
-                
-                # 更新思維鏈QA鏈
-                self.cot_chain = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    retriever=retriever,
-                    chain_type="stuff",
-                    chain_type_kwargs={"prompt": self.cot_prompt}
-                )
-                
-                # 更新重排序器
-                if self.settings['use_reranking']:
-                    self.reranker = LLMChainExtractor.from_llm(self.llm)
-                else:
-                    self.reranker = None
-            else:
-                self.qa_chain = None
-                self.cot_chain = None
-                self.reranker = None
+            # 更新問答鏈
+            self.qa_chain = self.standard_prompt | self.llm | StrOutputParser()
+            self.cot_chain = self.cot_prompt | self.llm | StrOutputParser()
+            
+            # 更新重排序器
+            self.reranker = self._create_reranker()
         except Exception as e:
             print(f"更新LLM設置時出錯: {str(e)}")
-            self.llm = None
+            self.llm_client.clear()
             self.qa_chain = None
             self.cot_chain = None
-            self.reranker = None
\ No newline at end of file
+            self.reranker = None
+    
+    @property
+    def llm(self) -> Optional[any]:
+        """當前的 LLM（由共用的 LLMClient 持有）"""
+        return self.llm_client.llm
+    
+    def _create_reranker(self) -> Optional[any]:
+        """
+        創建重排序器
+        
+        默認使用本地交叉編碼器（實例在設置更新間重用，模型只載入一次）；
+        TYPE 為 llm 時使用逐個文檔調用 LLM 的 LLMChainExtractor。
+        交叉編碼器不可用時按 FALLBACK 改用 LLM 壓縮或不重排序，避免多檢索的候選不經重排序直接截斷。
+        
+        Returns:
+            重排序器，未啟用重排序時返回 None
+        """
+        if not self.settings['use_reranking']:
+            return None
+        if self.reranker_config['TYPE'] == 'llm':
+            return LLMChainExtractor.from_llm(self.llm)
+        if self._cross_encoder is None:
+            self._cross_encoder = CrossEncoderReranker(self.reranker_config)
+        if self._cross_encoder.available:
+            return self._cross_encoder
+        return self._fallback_reranker()
+    
+    def _fallback_reranker(self) -> Optional[any]:
+        """
+        創建交叉編碼器不可用時的後備重排序器
+        
+        Returns:
+            FALLBACK 為 llm 時返回 LLMChainExtractor，否則返回 None
+        """
+        fallback = self.reranker_config['FALLBACK']
+        print(f"交叉編碼器重排序不可用（{self._cross_encoder.load_error}），改用: {fallback}")
+        if fallback == 'llm' and self.llm is not None:
+            return LLMChainExtractor.from_llm(self.llm)
+        return None
+    
+    def get_reranker(self) -> Optional[any]:
+        """
+        獲取可用的重排序器
+        
+        交叉編碼器在第一次使用時載入模型，載入失敗則切換為後備重排序器，
+        調用方據此決定是否多檢索候選文本塊。
+        
+        Returns:
+            重排序器，未啟用或不可用時返回 None
+        """
+        reranker = self.reranker
+        if isinstance(reranker, CrossEncoderReranker) and not reranker.load():
+            self.reranker = reranker = self._fallback_reranker()
+        return reranker
+    
+    def reranker_identity(self, reranker: Optional[any]) -> str:
+        """
+        獲取重排序器的標識，重排序結果快取以此區分不同的重排序方式
+        
+        Args:
+            reranker: get_reranker 返回的重排序器
+            
+        Returns:
+            類型與模型組成的字符串，沒有重排序器時返回空字符串
+        """
+        if isinstance(reranker, CrossEncoderReranker):
+            config = reranker.config
+            return f"cross_encoder:{config['MODEL_NAME']}:{config['INFERENCE_BACKEND']}:{config['ONNX_FILE_NAME']}"
+        if reranker is not None:
+            return f"llm:{self.settings.get('llm_model')}"
+        return ''
+    
+    def reranker_status(self) -> dict:
+        """
+        獲取重排序器狀態
+        
+        Returns:
+            包含配置的類型、實際使用的類型、模型名稱、候選數量與載入錯誤的字典
+        """
+        reranker = self.reranker
+        if isinstance(reranker, CrossEncoderReranker):
+            active = 'cross_encoder'
+        elif reranker is not None:
+            active = 'llm'
+        else:
+            active = None
+        return {
+            'enabled': bool(self.settings.get('use_reranking')),
+            'type': self.reranker_config['TYPE'],
+            'active': active,
+            'model': self.reranker_config['MODEL_NAME'],
+            'candidates': getattr(reranker, 'candidates', None),
+            'error': self._cross_encoder.load_error if self._cross_encoder is not None else None,
+        }
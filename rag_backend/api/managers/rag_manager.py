@@ -3,6 +3,7 @@ RAG Web App - RAG管理器 (優化版)
 負責整體RAG系統管理
 """
 import os
+import asyncio
 import django
 from django.conf import settings as django_settings
 
@@ -11,10 +12,13 @@ if not django_settings.configured:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_backend.settings')
     django.setup()
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Iterator, Tuple, Optional
 import sqlite3
 import logging
+import random
+import threading
 import time
 import uuid
 import json
@@ -31,6 +35,20 @@ from api.managers.llm_manager import LLMManager
 from api.managers.retrieval import RetrievalManager
 from api.managers.file_processor import FileProcessor
 from api.managers.vector_manager import VectorManager
+from api.managers.job_queue import IngestionQueue, PRIORITY_BULK, PRIORITY_INTERACTIVE
+from api.managers.context_cache import ContextCache
+from api.managers.cancellation import CancellationRegistry
+from api.managers.dedup import ChunkDeduplicator
+from api.managers.bulk_import import BulkImporter
+from api.managers.chunked_upload import ChunkedUploadManager
+from api.managers.answer_cache import AnswerCache, answer_settings_fingerprint, make_answer_key
+from api.managers.semantic_cache import SemanticCache, MemoizedQueryEmbeddings
+from api.managers.retrieval_cache import RetrievalCache, make_retrieval_key, STAGE_CANDIDATES, STAGE_RERANKED
+from api.managers.corpus_version import bump_corpus_version, get_corpus_version
+from api.managers.file_metadata import file_metadata_cache
+from api.managers.context_packer import ContextPacker, strip_context_prefix
+from api.managers.batch_query import BatchQueryRunner
+from api.managers.llm_client import LLMClient
 
 from api.models import Setting
 
@@ -94,8 +112,14 @@ class RAGManager:
             print("使用預設設置")
             self.settings = self._get_default_settings()
         
-        # 初始化嵌入模型
-        self.embeddings = HuggingFaceEmbeddings(model_name=self.settings['embedding_model'])
+        # 初始化語義快取（以問題嵌入的相似度匹配改寫過的問題，引用的文件未變更時重用回答）
+        self.semantic_cache = SemanticCache(getattr(django_settings, 'RAG_SEMANTIC_CACHE', {}))
+        
+        # 初始化嵌入模型（記住最近的問題嵌入，語義快取與檢索共用同一次計算）
+        self.embeddings = MemoizedQueryEmbeddings(
+            HuggingFaceEmbeddings(model_name=self.settings['embedding_model']),
+            self.semantic_cache.config['QUERY_EMBEDDING_MEMO_SIZE']
+        )
         
         # 打印所有使用的參數
         print("\n" + "="*50)
@@ -121,20 +145,95 @@ class RAGManager:
         # 初始化向量管理器
         self.vector_manager = VectorManager(self.chroma_db_dir, self.embeddings)
         
+        # 初始化共用的 LLM 客戶端（所有 LLM 調用共用連接池，連接數按各處的 LLM 並發數之和設置）
+        context_config = getattr(django_settings, 'RAG_CONTEXT_GENERATION', {})
+        queue_config = getattr(django_settings, 'RAG_INGESTION_QUEUE', {})
+        expected_concurrency = (
+            context_config.get('CONCURRENCY', 4) * queue_config.get('STAGE_CONCURRENCY', {}).get('context', 1)
+            + getattr(django_settings, 'RAG_BATCH_QUERY', {}).get('LLM_CONCURRENCY', 8)
+            + getattr(django_settings, 'RAG_ASYNC_QUERY', {}).get('RETRIEVAL_WORKERS', 8)
+        )
+        self.llm_client = LLMClient(getattr(django_settings, 'RAG_LLM_CLIENT', {}), expected_concurrency)
+        
         # 初始化LLM管理器
-        self.llm_manager = LLMManager(self.settings, self.vector_manager)
+        self.llm_manager = LLMManager(
+            self.settings,
+            self.vector_manager,
+            getattr(django_settings, 'RAG_RERANKER', {}),
+            self.llm_client
+        )
         
         # 初始化檢索管理器
-        self.retrieval_manager = RetrievalManager(self.vector_manager, self.llm_manager.llm, self.settings)
+        self.retrieval_manager = RetrievalManager(self.vector_manager, self.llm_client, self.settings)
+        
+        # 初始化攝取任務佇列（工作執行緒由 start() 啟動）
+        self.ingestion_queue = IngestionQueue(
+            self.run_ingestion_job,
+            getattr(django_settings, 'RAG_INGESTION_QUEUE', {}),
+            self.fail_ingestion_job
+        )
+        
+        # 初始化批量導入器（壓縮包與伺服器目錄），導入的文件分批加入攝取佇列
+        self.bulk_importer = BulkImporter(
+            self.ingestion_queue.enqueue_many,
+            getattr(django_settings, 'RAG_BULK_IMPORT', {})
+        )
+        
+        # 初始化可續傳分片上傳（最後一個分片寫入並校驗後立即加入攝取佇列）
+        self.chunked_upload = ChunkedUploadManager(
+            self.enqueue_file,
+            getattr(django_settings, 'RAG_CHUNKED_UPLOAD', {})
+        )
+        
+        # 初始化上下文快取（重新處理文件時重用已生成的文本塊上下文）
+        self.context_cache = ContextCache(getattr(django_settings, 'RAG_CONTEXT_CACHE', {}))
+        
+        # 初始化問答快取（鍵包含知識庫版本，攝取或刪除文件後舊條目自然失效）
+        self.answer_cache = AnswerCache(getattr(django_settings, 'RAG_ANSWER_CACHE', {}))
+        
+        # 初始化檢索結果快取（按策略與階段保存，重新生成回答時只重做設置有變化的階段）
+        self.retrieval_cache = RetrievalCache(getattr(django_settings, 'RAG_RETRIEVAL_CACHE', {}))
+        
+        # 初始化查詢執行緒池（異步查詢在此執行檢索等阻塞步驟，限制同時檢索的數量）
+        self.query_executor = ThreadPoolExecutor(
+            max_workers=getattr(django_settings, 'RAG_ASYNC_QUERY', {}).get('RETRIEVAL_WORKERS', 8),
+            thread_name_prefix='rag-query'
+        )
+        
+        # 初始化上下文打包器（按模型上下文窗口與 max_tokens 控制提示大小）
+        self.context_packer = ContextPacker(getattr(django_settings, 'RAG_CONTEXT_PACKING', {}))
+        
+        # 初始化批量問答執行器（問題分批嵌入與檢索，LLM 以有界並發調用）
+        self.batch_runner = BatchQueryRunner(
+            self._prepare_batch,
+            self._finish_query,
+            getattr(django_settings, 'RAG_BATCH_QUERY', {})
+        )
+        
+        # 初始化取消登記表（進程內事件，跨進程的取消由節流的資料庫檢查感知）
+        self.cancellation = CancellationRegistry(
+            FileProcessor.is_cancelled_in_db,
+            getattr(django_settings, 'RAG_CANCELLATION', {}).get('DB_CHECK_INTERVAL_SECONDS', 5)
+        )
+        
+        # 初始化近似重複檢測器
+        self.deduplicator = ChunkDeduplicator(getattr(django_settings, 'RAG_DEDUP', {}))
         
         # 初始化文件處理器，傳遞 db_path
         self.file_processor = FileProcessor(
             self.settings, 
             self.embeddings, 
             self.vector_manager, 
-            self.llm_manager.llm, 
+            self.llm_client, 
             self.chroma_db_dir, 
-            self.db_path
+            self.db_path,
+            stage_limiter=self.ingestion_queue,
+            parser_processes=getattr(django_settings, 'RAG_PARSER', {}).get('PROCESSES', 0),
+            context_config=getattr(django_settings, 'RAG_CONTEXT_GENERATION', {}),
+            context_cache=self.context_cache,
+            cancellation=self.cancellation,
+            deduplicator=self.deduplicator,
+            embed_batch_size=getattr(django_settings, 'RAG_INGESTION_QUEUE', {}).get('EMBED_BATCH_SIZE', 0)
         )
     
     def cancel_file_processing(self, file_id: str) -> None:
@@ -146,6 +245,17 @@ class RAGManager:
         """
         log_message(f"開始取消文件 {file_id} 的處理...")
         
+        # 通知本進程內正在處理該文件的工作執行緒
+        self.cancellation.cancel(file_id)
+        
+        try:
+            # 取消尚未開始的排隊任務
+            cancelled_jobs = self.ingestion_queue.cancel_file(file_id)
+            if cancelled_jobs:
+                log_message(f"已取消文件 {file_id} 的 {cancelled_jobs} 個排隊任務")
+        except Exception as e:
+            log_message(f"取消排隊任務時出錯: {str(e)}")
+        
         try:
             # 直接使用 Django ORM 獲取和更新文件狀態
             from django.apps import apps
@@ -212,45 +322,52 @@ class RAGManager:
         self.settings.update(new_settings)
         
         if 'embedding_model' in new_settings:
-            self.embeddings = HuggingFaceEmbeddings(model_name=self.settings['embedding_model'])
+            self.embeddings = MemoizedQueryEmbeddings(
+                HuggingFaceEmbeddings(model_name=self.settings['embedding_model']),
+                self.semantic_cache.config['QUERY_EMBEDDING_MEMO_SIZE']
+            )
             self.vector_manager.update_embeddings(self.embeddings)
+            self.semantic_cache.clear()
         
         if any(key in new_settings for key in ['llm_model', 'temperature', 'max_tokens']):
             self.llm_manager.update_llm_settings(new_settings, self.vector_manager)
         
-        self.retrieval_manager.Setting.update(new_settings)
+        self.retrieval_manager.settings.update(new_settings)
         self.file_processor.update_settings(new_settings)
     
-    def _format_context(self, documents: List[Document]) -> str:
+    def _format_context(self, documents: List[Document], question: str) -> Tuple[str, List[Document]]:
         """
-        格式化上下文
+        格式化上下文，按令牌預算截斷或丟棄排名靠後的文本塊
         
         Args:
             documents: 文檔列表
+            question: 問題（計算預算時扣除其令牌數）
             
         Returns:
-            格式化後的上下文
+            (格式化後的上下文, 實際放入上下文的文檔列表)
         """
-        context_parts = []
-        for i, doc in enumerate(documents):
-            file_id = doc.metadata.get('file_id', '')
-            
-            # 嘗試從 Django 獲取文件名
-            file_name = "Unknown"
-            try:
-                from django.apps import apps
-                File = apps.get_model('api', 'File')
-                file_obj = File.objects.get(id=file_id)
-                file_name = file_obj.original_filename
-            except Exception:
-                file_name = "Unknown"
-            
-            page = doc.metadata.get('page', 0) + 1
-            
-            context_part = f"[文檔 {i+1}] 來源: {file_name}, 頁碼: {page}\n{doc.page_content}\n"
-            context_parts.append(context_part)
+        file_names = self._resolve_file_names(documents)
+        budget = self.context_packer.budget(self.settings['llm_model'], self.settings['max_tokens'], question)
+        return self.context_packer.pack(
+            documents, file_names, self.settings['llm_model'], budget,
+            self.settings.get('use_contextual_embeddings', True)
+        )
+    
+    def _resolve_file_names(self, documents: List[Document]) -> Dict[str, str]:
+        """
+        批量解析文檔來源的文件名
         
-        return "\n".join(context_parts)
+        Args:
+            documents: 文檔列表
+            
+        Returns:
+            {文件ID: 原始文件名}，無法解析的文件不包含在內
+        """
+        try:
+            return file_metadata_cache.filenames(doc.metadata.get('file_id', '') for doc in documents)
+        except Exception as e:
+            log_message(f"獲取文件名時出錯: {str(e)}")
+            return {}
     
     def get_all_files(self) -> List[Dict[str, Any]]:
         """
@@ -297,13 +414,79 @@ class RAGManager:
         # 保留這個方法是為了向後兼容，但實際上什麼都不做
         log_message(f"add_file_to_db 被調用，但文件 {file_id} 應該已經在 Django 中存在")
     
-    def process_file(self, file_id: str, file_path: str) -> None:
+    def enqueue_file(self, file_id: str, file_path: str, priority: int = PRIORITY_INTERACTIVE, owner: str = '') -> str:
+        """
+        將文件加入攝取任務佇列，由工作執行緒池在背景處理
+        
+        Args:
+            file_id: 文件ID
+            file_path: 文件路徑
+            priority: 優先級類別（互動式上傳優先於批量導入）
+            owner: 提交者，用於用戶間的公平調度
+            
+        Returns:
+            任務ID
+        """
+        return self.ingestion_queue.enqueue(file_id, file_path, priority, owner)
+    
+    def run_ingestion_job(self, job: Dict[str, Any]) -> str:
+        """
+        執行一個攝取任務（由 IngestionQueue 的工作執行緒調用）
+        
+        Args:
+            job: 任務字典，包含 file_id、file_path、attempts、max_attempts
+            
+        Returns:
+            任務結果：'succeeded'、'failed' 或 'cancelled'
+        """
+        from django.apps import apps
+        File = apps.get_model('api', 'File')
+        file_id = job['file_id']
+        
+        try:
+            file_obj = File.objects.get(id=file_id)
+        except File.DoesNotExist:
+            log_message(f"文件 {file_id} 已被刪除，跳過攝取任務")
+            return 'cancelled'
+        if file_obj.status == 'cancelled':
+            log_message(f"文件 {file_id} 已被取消，跳過攝取任務")
+            return 'cancelled'
+        
+        if self.process_file(file_id, job['file_path']):
+            return 'succeeded'
+        
+        status = File.objects.filter(id=file_id).values_list('status', flat=True).first()
+        if status is None or status == 'cancelled':
+            return 'cancelled'
+        if job['attempts'] < job['max_attempts']:
+            # 還有重試機會，保持處理中狀態以免前端停止輪詢
+            File.objects.filter(id=file_id).update(status='processing')
+        return 'failed'
+    
+    def fail_ingestion_job(self, job: Dict[str, Any], error: str) -> None:
+        """
+        將未經 run_ingestion_job 就失敗的攝取任務（已用盡重試次數）的文件標記為錯誤
+        
+        Args:
+            job: 任務字典
+            error: 錯誤信息
+        """
+        from django.apps import apps
+        File = apps.get_model('api', 'File')
+        if File.objects.filter(id=job['file_id'], status='processing').update(status='error'):
+            log_message(f"文件 {job['file_id']} 處理失敗: {error}")
+    
+    def process_file(self, file_id: str, file_path: str, update_bm25: bool = True) -> bool:
         """
         處理文件
         
         Args:
             file_id: 文件ID
             file_path: 文件路徑
+            update_bm25: 是否更新本進程內的 BM25 索引（離線批量攝取時關閉，避免每個文件都重建索引）
+            
+        Returns:
+            是否處理成功
         """
         if not os.path.exists(file_path):
             log_message(f"文件不存在: {file_path}")
@@ -316,7 +499,7 @@ class RAGManager:
                 file_obj.save()
             except Exception as e:
                 log_message(f"更新文件狀態時出錯: {str(e)}")
-            return
+            return False
         
         # 設置文件狀態為處理中
         try:
@@ -324,70 +507,65 @@ class RAGManager:
             File = apps.get_model('api', 'File')
             file_obj = File.objects.get(id=file_id)
             file_obj.status = 'processing'
+            # 舊文本塊即將被替換，引用此文件的語義快取條目隨之失效
+            file_obj.indexed_version = 0
             file_obj.save()
         except Exception as e:
             log_message(f"更新文件狀態時出錯: {str(e)}")
-            return
+            return False
         
+        self.cancellation.register(file_id)
         try:
-            # 調用文件處理器處理文件
-            chunked_documents = self.file_processor.process_file(file_id, file_path)
+            # 調用文件處理器處理文件；只有需要更新 BM25 索引時才保留寫入的文檔
+            bm25_documents = [] if update_bm25 and self.settings.get('use_bm25', True) else None
+            chunks_count = self.file_processor.process_file(file_id, file_path, bm25_documents)
             
-            # 檢查文件狀態
-            try:
-                file_obj = File.objects.get(id=file_id)
-                if file_obj.status == 'cancelled':
-                    log_message(f"文件 {file_id} 處理被取消，中止後續操作")
-                    return
-            except Exception:
-                pass
+            # 檢查文件狀態（本進程內的取消無需查詢資料庫）
+            if self.cancellation.is_cancelled(file_id):
+                log_message(f"文件 {file_id} 處理被取消，中止後續操作")
+                return False
             
             # 如果成功處理，更新 BM25 和狀態
-            if chunked_documents:
-                if self.settings.get('use_bm25', True):
-                    # 再次檢查狀態
-                    try:
-                        file_obj = File.objects.get(id=file_id)
-                        if file_obj.status == 'cancelled':
-                            log_message(f"文件 {file_id} 處理被取消，中止 BM25 索引更新")
-                            return
-                    except Exception:
-                        pass
-                    self.retrieval_manager._update_bm25_index(chunked_documents)
+            if chunks_count:
+                if bm25_documents:
+                    self.retrieval_manager._update_bm25_index(bm25_documents)
                 
-                # 最終檢查狀態並更新
-                try:
-                    file_obj = File.objects.get(id=file_id)
-                    if file_obj.status == 'cancelled':
-                        log_message(f"文件 {file_id} 處理被取消，中止狀態更新")
-                        return
-                    
-                    # 更新 Django 資料庫中的狀態
-                    file_obj.status = 'processed'
-                    file_obj.chunks_count = len(chunked_documents)
-                    file_obj.save()
-                    log_message(f"成功更新文件 {file_id} 的狀態為 processed，塊數為 {len(chunked_documents)}")
-                except Exception as e:
-                    log_message(f"更新文件 {file_id} 狀態時出錯: {str(e)}")
+                # 以條件更新作為最終檢查，避免覆蓋處理期間（包括其他進程）寫入的取消狀態
+                updated = File.objects.filter(id=file_id).exclude(status='cancelled').update(
+                    status='processed',
+                    chunks_count=chunks_count
+                )
+                if not updated:
+                    log_message(f"文件 {file_id} 處理被取消，中止狀態更新")
+                    return False
+                log_message(f"成功更新文件 {file_id} 的狀態為 processed，塊數為 {chunks_count}")
+                version = bump_corpus_version(f"攝取文件 {file_id}")
+                File.objects.filter(id=file_id).update(indexed_version=version)
+                return True
+            elif self.deduplicator.duplicate_count(file_id):
+                # 所有文本塊均與已有內容重複，文件視為處理完成
+                File.objects.filter(id=file_id).exclude(status='cancelled').update(status='processed', chunks_count=0)
+                log_message(f"文件 {file_id} 的內容已全部存在於知識庫中，未新增文本塊")
+                return True
             else:
-                # 處理失敗，更新狀態為錯誤
+                # 處理失敗，更新狀態為錯誤（已取消的文件保持取消狀態）
                 try:
-                    file_obj = File.objects.get(id=file_id)
-                    file_obj.status = 'error'
-                    file_obj.save()
-                    log_message(f"文件 {file_id} 處理失敗，狀態已更新為 error")
+                    if File.objects.filter(id=file_id).exclude(status='cancelled').update(status='error'):
+                        log_message(f"文件 {file_id} 處理失敗，狀態已更新為 error")
                 except Exception as e:
                     log_message(f"更新文件 {file_id} 狀態時出錯: {str(e)}")
+                return False
         except Exception as e:
             log_message(f"處理文件 {file_id} 時出錯: {str(e)}")
             # 更新狀態為錯誤
             try:
-                file_obj = File.objects.get(id=file_id)
-                file_obj.status = 'error'
-                file_obj.save()
-                log_message(f"文件 {file_id} 處理出錯，狀態已更新為 error")
+                if File.objects.filter(id=file_id).exclude(status='cancelled').update(status='error'):
+                    log_message(f"文件 {file_id} 處理出錯，狀態已更新為 error")
             except Exception as django_err:
                 log_message(f"更新文件 {file_id} 狀態時出錯: {str(django_err)}")
+            return False
+        finally:
+            self.cancellation.unregister(file_id)
     
     def delete_file_from_vectorstore(self, file_id: str) -> None:
         """
@@ -397,6 +575,20 @@ class RAGManager:
             file_id: 文件ID
         """
         self.vector_manager.delete_file(file_id)
+        bump_corpus_version(f"刪除文件 {file_id}")
+        
+        # 重複塊因指向此文件而被丟棄（skip 或 link 模式）的其他文件需要重新處理，否則其內容將從知識庫中消失
+        try:
+            dependant_ids = self.deduplicator.remove_file(file_id)
+            if dependant_ids:
+                from django.apps import apps
+                File = apps.get_model('api', 'File')
+                for dependant in File.objects.filter(id__in=dependant_ids).exclude(status='cancelled'):
+                    if dependant.file:
+                        self.enqueue_file(str(dependant.id), dependant.file.path, PRIORITY_BULK)
+                log_message(f"已重新排隊 {len(dependant_ids)} 個與文件 {file_id} 重複的文件")
+        except Exception as e:
+            log_message(f"清理文件 {file_id} 的去重記錄時出錯: {str(e)}")
     
     def query(self, question: str, use_different_strategy: bool = False) -> Tuple[str, List[Dict[str, Any]]]:
         """
@@ -409,67 +601,237 @@ class RAGManager:
         Returns:
             (回答, 相關文檔列表)
         """
+        prepared = self._prepare_query(question, use_different_strategy)
+        if 'result' in prepared:
+            return prepared['result']
+        answer = prepared['chain'].invoke({"context": prepared['context'], "question": question})
+        return self._finish_query(question, prepared, answer)
+    
+    async def aquery(self, question: str, use_different_strategy: bool = False) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        查詢RAG系統（異步版本，供 ASGI 視圖使用）
+        
+        快取查找、檢索與上下文打包在有界的查詢執行緒池中執行，LLM 調用使用 ainvoke，
+        等待回答期間不佔用任何執行緒。
+        
+        Args:
+            question: 問題
+            use_different_strategy: 是否使用不同的策略（用於重新生成回答）
+            
+        Returns:
+            (回答, 相關文檔列表)
+        """
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(
+            self.query_executor, self._run_with_db, self._prepare_query, question, use_different_strategy
+        )
+        if 'result' in prepared:
+            return prepared['result']
+        answer = await prepared['chain'].ainvoke({"context": prepared['context'], "question": question})
+        return await loop.run_in_executor(
+            self.query_executor, self._run_with_db, self._finish_query, question, prepared, answer
+        )
+    
+    @staticmethod
+    def _run_with_db(func: Any, *args: Any) -> Any:
+        """在查詢執行緒池中執行，前後清理過期的資料庫連接（與請求結束時的處理相同）"""
+        from django.db import close_old_connections
+        
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    
+    def _prepare_query(self, question: str, use_different_strategy: bool) -> Dict[str, Any]:
+        """
+        執行查詢中 LLM 調用之前的步驟：快取查找、檢索與上下文打包
+        
+        Args:
+            question: 問題
+            use_different_strategy: 是否使用不同的策略
+            
+        Returns:
+            已有結果時為 {'result': (回答, 相關文檔列表)}；
+            否則為調用 LLM 與 _finish_query 所需的狀態（chain、context、documents 與快取鍵）
+        """
+        unavailable = self._unavailable_result()
+        if unavailable is not None:
+            return {'result': unavailable}
+        
+        corpus_version = get_corpus_version()
+        prepared = self._lookup_answer_caches(question, use_different_strategy, corpus_version)
+        if 'result' in prepared:
+            return prepared
+        
+        use_hybrid, use_rag_fusion, use_reranking, use_cot = self._strategy_flags(use_different_strategy)
+        documents = self._retrieve(question, use_hybrid, use_rag_fusion, use_reranking, corpus_version)
+        return self._build_prompt(question, documents, use_cot, prepared)
+    
+    def _prepare_batch(self, questions: List[str], use_different_strategy: bool) -> List[Dict[str, Any]]:
+        """
+        批量執行 _prepare_query：問題在一次調用中嵌入，未命中快取的問題一起檢索
+        
+        Args:
+            questions: 問題列表
+            use_different_strategy: 是否使用不同的策略
+            
+        Returns:
+            與 questions 順序一致的狀態列表（格式同 _prepare_query）
+        """
+        unavailable = self._unavailable_result()
+        if unavailable is not None:
+            return [{'result': unavailable} for _ in questions]
+        
+        corpus_version = get_corpus_version()
+        if not use_different_strategy and self.semantic_cache.enabled:
+            # 批量嵌入的結果被記住，語義快取查找與檢索時不再逐個計算
+            self.embeddings.embed_queries(questions)
+        prepared = [self._lookup_answer_caches(question, use_different_strategy, corpus_version)
+                    for question in questions]
+        
+        use_hybrid, use_rag_fusion, use_reranking, use_cot = self._strategy_flags(use_different_strategy)
+        misses = [i for i, item in enumerate(prepared) if 'result' not in item]
+        documents = self._retrieve_batch([questions[i] for i in misses], use_hybrid, use_rag_fusion,
+                                         use_reranking, corpus_version)
+        for i, docs in zip(misses, documents):
+            prepared[i] = self._build_prompt(questions[i], docs, use_cot, prepared[i])
+        return prepared
+    
+    def batch_query(self, questions: List[str], use_different_strategy: bool = False,
+                    max_concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        批量查詢RAG系統（用於離線評估與預先生成常見問題的回答）
+        
+        Args:
+            questions: 問題列表
+            use_different_strategy: 是否使用不同的策略
+            max_concurrency: 同時進行的 LLM 調用數（不超過 RAG_BATCH_QUERY['LLM_CONCURRENCY']）
+            
+        Returns:
+            結果迭代器，按完成順序輸出 {'index', 'question', 'answer', 'related_docs'} 或 {'index', 'question', 'error'}
+        """
+        return self.batch_runner.run(questions, use_different_strategy, max_concurrency)
+    
+    def _unavailable_result(self) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """知識庫或 LLM 尚未初始化時返回提示回答，否則返回 None"""
         if self.vector_manager.vectorstore is None:
-            return "知識庫尚未初始化，請先上傳文件。", []
+            return ("知識庫尚未初始化，請先上傳文件。", [])
         
         if self.llm_manager.llm is None:
-            return "LLM未正確初始化，請檢查API密鑰和設置。", []
+            return ("LLM未正確初始化，請檢查API密鑰和設置。", [])
+        return None
+    
+    def _lookup_answer_caches(self, question: str, use_different_strategy: bool, corpus_version: int) -> Dict[str, Any]:
+        """
+        查找問答快取與語義快取
         
-        if use_different_strategy:
-            use_hybrid = not self.settings.get('use_hybrid', True)
-            use_rag_fusion = not self.settings['use_rag_fusion']
-            use_reranking = not self.settings['use_reranking']
-            use_cot = not self.settings['use_cot']
-        else:
-            use_hybrid = self.settings.get('use_hybrid', True)
-            use_rag_fusion = self.settings['use_rag_fusion']
-            use_reranking = self.settings['use_reranking']
-            use_cot = self.settings['use_cot']
+        Args:
+            question: 問題
+            use_different_strategy: 是否使用不同的策略
+            corpus_version: 知識庫版本
+            
+        Returns:
+            命中時為 {'result': (回答, 相關文檔列表)}；否則為寫入快取所需的鍵（cache_key、query_embedding、settings_key）
+        """
+        # 重新生成回答時需要不同的結果，不使用問答快取（檢索結果快取仍然適用）
+        cache_key = None
+        if not use_different_strategy:
+            cache_key = make_answer_key(question, self.settings, corpus_version)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                log_message("問答快取命中，跳過檢索與 LLM 調用")
+                return {'result': cached}
         
-        if use_hybrid and self.retrieval_manager.bm25_available:
-            documents = self.retrieval_manager.hybrid_retrieval(question, use_reranking, self.llm_manager.reranker)
-        elif use_rag_fusion:
-            documents = self.retrieval_manager.rag_fusion_retrieval(question)
-        else:
-            documents = self.retrieval_manager.standard_retrieval(question, use_reranking, self.llm_manager.reranker)
+        # 語義快取：問題嵌入會被記住，未命中時檢索不會重複計算
+        query_embedding = None
+        settings_key = None
+        if not use_different_strategy and self.semantic_cache.enabled:
+            settings_key = answer_settings_fingerprint(self.settings)
+            query_embedding = self.embeddings.embed_query(question)
+            hit = self.semantic_cache.lookup(query_embedding, settings_key, self._cited_files_unchanged)
+            if hit is not None:
+                log_message(f"語義快取命中（相似度 {hit['similarity']:.3f}，原問題: {hit['question'][:50]}），跳過檢索與 LLM 調用")
+                if random.random() < self.semantic_cache.config['AUDIT_SAMPLE_RATE']:
+                    threading.Thread(target=self._audit_semantic_hit, args=(question, hit), daemon=True).start()
+                self.answer_cache.put(cache_key, hit['answer'], hit['related_docs'])
+                return {'result': (hit['answer'], hit['related_docs'])}
         
+        return {'cache_key': cache_key, 'query_embedding': query_embedding, 'settings_key': settings_key}
+    
+    def _strategy_flags(self, use_different_strategy: bool) -> Tuple[bool, bool, bool, bool]:
+        """
+        獲取本次查詢使用的策略
+        
+        Args:
+            use_different_strategy: 是否使用不同的策略（各開關取反）
+            
+        Returns:
+            (use_hybrid, use_rag_fusion, use_reranking, use_cot)
+        """
+        if use_different_strategy:
+            return (
+                not self.settings.get('use_hybrid', True),
+                not self.settings['use_rag_fusion'],
+                not self.settings['use_reranking'],
+                not self.settings['use_cot'],
+            )
+        return (
+            self.settings.get('use_hybrid', True),
+            self.settings['use_rag_fusion'],
+            self.settings['use_reranking'],
+            self.settings['use_cot'],
+        )
+    
+    def _build_prompt(self, question: str, documents: List[Document], use_cot: bool,
+                      prepared: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        打包上下文並選擇回答鏈
+        
+        Args:
+            question: 問題
+            documents: 檢索到的文檔列表
+            use_cot: 是否使用思維鏈
+            prepared: _lookup_answer_caches 返回的快取鍵
+            
+        Returns:
+            沒有相關文檔時為 {'result': (回答, [])}；否則為調用 LLM 與 _finish_query 所需的狀態
+        """
         if not documents:
-            return "我沒有找到與您問題相關的訊息。", []
+            return {'result': ("我沒有找到與您問題相關的訊息。", [])}
+        
+        context, documents = self._format_context(documents, question)
         
-        context = self._format_context(documents)
+        return {
+            **prepared,
+            'chain': self.llm_manager.cot_chain if use_cot else self.llm_manager.qa_chain,
+            'context': context,
+            'documents': documents,
+        }
+    
+    def _finish_query(self, question: str, prepared: Dict[str, Any], answer: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        執行查詢中 LLM 調用之後的步驟：整理相關文檔並寫入快取
         
-        chain = self.llm_manager.cot_chain if use_cot else self.llm_manager.qa_chain
-        response = chain.invoke({"input_documents": documents, "query": question, "context": context})
-        answer = response["result"]
+        Args:
+            question: 問題
+            prepared: _prepare_query 返回的狀態
+            answer: LLM 的回答
+            
+        Returns:
+            (回答, 相關文檔列表)
+        """
+        documents = prepared['documents']
         
+        # _format_context 已解析過同一批文件名，此處直接命中快取
+        file_names = self._resolve_file_names(documents)
         related_docs = []
         for i, doc in enumerate(documents):
             file_id = doc.metadata.get('file_id', '')
+            file_name = file_names.get(file_id, "Unknown")
             
-            # 獲取文件信息（先從Django數據庫獲取，失敗則從RAG數據庫獲取）
-            file_name = "Unknown"
-            try:
-                # 嘗試從Django數據庫獲取文件名
-                from django.apps import apps
-                File = apps.get_model('api', 'File')
-                try:
-                    file_obj = File.objects.get(id=file_id)
-                    file_name = file_obj.original_filename
-                except Exception:
-                    # 如果Django數據庫獲取失敗，使用預設值
-                    file_name = "Unknown"
-            except Exception:
-                # 如果Django導入失敗，使用預設值
-                file_name = "Unknown"
-            
-            # 提取實際文檔內容
-            content = doc.page_content
-            if self.settings.get('use_contextual_embeddings', True):
-                # 如果使用了上下文嵌入，內容會有格式為"上下文描述\n\n實際內容"
-                # 我們只需要提取實際內容部分
-                parts = content.split("\n\n", 1)
-                if len(parts) > 1:
-                    content = parts[1]
+            # 提取實際文檔內容（去除上下文嵌入加上的上下文描述）
+            content = strip_context_prefix(doc, self.settings.get('use_contextual_embeddings', True))
             
             # 清理和格式化內容，確保只顯示實際的文檔內容
             # 移除可能的標題、摘要等前綴
@@ -488,8 +850,149 @@ class RAGManager:
                 'page': page
             })
         
+        if prepared['cache_key'] is not None:
+            self.answer_cache.put(prepared['cache_key'], answer, related_docs)
+        if prepared['query_embedding'] is not None:
+            file_versions = self._indexed_versions({doc['file_id'] for doc in related_docs})
+            self.semantic_cache.put(question, prepared['query_embedding'], prepared['settings_key'], answer,
+                                    related_docs, file_versions)
         return answer, related_docs
     
+    def _retrieve(self, question: str, use_hybrid: bool, use_rag_fusion: bool, use_reranking: bool,
+                  corpus_version: int) -> List[Document]:
+        """
+        檢索相關文檔，候選檢索與重排序兩個階段的結果分別快取
+        
+        Args:
+            question: 問題
+            use_hybrid: 是否使用混合檢索
+            use_rag_fusion: 是否使用 RAG Fusion
+            use_reranking: 是否重排序
+            corpus_version: 知識庫版本
+            
+        Returns:
+            文檔列表
+        """
+        return self._retrieve_batch([question], use_hybrid, use_rag_fusion, use_reranking, corpus_version)[0]
+    
+    def _retrieve_batch(self, questions: List[str], use_hybrid: bool, use_rag_fusion: bool, use_reranking: bool,
+                        corpus_version: int) -> List[List[Document]]:
+        """
+        批量檢索相關文檔，未命中快取的問題一起檢索候選（一次嵌入、一次向量查詢、一次 BM25 打分）
+        
+        Args:
+            questions: 問題列表
+            use_hybrid: 是否使用混合檢索
+            use_rag_fusion: 是否使用 RAG Fusion
+            use_reranking: 是否重排序
+            corpus_version: 知識庫版本
+            
+        Returns:
+            與 questions 順序一致的文檔列表
+        """
+        if use_hybrid and self.retrieval_manager.bm25_available:
+            strategy = 'hybrid'
+        elif use_rag_fusion:
+            strategy = 'fusion'
+        else:
+            strategy = 'standard'
+        # RAG Fusion 的結果不經過重排序
+        reranker = self.llm_manager.get_reranker() if use_reranking and strategy != 'fusion' else None
+        rerank = reranker is not None
+        
+        top_k = self.settings['top_k']
+        
+        results: List[Optional[List[Document]]] = [None] * len(questions)
+        reranked_keys = {}
+        if rerank:
+            reranker_id = self.llm_manager.reranker_identity(reranker)
+            for i, question in enumerate(questions):
+                reranked_keys[i] = make_retrieval_key(question, strategy, STAGE_RERANKED, self.settings, corpus_version,
+                                                      reranker=reranker_id)
+                results[i] = self.retrieval_cache.get(reranked_keys[i], STAGE_RERANKED)
+        
+        # 候選文本塊不論是否重排序都按同一深度檢索並快取，切換重排序時重用；RAG Fusion 不重排序，只取 top_k 個
+        depth = None if strategy == 'fusion' else max(top_k, int(self.llm_manager.reranker_config['CANDIDATES']))
+        misses = [i for i, documents in enumerate(results) if documents is None]
+        candidates = {}
+        to_fetch = []
+        for i in misses:
+            candidates_key = make_retrieval_key(questions[i], strategy, STAGE_CANDIDATES, self.settings,
+                                                corpus_version, depth)
+            cached = self.retrieval_cache.get(candidates_key, STAGE_CANDIDATES)
+            if cached is None:
+                to_fetch.append((i, candidates_key))
+            else:
+                candidates[i] = cached
+        if to_fetch:
+            fetched = self.retrieval_manager.retrieve_candidates_batch(
+                [questions[i] for i, _ in to_fetch], strategy, depth
+            )
+            for (i, candidates_key), documents in zip(to_fetch, fetched):
+                self.retrieval_cache.put(candidates_key, STAGE_CANDIDATES, documents)
+                candidates[i] = documents
+        
+        for i in misses:
+            if not rerank:
+                results[i] = candidates[i][:top_k]
+                continue
+            # 交叉編碼器批量打分成本低，為全部候選重排序；LLM 壓縮逐個文檔調用 LLM，只處理前 top_k 個
+            rerank_depth = getattr(reranker, 'candidates', top_k)
+            results[i] = self.retrieval_manager.rerank(questions[i], candidates[i][:rerank_depth], reranker)
+            self.retrieval_cache.put(reranked_keys[i], STAGE_RERANKED, results[i])
+        return results
+    
+    def _indexed_versions(self, file_ids: Any) -> Dict[str, Optional[int]]:
+        """
+        獲取文件當前的索引版本
+        
+        Args:
+            file_ids: 文件ID集合
+            
+        Returns:
+            {文件ID: 索引版本}，不存在的文件對應 None
+        """
+        from django.apps import apps
+        File = apps.get_model('api', 'File')
+        
+        versions = {file_id: None for file_id in file_ids}
+        # 向量庫中的 file_id 可能不是有效的 UUID，這些文件視為不存在
+        valid_ids = []
+        for file_id in versions:
+            try:
+                valid_ids.append(uuid.UUID(str(file_id)))
+            except ValueError:
+                pass
+        for file_id, version in File.objects.filter(id__in=valid_ids).values_list('id', 'indexed_version'):
+            versions[str(file_id)] = version
+        return versions
+    
+    def _cited_files_unchanged(self, file_versions: Dict[str, Optional[int]]) -> bool:
+        """語義快取條目的有效性檢查：引用的文件均未重新攝取或刪除"""
+        return self._indexed_versions(file_versions.keys()) == file_versions
+    
+    def _audit_semantic_hit(self, question: str, hit: Dict[str, Any]) -> None:
+        """
+        抽檢語義快取命中（在背景執行緒中執行，只做檢索不調用 LLM）
+        
+        重新檢索新問題，若結果與條目引用的文件重疊比例低於 AUDIT_MIN_OVERLAP，則記為誤命中並移除條目。
+        
+        Args:
+            question: 命中的新問題
+            hit: SemanticCache.lookup 返回的條目
+        """
+        try:
+            documents = self.retrieval_manager.standard_retrieval(question)
+            fresh = {doc.metadata.get('file_id', '') for doc in documents}
+            cited = set(hit['file_versions'])
+            overlap = len(fresh & cited) / len(cited) if cited else 1.0
+            false_hit = overlap < self.semantic_cache.config['AUDIT_MIN_OVERLAP']
+            self.semantic_cache.record_audit(hit['entry_id'], false_hit)
+            if false_hit:
+                log_message(f"語義快取誤命中：「{question[:50]}」與「{hit['question'][:50]}」的檢索結果重疊 {overlap:.0%}")
+        except Exception as e:
+            log_message(f"抽檢語義快取命中時出錯: {str(e)}")
+    
     def _clean_content_for_display(self, content: str) -> str:
         """
         清理內容以便於顯示
@@ -550,6 +1053,8 @@ class RAGManager:
         except Exception as e:
             log_message(f"更新文件狀態時出錯: {str(e)}")
         
+        version = bump_corpus_version(f"添加文件 {file_id}")
+        File.objects.filter(id=file_id).update(indexed_version=version)
         return True
     
     def delete_file(self, file_id: str) -> bool:
@@ -0,0 +1,81 @@
+"""
+Rate Limiter - 令牌桶限流器
+同時限制每分鐘請求數與每分鐘令牌數，供並發 LLM 調用共用
+"""
+import threading
+import time
+
+class TokenBucketRateLimiter:
+    """令牌桶限流器類，按每分鐘請求數（RPM）與每分鐘令牌數（TPM）限流"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        """
+        初始化限流器
+
+        Args:
+            requests_per_minute: 每分鐘請求數上限，0 表示不限制
+            tokens_per_minute: 每分鐘令牌數上限，0 表示不限制
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._available_requests = min(
+                self.requests_per_minute, self._available_requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._available_tokens = min(
+                self.tokens_per_minute, self._available_tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        阻塞直到可以發送一個消耗指定令牌數的請求
+
+        Args:
+            tokens: 請求預計消耗的令牌數（超過每分鐘上限時按上限計）
+
+        Returns:
+            等待的秒數
+        """
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                request_wait = 0.0
+                token_wait = 0.0
+                if self.requests_per_minute and self._available_requests < 1:
+                    request_wait = (1 - self._available_requests) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self._available_tokens < tokens:
+                    token_wait = (tokens - self._available_tokens) * 60 / self.tokens_per_minute
+                wait = max(request_wait, token_wait)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._available_requests -= 1
+                    if self.tokens_per_minute:
+                        self._available_tokens -= tokens
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self, seconds: float) -> None:
+        """
+        收到 429 後清空請求額度，讓所有共用此限流器的調用一起退避
+
+        Args:
+            seconds: 退避秒數
+        """
+        with self._lock:
+            self._refill()
+            if self.requests_per_minute:
+                self._available_requests = min(self._available_requests, -seconds * self.requests_per_minute / 60)
@@ -0,0 +1,138 @@
+"""
+Reranker - 本地交叉編碼器重排序
+一次批量為 (問題, 文本塊) 對打分並按分數排序，取代逐個文檔調用 LLM 的 LLMChainExtractor
+"""
+import importlib.util
+import threading
+import time
+from typing import Dict, Any, List, Optional, Sequence
+
+from langchain.schema import Document
+
+from api.managers.context_packer import SCORE_METADATA_KEY
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_RERANKER_CONFIG = {
+    'TYPE': 'cross_encoder',
+    'FALLBACK': 'llm',
+    'MODEL_NAME': 'BAAI/bge-reranker-base',
+    'INFERENCE_BACKEND': 'torch',
+    'ONNX_FILE_NAME': '',
+    'CANDIDATES': 30,
+    'BATCH_SIZE': 32,
+    'MAX_LENGTH': 512,
+}
+
+class CrossEncoderReranker:
+    """
+    交叉編碼器重排序器類
+
+    提供與 LangChain 文檔壓縮器相同的 compress_documents 接口，可直接作為 RetrievalManager.rerank 的 reranker。
+    模型在第一次重排序時載入，之後在進程內重用。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化交叉編碼器重排序器
+
+        Args:
+            config: 配置（見 settings.RAG_RERANKER）
+        """
+        self.config = {**DEFAULT_RERANKER_CONFIG, **(config or {})}
+        # 重排序前檢索的候選文本塊數量
+        self.candidates = int(self.config['CANDIDATES'])
+        self._model = None
+        self._load_failed = False
+        # 載入失敗的原因，供狀態端點顯示
+        self.load_error: Optional[str] = None
+        if importlib.util.find_spec('sentence_transformers') is None:
+            self._load_failed = True
+            self.load_error = "未安裝 sentence-transformers"
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """模型是否可用（尚未載入時視為可用）"""
+        return not self._load_failed
+
+    def load(self) -> bool:
+        """
+        載入模型（已載入時直接返回）
+
+        Returns:
+            模型是否可用
+        """
+        return self._load_model() is not None
+
+    def _load_model(self) -> Any:
+        with self._lock:
+            if self._model is not None or self._load_failed:
+                return self._model
+            try:
+                from sentence_transformers import CrossEncoder
+
+                kwargs = {'max_length': self.config['MAX_LENGTH'], 'device': 'cpu'}
+                backend = self.config['INFERENCE_BACKEND']
+                if backend != 'torch':
+                    # ONNX/OpenVINO 推理，可指定量化後的模型文件（如 onnx/model_qint8_avx512.onnx）
+                    kwargs['backend'] = backend
+                    if self.config['ONNX_FILE_NAME']:
+                        kwargs['model_kwargs'] = {'file_name': self.config['ONNX_FILE_NAME']}
+                started = time.perf_counter()
+                self._model = CrossEncoder(self.config['MODEL_NAME'], **kwargs)
+                log_message(f"重排序模型 {self.config['MODEL_NAME']}（{backend}）載入完成，耗時 {time.perf_counter() - started:.1f} 秒")
+            except Exception as e:
+                # 載入失敗時不重試，由 LLMManager 改用 FALLBACK 指定的重排序方式
+                self._load_failed = True
+                self.load_error = str(e)
+                log_message(f"載入重排序模型時出錯: {str(e)}")
+            return self._model
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        """
+        批量計算問題與文本的相關性分數
+
+        Args:
+            query: 問題
+            texts: 文本列表
+
+        Returns:
+            分數列表（與 texts 順序一致），模型不可用時返回空列表
+        """
+        model = self._load_model()
+        if model is None or not texts:
+            return []
+        scores = model.predict([(query, text) for text in texts], batch_size=self.config['BATCH_SIZE'],
+                               show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Any = None) -> List[Document]:
+        """
+        按相關性分數重排序文檔，分數寫入 metadata['score']
+
+        Args:
+            documents: 候選文檔列表
+            query: 問題
+            callbacks: 未使用，保持與文檔壓縮器接口一致
+
+        Returns:
+            按分數從高到低排序的文檔列表（不截斷，由調用方取前 top_k 個）
+        """
+        documents = list(documents)
+        started = time.perf_counter()
+        scores = self.score(query, [doc.page_content for doc in documents])
+        if not scores:
+            return documents
+        # 複製文檔而不修改原對象，候選結果可能被檢索結果快取共用
+        ranked = sorted(
+            (Document(page_content=doc.page_content, metadata={**doc.metadata, SCORE_METADATA_KEY: score})
+             for doc, score in zip(documents, scores)),
+            key=lambda doc: doc.metadata[SCORE_METADATA_KEY],
+            reverse=True
+        )
+        log_message(f"重排序 {len(documents)} 個候選文本塊，耗時 {(time.perf_counter() - started) * 1000:.0f} 毫秒")
+        return ranked
@@ -2,32 +2,58 @@
 Retrieval - 檢索策略管理
 包含標準檢索、混合檢索和 RAG Fusion 檢索
 """
+import threading
+import time
+from collections import Counter, OrderedDict
 from typing import List, Optional
 from langchain.schema import Document
-from langchain.retrievers import ContextualCompressionRetriever
+
+from api.managers.answer_cache import normalize_question
+from api.managers.context_packer import SCORE_METADATA_KEY
+
+# 倒數排名融合的平滑常數
+RRF_K = 60
+# 查詢擴展結果的快取條目數與有效期
+EXPANSION_CACHE_SIZE = 512
+EXPANSION_CACHE_TTL_SECONDS = 3600
+# 批量 BM25 打分時每次計算的查詢數（分數矩陣為 查詢數 × 文檔數）
+BM25_SCORE_BATCH_SIZE = 64
+# 標準檢索的候選倍數：近似重複塊（DOWNWEIGHT 0.5）的排名約後移一倍，多檢索的候選用於補足前 k 個
+DEDUP_OVERFETCH_FACTOR = 2
 
 class RetrievalManager:
     """檢索管理器類，負責處理不同的檢索策略"""
     
-    def __init__(self, vector_manager: Optional[any], llm: any, settings: dict):
+    def __init__(self, vector_manager: Optional[any], llm_client: Optional[any], settings: dict):
         """
         初始化檢索管理器
         
         Args:
             vector_manager: 向量管理器對象
-            llm: LLM對象（用於查詢擴展和重排序）
+            llm_client: 共用的 LLM 客戶端（LLMClient，用於查詢擴展）
             settings: 配置設置字典
         """
         self.vector_manager = vector_manager
-        self.llm = llm
+        self.llm_client = llm_client
         self.settings = settings
         
+        # 查詢擴展快取：(規範化問題, LLM 模型, 擴展數量) -> (過期時間, 擴展查詢列表)
+        self._expansion_cache = OrderedDict()
+        self._expansion_lock = threading.Lock()
+        
         # 初始化BM25相關屬性
         self.bm25_available = False
         self.bm25_index = None
         self.bm25_documents = []
+        # BM25 倒排表：(詞項 -> 詞項ID, 各詞項在 doc_ids/weights 中的起止位置, 文檔下標, BM25 權重, 文檔列表)
+        self._bm25_postings = None
         self._initialize_bm25()
 
+    @property
+    def llm(self) -> Optional[any]:
+        """當前的 LLM（由共用的 LLMClient 持有，更新 LLM 設置後自動使用新的模型）"""
+        return self.llm_client.llm if self.llm_client is not None else None
+
     def _initialize_bm25(self) -> None:
         """
         初始化 BM25 索引
@@ -64,10 +90,51 @@ class RetrievalManager:
             self.bm25_documents.extend(documents)
             tokenized_documents = [list(jieba.cut(doc.page_content)) for doc in self.bm25_documents]
             self.bm25_index = BM25Okapi(tokenized_documents)
+            self._bm25_postings = self._build_bm25_postings(self.bm25_index, list(self.bm25_documents))
             print(f"BM25 索引已更新，共包含 {len(self.bm25_documents)} 個文檔")
         except Exception as e:
             print(f"更新 BM25 索引時出錯: {str(e)}")
 
+    @staticmethod
+    def _build_bm25_postings(index: any, documents: List[Document]) -> tuple:
+        """
+        將 BM25 索引展開為倒排表，預先計算每個 (詞項, 文檔) 的 BM25 權重
+        
+        查詢分數等於查詢中各詞項（按出現次數）權重之和，與 BM25Okapi.get_scores 的結果相同，
+        但打分時只需訪問包含查詢詞項的文檔，不必逐個文檔查找詞頻。
+        
+        Args:
+            index: BM25Okapi 索引
+            documents: 與索引對應的文檔列表
+            
+        Returns:
+            (詞項 -> 詞項ID, 起止位置數組, 文檔下標數組, 權重數組, 文檔列表)
+        """
+        import numpy as np
+        
+        vocab = {}
+        term_ids, doc_ids, term_freqs = [], [], []
+        for doc_index, freqs in enumerate(index.doc_freqs):
+            for term, freq in freqs.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_index)
+                term_freqs.append(freq)
+        
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        term_freqs = np.asarray(term_freqs, dtype=np.float64)
+        doc_len = np.asarray(index.doc_len, dtype=np.float64)
+        idf = np.asarray([index.idf.get(term) or 0.0 for term in vocab], dtype=np.float64)
+        
+        k1, b = index.k1, index.b
+        weights = idf[term_ids] * term_freqs * (k1 + 1) / (
+            term_freqs + k1 * (1 - b + b * doc_len[doc_ids] / index.avgdl)
+        )
+        order = np.argsort(term_ids, kind='stable')
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=indptr[1:])
+        return vocab, indptr, doc_ids[order], weights[order], documents
+
     def _bm25_search(self, query: str, top_k: int = 5) -> List[Document]:
         """
         使用 BM25 搜索
@@ -79,22 +146,81 @@ class RetrievalManager:
         Returns:
             文檔列表
         """
-        if not self.bm25_available or self.bm25_index is None:
-            return []
+        return self._bm25_search_batch([query], top_k)[0]
+
+    def _bm25_search_batch(self, queries: List[str], top_k: int = 5) -> List[List[Document]]:
+        """
+        使用 BM25 批量搜索，同一批查詢的分數以一次向量化運算得出
+        
+        Args:
+            queries: 查詢列表
+            top_k: 每個查詢返回的文檔數量
+            
+        Returns:
+            與 queries 順序一致的文檔列表
+        """
+        postings = self._bm25_postings
+        if not self.bm25_available or postings is None or not queries:
+            return [[] for _ in queries]
             
         try:
             import jieba
             import numpy as np
             
-            tokenized_query = list(jieba.cut(query))
-            scores = self.bm25_index.get_scores(tokenized_query)
-            top_indices = np.argsort(scores)[::-1][:top_k]
-            return [self.bm25_documents[i] for i in top_indices]
+            vocab, indptr, doc_ids, weights, documents = postings
+            n_docs = len(documents)
+            k = min(top_k, n_docs)
+            results = []
+            for offset in range(0, len(queries), BM25_SCORE_BATCH_SIZE):
+                batch = queries[offset:offset + BM25_SCORE_BATCH_SIZE]
+                rows, cols, values = [], [], []
+                for row, query in enumerate(batch):
+                    for term, count in Counter(jieba.cut(query)).items():
+                        term_id = vocab.get(term)
+                        if term_id is None:
+                            continue
+                        start, end = indptr[term_id], indptr[term_id + 1]
+                        rows.append(np.full(end - start, row * n_docs, dtype=np.int64))
+                        cols.append(doc_ids[start:end])
+                        values.append(weights[start:end] * count)
+                if rows:
+                    scores = np.bincount(
+                        np.concatenate(rows) + np.concatenate(cols),
+                        weights=np.concatenate(values),
+                        minlength=len(batch) * n_docs
+                    ).reshape(len(batch), n_docs)
+                else:
+                    scores = np.zeros((len(batch), n_docs))
+                
+                for row_scores in scores:
+                    if k <= 0:
+                        results.append([])
+                        continue
+                    top_indices = np.argpartition(-row_scores, k - 1)[:k]
+                    top_indices = top_indices[np.argsort(-row_scores[top_indices], kind='stable')]
+                    results.append([documents[i] for i in top_indices])
+            return results
         except Exception as e:
             print(f"BM25 搜索時出錯: {str(e)}")
-            return []
+            return [[] for _ in queries]
+
+    def _apply_dedup_weights(self, docs: List[Document]) -> List[Document]:
+        """
+        按去重權重調整排名，被標記為近似重複的文本塊（dedup_weight < 1）排名後移
+        
+        Args:
+            docs: 按相關性排序的文檔列表
+            
+        Returns:
+            調整後的文檔列表
+        """
+        if not any('dedup_weight' in doc.metadata for doc in docs):
+            return docs
+        ranked = sorted(enumerate(docs), key=lambda item: (item[0] + 1) / item[1].metadata.get('dedup_weight', 1.0))
+        return [doc for _, doc in ranked]
 
-    def standard_retrieval(self, query: str, use_reranking: bool = False, reranker: Optional[any] = None) -> List[Document]:
+    def standard_retrieval(self, query: str, use_reranking: bool = False, reranker: Optional[any] = None,
+                           k: Optional[int] = None) -> List[Document]:
         """
         標準檢索
         
@@ -102,23 +228,23 @@ class RetrievalManager:
             query: 查詢
             use_reranking: 是否使用重排序
             reranker: 重排序器（可選）
+            k: 檢索數量，默認為 top_k（重排序時通常檢索更多候選）
             
         Returns:
             文檔列表
         """
         if self.vector_manager.vectorstore is None:
             return []
-            
-        retriever = self.vector_manager.vectorstore.as_retriever(search_kwargs={"k": self.settings['top_k']})
+        
+        k = k or self.settings['top_k']
+        retriever = self.vector_manager.vectorstore.as_retriever(search_kwargs={"k": k * DEDUP_OVERFETCH_FACTOR})
+        docs = self._apply_dedup_weights(retriever.invoke(query))[:k]
         if use_reranking and reranker:
-            compression_retriever = ContextualCompressionRetriever(
-                base_retriever=retriever,
-                doc_compressor=reranker
-            )
-            return compression_retriever.invoke(query)
-        return retriever.invoke(query)
+            return self.rerank(query, docs, reranker)
+        return docs
 
-    def hybrid_retrieval(self, query: str, use_reranking: bool = False, reranker: Optional[any] = None) -> List[Document]:
+    def hybrid_retrieval(self, query: str, use_reranking: bool = False, reranker: Optional[any] = None,
+                         k: Optional[int] = None) -> List[Document]:
         """
         混合檢索策略，結合向量檢索和 BM25
         
@@ -126,61 +252,144 @@ class RetrievalManager:
             query: 查詢
             use_reranking: 是否使用重排序
             reranker: 重排序器（可選）
+            k: 檢索數量，默認為 top_k（重排序時通常檢索更多候選）
             
         Returns:
             文檔列表
         """
         if self.vector_manager.vectorstore is None:
             return []
-            
-        vector_retriever = self.vector_manager.vectorstore.as_retriever(search_kwargs={"k": self.settings['top_k']})
+        
+        k = k or self.settings['top_k']
+        vector_retriever = self.vector_manager.vectorstore.as_retriever(search_kwargs={"k": k})
         vector_docs = vector_retriever.invoke(query)
-        bm25_docs = self._bm25_search(query, top_k=self.settings['top_k'])
+        bm25_docs = self._bm25_search(query, top_k=k)
+        docs = self._merge_hybrid(vector_docs, bm25_docs, k)
         
-        all_docs = vector_docs + bm25_docs
+        if use_reranking and reranker:
+            return self.rerank(query, docs, reranker)
+        return docs
+
+    def _merge_hybrid(self, vector_docs: List[Document], bm25_docs: List[Document], k: int) -> List[Document]:
+        """
+        合併向量檢索與 BM25 的結果（按內容前 100 個字符去重）
+        
+        Args:
+            vector_docs: 向量檢索結果
+            bm25_docs: BM25 結果
+            k: 返回的文檔數量
+            
+        Returns:
+            文檔列表
+        """
         unique_docs = {}
-        for doc in all_docs:
+        for doc in vector_docs + bm25_docs:
             key = doc.page_content[:100]
             if key not in unique_docs or len(doc.page_content) > len(unique_docs[key].page_content):
                 unique_docs[key] = doc
+        return self._apply_dedup_weights(list(unique_docs.values()))[:k]
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        在一次調用中嵌入多個查詢
+        
+        Args:
+            queries: 查詢列表
+            
+        Returns:
+            與 queries 順序一致的嵌入列表
+        """
+        embeddings = self.vector_manager.embeddings
+        if hasattr(embeddings, 'embed_queries'):
+            return embeddings.embed_queries(queries)
+        return embeddings.embed_documents(queries)
+
+    def retrieve_candidates_batch(self, queries: List[str], strategy: str, k: Optional[int] = None) -> List[List[Document]]:
+        """
+        按策略批量檢索候選文檔（不重排序）
         
-        docs = list(unique_docs.values())[:self.settings['top_k']]
+        所有查詢在一次調用中嵌入、在一次 Chroma 查詢中檢索，混合檢索的 BM25 分數批量計算。
+        RAG Fusion 需要逐個問題調用 LLM 擴展查詢，仍按問題分別檢索。
         
-        if use_reranking and reranker:
-            compression_retriever = ContextualCompressionRetriever(
-                base_retriever=lambda x: docs,
-                doc_compressor=reranker
+        Args:
+            queries: 查詢列表
+            strategy: 檢索策略（hybrid、fusion、standard）
+            k: 候選數量，默認為 top_k
+            
+        Returns:
+            與 queries 順序一致的文檔列表
+        """
+        if strategy == 'fusion':
+            return [self.rag_fusion_retrieval(query) for query in queries]
+        if self.vector_manager.vectorstore is None or not queries:
+            return [[] for _ in queries]
+        
+        k = k or self.settings['top_k']
+        if strategy != 'hybrid':
+            vector_results = self.vector_manager.similarity_search_by_vectors(
+                self._embed_queries(queries), k * DEDUP_OVERFETCH_FACTOR
             )
-            return compression_retriever.invoke(query)
-        return docs
+            return [self._apply_dedup_weights(docs)[:k] for docs in vector_results]
+        vector_results = self.vector_manager.similarity_search_by_vectors(self._embed_queries(queries), k)
+        bm25_results = self._bm25_search_batch(queries, top_k=k)
+        return [self._merge_hybrid(vector_docs, bm25_docs, k)
+                for vector_docs, bm25_docs in zip(vector_results, bm25_results)]
+
+    def rerank(self, query: str, docs: List[Document], reranker: any) -> List[Document]:
+        """
+        對候選文檔重排序
+        
+        Args:
+            query: 查詢
+            docs: 候選文檔列表
+            reranker: 重排序器（文檔壓縮器）
+            
+        Returns:
+            重排序後的前 top_k 個文檔
+        """
+        if not docs:
+            return docs
+        return list(reranker.compress_documents(docs, query))[:self.settings['top_k']]
 
     def rag_fusion_retrieval(self, query: str) -> List[Document]:
         """
         RAG Fusion 檢索
         
+        擴展查詢一次批量嵌入，在一次 Chroma 查詢中檢索，再以倒數排名融合（RRF）合併各查詢的結果。
+        融合分數（乘以去重權重）寫入 metadata['score']。
+        
         Args:
             query: 查詢
             
         Returns:
             文檔列表
         """
+        if self.vector_manager.vectorstore is None:
+            return []
+        
         expanded_queries = self._query_expansion(query)
-        all_docs = []
-        for q in expanded_queries:
-            docs = self.standard_retrieval(q)
-            all_docs.extend(docs)
+        results = self.vector_manager.similarity_search_by_vectors(
+            self._embed_queries(expanded_queries), self.settings['top_k']
+        )
         
-        unique_docs = {}
-        for doc in all_docs:
-            key = doc.page_content[:100]
-            if key not in unique_docs:
-                unique_docs[key] = doc
+        fused = {}
+        for docs in results:
+            for rank, doc in enumerate(docs):
+                key = doc.id or doc.page_content[:100]
+                score, first = fused.get(key, (0.0, doc))
+                fused[key] = (score + 1.0 / (RRF_K + rank + 1), first)
         
-        return list(unique_docs.values())[:self.settings['top_k']]
+        ranked = []
+        for score, doc in fused.values():
+            score *= doc.metadata.get('dedup_weight', 1.0)
+            ranked.append(Document(id=doc.id, page_content=doc.page_content,
+                                   metadata={**doc.metadata, SCORE_METADATA_KEY: score}))
+        ranked.sort(key=lambda doc: doc.metadata[SCORE_METADATA_KEY], reverse=True)
+        return ranked[:self.settings['top_k']]
 
     def _query_expansion(self, query: str, num_expansions: int = 3) -> List[str]:
         """
-        查詢擴展
+        查詢擴展（結果按問題快取，重複查詢與重新生成回答時不再調用 LLM）
         
         Args:
             query: 查詢
@@ -193,6 +402,13 @@ class RetrievalManager:
             print("LLM未初始化，無法進行查詢擴展")
             return [query]
         
+        cache_key = (normalize_question(query), self.settings.get('llm_model'), num_expansions)
+        with self._expansion_lock:
+            cached = self._expansion_cache.get(cache_key)
+            if cached is not None and cached[0] > time.time():
+                self._expansion_cache.move_to_end(cache_key)
+                return list(cached[1])
+        
         prompt = f"""
         你是一個專業的查詢擴展助手。你的任務是生成多個不同的查詢，這些查詢與原始查詢表達相同的意思，但使用不同的詞彙和表達方式。
         
@@ -207,7 +423,7 @@ class RetrievalManager:
         """
         
         try:
-            response = self.llm.predict(prompt)
+            response = self.llm.invoke(prompt).content
             expanded_queries = []
             for line in response.strip().split('\n'):
                 line = line.strip()
@@ -219,7 +435,12 @@ class RetrievalManager:
                 expanded_queries = [query]
             if query not in expanded_queries:
                 expanded_queries.insert(0, query)
-            return expanded_queries
         except Exception as e:
             print(f"查詢擴展時出錯: {str(e)}")
-            return [query]
\ No newline at end of file
+            return [query]
+        
+        with self._expansion_lock:
+            self._expansion_cache[cache_key] = (time.time() + EXPANSION_CACHE_TTL_SECONDS, expanded_queries)
+            while len(self._expansion_cache) > EXPANSION_CACHE_SIZE:
+                self._expansion_cache.popitem(last=False)
+        return list(expanded_queries)
@@ -0,0 +1,140 @@
+"""
+Retrieval Cache - 檢索結果快取
+按 (規範化問題, 檢索策略, 檢索階段, 知識庫版本) 短時間保存檢索到的文本塊，
+重新生成回答或重複查詢時只重做設置有變化的階段
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain.schema import Document
+
+from api.managers.answer_cache import normalize_question
+
+DEFAULT_RETRIEVAL_CACHE_CONFIG = {
+    'ENABLED': True,
+    'TTL_SECONDS': 600,
+    'MAX_ENTRIES': 1000,
+}
+
+# 檢索階段：候選文本塊（向量/BM25/RAG Fusion 檢索）與重排序後的結果
+STAGE_CANDIDATES = 'candidates'
+STAGE_RERANKED = 'reranked'
+
+def make_retrieval_key(question: str, strategy: str, stage: str, settings: Dict[str, Any], corpus_version: int,
+                       depth: Optional[int] = None, reranker: str = '') -> str:
+    """
+    計算檢索快取鍵
+
+    Args:
+        question: 問題
+        strategy: 檢索策略（hybrid、fusion、standard）
+        stage: 檢索階段（STAGE_CANDIDATES 或 STAGE_RERANKED）
+        settings: 當前設置字典
+        corpus_version: 知識庫版本
+        depth: 候選數量，默認為 top_k
+        reranker: 重排序器標識（類型與模型），重排序結果隨之變化
+
+    Returns:
+        快取鍵（sha256 十六進制字符串）
+    """
+    payload = json.dumps(
+        [normalize_question(question), strategy, stage, settings.get('top_k'), depth or settings.get('top_k'),
+         settings.get('embedding_model'), corpus_version, reranker],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class RetrievalCache:
+    """檢索結果快取類，進程內 LRU，條目在 TTL_SECONDS 後過期"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化檢索結果快取
+
+        Args:
+            config: 配置（見 settings.RAG_RETRIEVAL_CACHE）
+        """
+        self.config = {**DEFAULT_RETRIEVAL_CACHE_CONFIG, **(config or {})}
+        self.enabled = bool(self.config['ENABLED'])
+        # 鍵 -> (過期時間, 檢索階段, 文檔列表)，按訪問順序排列
+        self._entries: 'OrderedDict[str, Tuple[float, str, List[Document]]]' = OrderedDict()
+        self._hits: Dict[str, int] = {STAGE_CANDIDATES: 0, STAGE_RERANKED: 0}
+        self._misses: Dict[str, int] = {STAGE_CANDIDATES: 0, STAGE_RERANKED: 0}
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, stage: str) -> Optional[List[Document]]:
+        """
+        查詢快取
+
+        Args:
+            key: 快取鍵（見 make_retrieval_key）
+            stage: 檢索階段（僅用於統計）
+
+        Returns:
+            文檔列表，未命中或已過期時返回 None
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self._hits[stage] += 1
+                    return list(entry[2])
+                del self._entries[key]
+            self._misses[stage] += 1
+            return None
+
+    def put(self, key: str, stage: str, documents: List[Document]) -> None:
+        """
+        寫入快取
+
+        Args:
+            key: 快取鍵
+            stage: 檢索階段
+            documents: 檢索到的文檔列表
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.config['TTL_SECONDS'], stage, list(documents))
+            while len(self._entries) > self.config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """清空條目與計數器"""
+        with self._lock:
+            self._entries.clear()
+            self._hits = {STAGE_CANDIDATES: 0, STAGE_RERANKED: 0}
+            self._misses = {STAGE_CANDIDATES: 0, STAGE_RERANKED: 0}
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取快取統計信息
+
+        Returns:
+            包含各階段命中/未命中次數、命中率與條目數的字典
+        """
+        with self._lock:
+            hits = sum(self._hits.values())
+            lookups = hits + sum(self._misses.values())
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'candidate_hits': self._hits[STAGE_CANDIDATES],
+                'candidate_misses': self._misses[STAGE_CANDIDATES],
+                'rerank_hits': self._hits[STAGE_RERANKED],
+                'rerank_misses': self._misses[STAGE_RERANKED],
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'ttl_seconds': self.config['TTL_SECONDS'],
+            }
@@ -0,0 +1,299 @@
+"""
+Semantic Cache - 語義問答快取
+以問題嵌入的餘弦相似度查找改寫過的相同問題，引用的文件未變更時直接返回已生成的回答
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 自定義日誌函數，確保輸出後立即刷新
+def log_message(message):
+    """輸出日誌並立即刷新緩衝區"""
+    print(message, flush=True)
+
+DEFAULT_SEMANTIC_CACHE_CONFIG = {
+    'ENABLED': True,
+    'SIMILARITY_THRESHOLD': 0.92,
+    'MAX_ENTRIES': 5000,
+    'TTL_SECONDS': 24 * 3600,
+    'AUDIT_SAMPLE_RATE': 0.05,
+    'AUDIT_MIN_OVERLAP': 0.5,
+    'QUERY_EMBEDDING_MEMO_SIZE': 256,
+}
+
+# 命中時最多驗證的候選條目數，超過仍未找到有效條目則視為未命中
+MAX_VALIDATION_CANDIDATES = 3
+
+class MemoizedQueryEmbeddings(Embeddings):
+    """
+    嵌入模型包裝類，記住最近的問題嵌入
+
+    語義快取未命中時檢索會再次嵌入同一個問題，包裝後兩次調用只計算一次。
+    文檔嵌入直接轉發，不做快取。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = 256):
+        """
+        初始化包裝類
+
+        Args:
+            embeddings: 實際的嵌入模型
+            max_entries: 記住的問題數量
+        """
+        self.embeddings = embeddings
+        self.max_entries = max(1, int(max_entries))
+        self._memo: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量嵌入多個問題，未記住的問題在一次調用中計算
+
+        HuggingFaceEmbeddings 未設置 query_encode_kwargs 時問題與文檔的編碼方式相同，因此以 embed_documents 批量計算。
+
+        Args:
+            texts: 問題列表
+
+        Returns:
+            與 texts 順序一致的嵌入列表
+        """
+        with self._lock:
+            vectors = {text: self._memo[text] for text in texts if text in self._memo}
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing:
+            computed = self.embeddings.embed_documents(missing)
+            with self._lock:
+                for text, vector in zip(missing, computed):
+                    vectors[text] = vector
+                    self._memo[text] = vector
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+        return [vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._memo.get(text)
+            if vector is not None:
+                self._memo.move_to_end(text)
+                return vector
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._memo[text] = vector
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return vector
+
+class SemanticCache:
+    """
+    語義快取類
+
+    條目的問題嵌入經 L2 正規化後按行保存在矩陣中，查找時以一次矩陣乘法計算與全部條目的餘弦相似度。
+    條目數受 MAX_ENTRIES 限制，精確搜索在此規模下比維護近似最近鄰索引更快，結果也不會漏掉最相似的條目。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化語義快取
+
+        Args:
+            config: 配置（見 settings.RAG_SEMANTIC_CACHE）
+        """
+        self.config = {**DEFAULT_SEMANTIC_CACHE_CONFIG, **(config or {})}
+        self.enabled = bool(self.config['ENABLED'])
+        self.threshold = float(self.config['SIMILARITY_THRESHOLD'])
+        # 條目ID -> 條目字典，按最近使用順序排列
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        # 與 _entry_ids 逐行對應的嵌入矩陣，條目變更後延遲重建
+        self._matrix: Optional[np.ndarray] = None
+        self._entry_ids: List[str] = []
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.audited = 0
+        self.false_hits = 0
+        self._hit_similarity_sum = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if not norm:
+            return None
+        return vector / norm
+
+    def _rebuild_matrix(self) -> None:
+        self._entry_ids = list(self._entries)
+        if self._entry_ids:
+            self._matrix = np.vstack([self._entries[entry_id]['vector'] for entry_id in self._entry_ids])
+        else:
+            self._matrix = None
+        self._dirty = False
+
+    def _remove(self, entry_id: str) -> None:
+        if self._entries.pop(entry_id, None) is not None:
+            self._dirty = True
+
+    def lookup(self, embedding: List[float], settings_key: str,
+               is_valid: Callable[[Dict[str, int]], bool]) -> Optional[Dict[str, Any]]:
+        """
+        查找與問題嵌入最相似且仍然有效的條目
+
+        Args:
+            embedding: 問題嵌入
+            settings_key: 檢索相關設置的指紋，只匹配相同設置下生成的條目
+            is_valid: 接收條目的 {文件ID: 索引版本}，引用的文件均未變更時返回 True
+
+        Returns:
+            條目字典（包含 entry_id、question、answer、related_docs、similarity），未命中時返回 None
+        """
+        if not self.enabled:
+            return None
+        vector = self._normalize(embedding)
+        now = time.time()
+        candidates = []
+        with self._lock:
+            if vector is not None and self._entries:
+                if self._dirty or self._matrix is None:
+                    self._rebuild_matrix()
+                if self._matrix.shape[1] == vector.shape[0]:
+                    similarities = self._matrix @ vector
+                    for index in np.argsort(-similarities):
+                        similarity = float(similarities[index])
+                        if similarity < self.threshold or len(candidates) >= MAX_VALIDATION_CANDIDATES:
+                            break
+                        entry = self._entries.get(self._entry_ids[index])
+                        if entry is None or entry['settings_key'] != settings_key:
+                            continue
+                        if entry['expires_at'] <= now:
+                            self._remove(entry['entry_id'])
+                            continue
+                        candidates.append((similarity, entry))
+
+        # 驗證需要查詢資料庫，不在鎖內進行
+        for similarity, entry in candidates:
+            if not is_valid(entry['file_versions']):
+                with self._lock:
+                    self._remove(entry['entry_id'])
+                    self.stale += 1
+                continue
+            with self._lock:
+                if entry['entry_id'] in self._entries:
+                    self._entries.move_to_end(entry['entry_id'])
+                self.hits += 1
+                self._hit_similarity_sum += similarity
+            return {
+                'entry_id': entry['entry_id'],
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'related_docs': entry['related_docs'],
+                'file_versions': entry['file_versions'],
+                'similarity': similarity,
+            }
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, embedding: List[float], settings_key: str, answer: str,
+            related_docs: List[Dict[str, Any]], file_versions: Dict[str, int]) -> Optional[str]:
+        """
+        寫入條目
+
+        Args:
+            question: 原始問題
+            embedding: 問題嵌入
+            settings_key: 檢索相關設置的指紋
+            answer: 回答
+            related_docs: 相關文檔列表
+            file_versions: 回答引用的文件在生成時的 {文件ID: 索引版本}
+
+        Returns:
+            條目ID，未寫入時返回 None
+        """
+        if not self.enabled:
+            return None
+        vector = self._normalize(embedding)
+        if vector is None:
+            return None
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            first = next(iter(self._entries.values()), None)
+            if first is not None and first['vector'].shape != vector.shape:
+                # 嵌入模型已更換，舊條目無法比較
+                self._entries.clear()
+            self._entries[entry_id] = {
+                'entry_id': entry_id,
+                'question': question,
+                'vector': vector,
+                'settings_key': settings_key,
+                'answer': answer,
+                'related_docs': related_docs,
+                'file_versions': dict(file_versions),
+                'expires_at': time.time() + self.config['TTL_SECONDS'],
+            }
+            while len(self._entries) > self.config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        return entry_id
+
+    def record_audit(self, entry_id: str, false_hit: bool) -> None:
+        """
+        記錄一次命中抽檢的結果，誤命中的條目會被移除以免再次返回
+
+        Args:
+            entry_id: 條目ID
+            false_hit: 重新檢索的結果是否與條目引用的文件明顯不同
+        """
+        with self._lock:
+            self.audited += 1
+            if false_hit:
+                self.false_hits += 1
+                self._remove(entry_id)
+
+    def clear(self) -> None:
+        """清空條目與計數器"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._entry_ids = []
+            self._dirty = False
+            self.hits = self.misses = self.stale = self.evictions = 0
+            self.audited = self.false_hits = 0
+            self._hit_similarity_sum = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        獲取快取統計信息
+
+        Returns:
+            包含命中率、誤命中率（抽檢得出）、失效與淘汰次數等的字典
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'similarity_threshold': self.threshold,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'audited': self.audited,
+                'false_hits': self.false_hits,
+                'false_hit_rate': self.false_hits / self.audited if self.audited else 0.0,
+                'avg_hit_similarity': self._hit_similarity_sum / self.hits if self.hits else 0.0,
+                'ttl_seconds': self.config['TTL_SECONDS'],
+            }
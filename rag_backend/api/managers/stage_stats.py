@@ -0,0 +1,74 @@
+"""
+Stage Stats - 分階段並發限制與吞吐量統計
+與 IngestionQueue.stage 接口相同，可作為 FileProcessor 的 stage_limiter，額外記錄各階段的等待與執行時間
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+class StageStats:
+    """分階段統計類，限制各階段並發並累計調用次數、執行時間與等待時間"""
+
+    def __init__(self, stage_concurrency: Optional[Dict[str, int]] = None):
+        """
+        初始化分階段統計
+
+        Args:
+            stage_concurrency: {階段名稱: 並發上限}，未配置的階段不限制並發但仍會統計
+        """
+        self._limits = {name: max(1, int(limit)) for name, limit in (stage_concurrency or {}).items()}
+        self._semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in self._limits.items()}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        佔用指定處理階段的一個並發名額並計時
+
+        Args:
+            name: 階段名稱（如 parse、context、embed）
+        """
+        semaphore = self._semaphores.get(name)
+        waiting_since = time.perf_counter()
+        if semaphore is not None:
+            semaphore.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            if semaphore is not None:
+                semaphore.release()
+            with self._lock:
+                stats = self._stats.setdefault(name, {'calls': 0, 'busy_seconds': 0.0, 'wait_seconds': 0.0})
+                stats['calls'] += 1
+                stats['busy_seconds'] += finished - started
+                stats['wait_seconds'] += started - waiting_since
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        獲取各階段的統計
+
+        每槽吞吐量 = 調用次數 / 執行時間，反映單個並發名額的處理速度；
+        有效吞吐量 = 調用次數 / 經過時間，反映整體速度。等待時間高的階段即為瓶頸。
+
+        Returns:
+            {'elapsed_seconds': 經過時間, 'stages': {階段名稱: 統計字典}}
+        """
+        elapsed = time.perf_counter() - self.started_at
+        with self._lock:
+            stages = {}
+            for name, stats in self._stats.items():
+                busy = stats['busy_seconds']
+                stages[name] = {
+                    'calls': int(stats['calls']),
+                    'concurrency': self._limits.get(name),
+                    'busy_seconds': busy,
+                    'wait_seconds': stats['wait_seconds'],
+                    'per_slot_per_second': stats['calls'] / busy if busy else 0.0,
+                    'effective_per_second': stats['calls'] / elapsed if elapsed else 0.0,
+                }
+        return {'elapsed_seconds': elapsed, 'stages': stages}
@@ -0,0 +1,78 @@
+"""
+Token Counter - 令牌計數
+優先使用 tiktoken 精確計數，未安裝時按字符數估算
+"""
+import threading
+from typing import Optional
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def _get_encoding(model: Optional[str]):
+    """
+    獲取（並快取）模型對應的 tiktoken 編碼器
+
+    Args:
+        model: 模型名稱，未知模型使用 cl100k_base
+
+    Returns:
+        編碼器，tiktoken 不可用時返回 None
+    """
+    key = model or ''
+    if key in _encodings:
+        return _encodings[key]
+    with _encodings_lock:
+        if key not in _encodings:
+            try:
+                import tiktoken
+                try:
+                    encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding('cl100k_base')
+                except KeyError:
+                    encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception:
+                encoding = None
+            _encodings[key] = encoding
+    return _encodings[key]
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    計算文本的令牌數
+
+    Args:
+        text: 文本
+        model: 模型名稱（可選）
+
+    Returns:
+        令牌數
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # 中文約每字一個令牌，英文約每四個字符一個令牌，取偏保守的估計
+        return len(text) // 2 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    截斷文本至不超過 max_tokens 個令牌
+
+    Args:
+        text: 文本
+        max_tokens: 令牌數上限
+        model: 模型名稱（可選）
+
+    Returns:
+        截斷後的文本
+    """
+    if max_tokens <= 0 or not text:
+        return ''
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # 與 count_tokens 的估算一致：n 個字符約 n // 2 + 1 個令牌
+        return text[:max_tokens * 2 - 1]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 截斷點可能落在多字節字符中間，解碼時丟棄不完整的字符
+    return encoding.decode_bytes(tokens[:max_tokens]).decode('utf-8', errors='ignore')
@@ -38,12 +38,13 @@ class VectorManager:
             self.vectorstore = None
             log_message(f"向量數據庫尚未初始化，將在添加文檔時創建")
     
-    def add_documents(self, documents: List[Document]) -> None:
+    def add_documents(self, documents: List[Document], batch_size: int = 0) -> None:
         """
         將文檔添加到向量存儲
         
         Args:
             documents: 文檔列表
+            batch_size: 每批嵌入並寫入的文檔數，0 表示一次寫入全部（大文件分批可限制嵌入時的記憶體佔用）
         """
         if not documents:
             log_message("沒有文檔可添加")
@@ -54,16 +55,19 @@ class VectorManager:
             if 'file_id' not in doc.metadata or not doc.metadata['file_id']:
                 log_message("警告: 發現缺少 file_id 的文檔，這可能導致無法正確刪除文檔")
         
-        if self.vectorstore is None:
-            self.vectorstore = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=self.chroma_db_dir
-            )
-            log_message(f"已創建新的向量數據庫並添加 {len(documents)} 個文檔")
-        else:
-            self.vectorstore.add_documents(documents)
-            log_message(f"已向現有向量數據庫添加 {len(documents)} 個文檔")
+        batch_size = batch_size if batch_size > 0 else len(documents)
+        for offset in range(0, len(documents), batch_size):
+            batch = documents[offset:offset + batch_size]
+            if self.vectorstore is None:
+                self.vectorstore = Chroma.from_documents(
+                    documents=batch,
+                    embedding=self.embeddings,
+                    persist_directory=self.chroma_db_dir
+                )
+                log_message(f"已創建新的向量數據庫並添加 {len(batch)} 個文檔")
+            else:
+                self.vectorstore.add_documents(batch)
+                log_message(f"已向現有向量數據庫添加 {len(batch)} 個文檔")
         
         log_message("向量數據庫已持久化")
     
@@ -209,6 +213,31 @@ class VectorManager:
             log_message(f"刪除文件 {file_id} 的文檔時出錯: {str(e)}")
             # 即使出錯也繼續處理，不中斷整體刪除流程
     
+    def similarity_search_by_vectors(self, query_embeddings: List[List[float]], k: int) -> List[List[Document]]:
+        """
+        以多個查詢向量在一次 Chroma 查詢中檢索
+        
+        Args:
+            query_embeddings: 查詢向量列表
+            k: 每個查詢返回的文檔數量
+            
+        Returns:
+            與 query_embeddings 順序一致的文檔列表（按相似度排序），Document.id 為 Chroma 中的文本塊ID
+        """
+        if self.vectorstore is None or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        
+        result = self.vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            include=["documents", "metadatas"]
+        )
+        return [
+            [Document(id=chunk_id, page_content=text or '', metadata=metadata or {})
+             for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+            for ids, texts, metadatas in zip(result['ids'], result['documents'], result['metadatas'])
+        ]
+    
     def update_embeddings(self, embeddings: any) -> None:
         """
         更新嵌入模型並重新初始化向量存儲
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_corpusversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='indexed_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
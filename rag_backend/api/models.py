@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 # from django.forms.models import model_to_dict # Not strictly needed here unless used elsewhere
 
 class Tag(models.Model):
@@ -11,6 +12,24 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+class IngestionBatch(models.Model):
+    # A bulk import (archive upload or server-side directory) whose files are ingested together
+    SOURCE_CHOICES = [
+        ('archive', 'Archive'),
+        ('directory', 'Directory'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    name = models.CharField(max_length=1024)
+    total_files = models.IntegerField(default=0)
+    skipped_files = models.IntegerField(default=0) # 不支持的類型、超出限制或無法讀取的成員
+    extraction_done = models.BooleanField(default=False) # 所有成員已解出並加入攝取佇列
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"IngestionBatch {self.id} ({self.name})"
+
 class File(models.Model):
     STATUS_CHOICES = [
         ('uploading', 'Uploading'),
@@ -29,11 +48,83 @@ class File(models.Model):
     upload_time = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
     chunks_count = models.IntegerField(default=0)
+    # Corpus version at which this file's chunks were last written; semantic cache hits citing the file are
+    # only served while it is unchanged
+    indexed_version = models.BigIntegerField(default=0)
     tags = models.ManyToManyField(Tag, blank=True)
+    batch = models.ForeignKey(IngestionBatch, related_name='files', null=True, blank=True, on_delete=models.SET_NULL)
 
     def __str__(self):
         return self.original_filename
 
+class UploadSession(models.Model):
+    # Resumable chunked upload, consumed by api.managers.chunked_upload
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('aborted', 'Aborted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=10)
+    total_size = models.BigIntegerField()
+    received_bytes = models.BigIntegerField(default=0) # 已連續寫入磁盤的字節數，即下一個分片的偏移量
+    sha256 = models.CharField(max_length=64, blank=True, default='') # 預期的校驗和，提供時最後一個分片寫入後自動完成
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active', db_index=True)
+    error = models.TextField(blank=True, default='')
+    file = models.ForeignKey(File, related_name='upload_sessions', null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"UploadSession {self.id} ({self.original_filename})"
+
+class IngestionJob(models.Model):
+    # Persistent ingestion queue entry, consumed by api.managers.job_queue
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file = models.ForeignKey(File, related_name='ingestion_jobs', on_delete=models.CASCADE)
+    file_path = models.CharField(max_length=1024)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    priority = models.SmallIntegerField(default=0) # 優先級類別，數值越小越先處理（0: 互動式單文件上傳，10: 批量導入）
+    size_bytes = models.BigIntegerField(default=0) # 文件大小，同一優先級內小文件先處理
+    owner = models.CharField(max_length=150, blank=True, default='') # 提交者，用於用戶間的公平調度
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    last_error = models.TextField(blank=True, default='')
+    available_at = models.DateTimeField(default=timezone.now) # 重試退避：在此時間之前不會被領取
+    locked_until = models.DateTimeField(null=True, blank=True) # 執行中任務的租約，過期代表工作者已中斷
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'size_bytes'], name='ingestion_job_schedule'),
+        ]
+
+    def __str__(self):
+        return f"IngestionJob {self.id} ({self.status})"
+
+class CorpusVersion(models.Model):
+    # Singleton counter bumped whenever the indexed corpus changes (ingest or delete); part of query cache keys
+    id = models.AutoField(primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CorpusVersion {self.version}"
+
 class Conversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255, default="新對話")
@@ -32,6 +32,18 @@ rag_manager_singleton = RAGManager(
     db_path=RAG_DB_PATH  # 使用 Django 的數據庫路徑
 )
 
+def start_ingestion_workers(force: bool = False) -> None:
+    """
+    啟動攝取任務佇列的工作執行緒（會自動恢復租約過期的未完成任務）
+
+    只由 ASGI/WSGI 入口與 run_ingestion_workers 命令調用；導入本模組（例如系統檢查載入 URLconf、
+    其他管理命令）不會啟動工作執行緒，以免這些進程領取佇列中的任務。
+
+    Args:
+        force: 忽略 RAG_INGESTION_QUEUE['AUTOSTART']（專用的工作進程使用）
+    """
+    rag_manager_singleton.ingestion_queue.start(force=force)
+
 # 初始化資料表
 # rag_manager_singleton.settings_manager._initialize_settings_table()  # 註解掉 rag.db 的初始化
 # rag_manager_singleton.db_manager._initialize_database()  # 註解掉 rag.db 的初始化
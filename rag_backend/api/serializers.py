@@ -1,6 +1,6 @@
 # /home/ubuntu/manus_rag_refactor/backend_merged/api/serializers.py
 from rest_framework import serializers
-from .models import Tag, File, ChatMessage, Setting as SettingModel, Conversation # 添加 Conversation 導入
+from .models import Tag, File, ChatMessage, Setting as SettingModel, Conversation, UploadSession # 添加 Conversation 導入
 
 # 通用響應序列化器
 class StatusResponseSerializer(serializers.Serializer):
@@ -32,6 +32,14 @@ class QueryResultSerializer(serializers.Serializer): # Kept from user, as it is
     answer = serializers.CharField()
     related_docs = serializers.ListField()
 
+class BatchQuerySerializer(serializers.Serializer):
+    questions = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    use_different_strategy = serializers.BooleanField(required=False, default=False)
+    max_concurrency = serializers.IntegerField(required=False, min_value=1)
+    persist = serializers.BooleanField(required=False, default=False)
+    title = serializers.CharField(required=False, max_length=255)
+    show_sources = serializers.BooleanField(required=False, default=True)
+
 # More comprehensive serializers based on my previous version, adapted for merged models
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -56,6 +64,60 @@ class FileSerializer(serializers.ModelSerializer):
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
 
+class BulkUploadSerializer(serializers.Serializer):
+    archive = serializers.FileField(required=False)
+    directory = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if bool(attrs.get('archive')) == bool(attrs.get('directory')):
+            raise serializers.ValidationError("請提供 archive（壓縮包）或 directory（伺服器目錄）其中之一")
+        return attrs
+
+class BulkUploadResponseSerializer(serializers.Serializer):
+    batch_id = serializers.UUIDField()
+    total_files = serializers.IntegerField()
+    skipped_files = serializers.IntegerField()
+
+class IngestionBatchStatusSerializer(serializers.Serializer):
+    batch_id = serializers.UUIDField()
+    source = serializers.CharField()
+    name = serializers.CharField()
+    total_files = serializers.IntegerField()
+    skipped_files = serializers.IntegerField()
+    created_at = serializers.DateTimeField()
+    uploading = serializers.IntegerField()
+    processing = serializers.IntegerField()
+    processed = serializers.IntegerField()
+    cancelled = serializers.IntegerField()
+    error = serializers.IntegerField()
+    extraction_done = serializers.BooleanField()
+    progress = serializers.FloatField()
+    is_complete = serializers.BooleanField()
+
+class UploadSessionInitSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    total_size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+
+class UploadSessionFinalizeSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    file = FileSerializer(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'original_filename', 'file_type', 'total_size', 'received_bytes', 'sha256', 'status', 'error', 'file', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+class IngestionEstimateSerializer(serializers.Serializer):
+    job_id = serializers.CharField()
+    status = serializers.CharField()
+    priority = serializers.IntegerField()
+    jobs_ahead = serializers.IntegerField()
+    estimated_seconds = serializers.FloatField()
+    estimated_ready_at = serializers.DateTimeField()
+
 class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
@@ -119,3 +181,102 @@ class VectorstoreMaintenanceResponseSerializer(serializers.Serializer):
     message = serializers.CharField()
     document_count = serializers.IntegerField()
 
+# 攝取佇列狀態序列化器
+class IngestionQueueStatusSerializer(serializers.Serializer):
+    queued = serializers.IntegerField()
+    running = serializers.IntegerField()
+    succeeded = serializers.IntegerField()
+    failed = serializers.IntegerField()
+    cancelled = serializers.IntegerField()
+    queue_depth = serializers.IntegerField()
+    workers = serializers.IntegerField()
+    active_jobs = serializers.IntegerField()
+    stage_concurrency = serializers.DictField(child=serializers.IntegerField())
+    stages_in_use = serializers.DictField(child=serializers.IntegerField())
+
+class DedupFileReportSerializer(serializers.Serializer):
+    file_id = serializers.CharField()
+    duplicate_chunks = serializers.IntegerField()
+    chars_saved = serializers.IntegerField()
+
+class DedupReportSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    mode = serializers.CharField()
+    threshold = serializers.FloatField()
+    indexed_chunks = serializers.IntegerField()
+    duplicate_chunks = serializers.IntegerField()
+    vectors_saved = serializers.IntegerField()
+    chars_saved = serializers.IntegerField()
+    files = DedupFileReportSerializer(many=True)
+
+class ContextCacheStatsSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    evictions = serializers.IntegerField()
+    hit_rate = serializers.FloatField()
+    entries = serializers.IntegerField()
+    size_bytes = serializers.IntegerField()
+    max_bytes = serializers.IntegerField()
+
+class AnswerCacheStatsSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    persistent = serializers.BooleanField()
+    hits = serializers.IntegerField()
+    persistent_hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    evictions = serializers.IntegerField()
+    hit_rate = serializers.FloatField()
+    memory_entries = serializers.IntegerField()
+    memory_bytes = serializers.IntegerField()
+    persistent_entries = serializers.IntegerField()
+    ttl_seconds = serializers.IntegerField()
+    corpus_version = serializers.IntegerField()
+
+class SemanticCacheStatsSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    similarity_threshold = serializers.FloatField()
+    entries = serializers.IntegerField()
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    hit_rate = serializers.FloatField()
+    stale = serializers.IntegerField()
+    evictions = serializers.IntegerField()
+    audited = serializers.IntegerField()
+    false_hits = serializers.IntegerField()
+    false_hit_rate = serializers.FloatField()
+    avg_hit_similarity = serializers.FloatField()
+    ttl_seconds = serializers.IntegerField()
+
+class RetrievalCacheStatsSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    entries = serializers.IntegerField()
+    candidate_hits = serializers.IntegerField()
+    candidate_misses = serializers.IntegerField()
+    rerank_hits = serializers.IntegerField()
+    rerank_misses = serializers.IntegerField()
+    hit_rate = serializers.FloatField()
+    evictions = serializers.IntegerField()
+    ttl_seconds = serializers.IntegerField()
+
+class CircuitBreakerStatsSerializer(serializers.Serializer):
+    state = serializers.CharField()
+    consecutive_failures = serializers.IntegerField()
+    times_opened = serializers.IntegerField()
+    rejected = serializers.IntegerField()
+
+class LLMClientStatsSerializer(serializers.Serializer):
+    model = serializers.CharField(allow_null=True)
+    http2 = serializers.BooleanField()
+    max_connections = serializers.IntegerField()
+    max_keepalive_connections = serializers.IntegerField()
+    max_retries = serializers.IntegerField()
+    circuit = CircuitBreakerStatsSerializer()
+
+class RerankerStatusSerializer(serializers.Serializer):
+    enabled = serializers.BooleanField()
+    type = serializers.CharField()
+    active = serializers.CharField(allow_null=True)
+    model = serializers.CharField()
+    candidates = serializers.IntegerField(allow_null=True)
+    error = serializers.CharField(allow_null=True)
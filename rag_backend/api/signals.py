@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .managers.file_metadata import file_metadata_cache
+from .models import File
+
+# 文件上傳、重命名或刪除後，使查詢時使用的文件名快取失效
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def invalidate_file_metadata(sender, instance, **kwargs):
+    file_metadata_cache.invalidate(str(instance.id))
@@ -0,0 +1,547 @@
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from datetime import timedelta
+from unittest import mock
+from uuid import uuid4
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from langchain.schema import Document
+
+from api.managers.chunked_upload import ChunkedUploadManager, UploadOffsetError
+from api.managers.context_generator import (
+    ContextGenerator, _is_rate_limit_error, _is_retryable_error, _parse_batch_response, group_chunks_by_window
+)
+from api.managers.document_parser import (
+    _splitter_spans, create_text_splitter, iter_file_chunks, iter_structured_chunks
+)
+from api.managers.context_packer import CONTEXT_PREFIX_METADATA_KEY, ContextPacker, strip_context_prefix
+from api.managers.llm_client import (
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, CircuitBreaker, LLMUnavailableError
+)
+from api.managers.job_queue import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, DjangoJobStore, IngestionQueue, SQLiteJobStore, rank_candidates
+)
+from api.models import File, IngestionJob, UploadSession
+
+class StripContextPrefixTests(SimpleTestCase):
+    """上下文前綴去除的回歸測試：沒有上下文的文本塊不能被切掉第一段"""
+
+    chunk = "第一條　員工請假須提前申請。\n\n第二條　特別休假給予七日。"
+
+    def test_chunk_without_context_keeps_first_paragraph(self):
+        doc = Document(page_content=self.chunk, metadata={CONTEXT_PREFIX_METADATA_KEY: 0})
+        self.assertEqual(strip_context_prefix(doc), self.chunk)
+
+    def test_chunk_with_context_strips_prefix(self):
+        context = "本段摘自員工手冊的請假規定。"
+        doc = Document(page_content=f"{context}\n\n{self.chunk}",
+                       metadata={CONTEXT_PREFIX_METADATA_KEY: len(context) + 2})
+        self.assertEqual(strip_context_prefix(doc), self.chunk)
+
+    def test_chunk_with_offsets_but_no_prefix_length(self):
+        # 前綴長度寫入之前攝取的文本塊：有沒有上下文都以原始長度確定前綴
+        metadata = {'start_index': 100, 'end_index': 100 + len(self.chunk)}
+        plain = Document(page_content=self.chunk, metadata=metadata)
+        enhanced = Document(page_content=f"上下文描述\n\n{self.chunk}", metadata=metadata)
+        self.assertEqual(strip_context_prefix(plain), self.chunk)
+        self.assertEqual(strip_context_prefix(enhanced), self.chunk)
+
+    def test_legacy_chunk_splits_on_first_blank_line(self):
+        doc = Document(page_content=f"上下文描述\n\n{self.chunk}")
+        self.assertEqual(strip_context_prefix(doc), self.chunk)
+        self.assertEqual(strip_context_prefix(doc, use_contextual_embeddings=False), doc.page_content)
+
+    def test_pack_keeps_first_paragraph_of_chunk_without_context(self):
+        doc = Document(page_content=self.chunk, metadata={'file_id': '1', 'page': 0, CONTEXT_PREFIX_METADATA_KEY: 0})
+        context, packed = ContextPacker().pack([doc], {'1': '員工手冊.pdf'}, 'gpt-4o-mini', 3000)
+        self.assertIn("第一條　員工請假須提前申請。", context)
+        self.assertEqual(packed, [doc])
+
+def _candidate(job_id, priority=PRIORITY_INTERACTIVE, size_bytes=0, owner='', created_ts=0.0, status='queued'):
+    return {'id': job_id, 'priority': priority, 'size_bytes': size_bytes, 'owner': owner,
+            'created_ts': created_ts, 'status': status}
+
+class RankCandidatesTests(SimpleTestCase):
+    """攝取任務調度順序：中斷恢復、優先級、用戶公平、短任務優先與優先級老化"""
+
+    def ranked_ids(self, candidates, running_by_owner=None, now=1000.0, aging_seconds=0):
+        return [job['id'] for job in rank_candidates(candidates, running_by_owner or {}, now, aging_seconds)]
+
+    def test_expired_running_job_comes_first(self):
+        candidates = [_candidate('queued'), _candidate('expired', priority=PRIORITY_BULK, size_bytes=10 ** 9, status='running')]
+        self.assertEqual(self.ranked_ids(candidates), ['expired', 'queued'])
+
+    def test_priority_then_shortest_job_then_creation_time(self):
+        candidates = [
+            _candidate('bulk-small', priority=PRIORITY_BULK, size_bytes=1),
+            _candidate('large', size_bytes=500),
+            _candidate('small-newer', size_bytes=100, created_ts=20),
+            _candidate('small-older', size_bytes=100, created_ts=10),
+        ]
+        self.assertEqual(self.ranked_ids(candidates), ['small-older', 'small-newer', 'large', 'bulk-small'])
+
+    def test_aged_bulk_job_competes_as_interactive(self):
+        candidates = [
+            _candidate('interactive', size_bytes=500, created_ts=990),
+            _candidate('bulk', priority=PRIORITY_BULK, size_bytes=100, created_ts=0),
+        ]
+        self.assertEqual(self.ranked_ids(candidates, aging_seconds=0), ['interactive', 'bulk'])
+        self.assertEqual(self.ranked_ids(candidates, aging_seconds=600), ['bulk', 'interactive'])
+
+    def test_owner_with_fewer_running_jobs_goes_first(self):
+        candidates = [_candidate('busy', owner='alice', size_bytes=1), _candidate('idle', owner='bob', size_bytes=900)]
+        self.assertEqual(self.ranked_ids(candidates, {'alice': 2}), ['idle', 'busy'])
+        self.assertEqual(self.ranked_ids(candidates, {}), ['busy', 'idle'])
+
+class SQLiteJobStoreTests(SimpleTestCase):
+    """SQLite 任務存儲：原子領取、租約過期後重新領取，以及舊工作者不能覆蓋新一次嘗試"""
+
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, self.db_path)
+        self.store = SQLiteJobStore(self.db_path)
+
+    def job_row(self, job_id):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute('SELECT status, attempts FROM ingestion_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def test_running_job_is_not_claimed_twice(self):
+        job_id = self.store.enqueue('file-1', '/tmp/a.txt', 3)
+        claimed = []
+        barrier = threading.Barrier(8)
+
+        def claim():
+            barrier.wait()
+            claimed.append(self.store.claim(lease_seconds=60))
+
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        jobs = [job for job in claimed if job is not None]
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['id'], job_id)
+        self.assertEqual(jobs[0]['attempts'], 1)
+
+    def test_expired_lease_is_reclaimed_and_stale_worker_is_ignored(self):
+        job_id = self.store.enqueue('file-1', '/tmp/a.txt', 3)
+        first = self.store.claim(lease_seconds=-1)
+        second = self.store.claim(lease_seconds=60)
+        self.assertEqual((second['id'], second['attempts']), (job_id, 2))
+        self.assertIsNone(self.store.claim(lease_seconds=60))
+
+        # 第一次嘗試的工作者在租約過期後才結束，不能覆蓋第二次嘗試
+        self.assertFalse(self.store.finish(job_id, first['attempts'], 'succeeded'))
+        self.assertFalse(self.store.retry(job_id, first['attempts'], 0))
+        self.assertEqual(self.job_row(job_id), ('running', 2))
+        self.assertTrue(self.store.finish(job_id, second['attempts'], 'succeeded'))
+        self.assertEqual(self.job_row(job_id), ('succeeded', 2))
+
+class DjangoJobStoreTests(TestCase):
+    """Django 任務存儲：租約過期的執行中任務以條件更新重新領取"""
+
+    def setUp(self):
+        self.file = File.objects.create(original_filename='a.txt', file='uploads/a.txt', file_type='txt',
+                                        file_size=1, status='processing')
+        self.store = DjangoJobStore()
+
+    def test_expired_lease_is_reclaimed_and_stale_worker_is_ignored(self):
+        job = IngestionJob.objects.create(file=self.file, file_path='/tmp/a.txt', status='running', attempts=1,
+                                          locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = self.store.claim(lease_seconds=60)
+        self.assertEqual((claimed['id'], claimed['attempts']), (str(job.id), 2))
+        self.assertIsNone(self.store.claim(lease_seconds=60))
+
+        self.assertFalse(self.store.finish(str(job.id), 1, 'failed', 'stale'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('running', 2))
+        self.assertTrue(self.store.finish(str(job.id), 2, 'succeeded'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+
+class IngestionQueueRunJobTests(SimpleTestCase):
+    """攝取任務執行結果：失敗後的指數退避重試，以及用盡重試次數後不經 handler 直接失敗"""
+
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, self.db_path)
+        self.handled = []
+        self.exhausted = []
+
+    def make_queue(self, outcome='failed', **config):
+        def handler(job):
+            self.handled.append(job['attempts'])
+            return outcome
+
+        return IngestionQueue(
+            handler,
+            {'BACKEND': 'sqlite', 'SQLITE_PATH': self.db_path, 'AUTOSTART': False, **config},
+            lambda job, error: self.exhausted.append((job['file_id'], error))
+        )
+
+    def make_available(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('UPDATE ingestion_jobs SET available_at = 0')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def test_failed_job_retries_with_exponential_backoff(self):
+        queue = self.make_queue(MAX_ATTEMPTS=3, RETRY_BACKOFF_SECONDS=10)
+        queue.enqueue('file-1', '/tmp/a.txt')
+        delays = []
+        for _ in range(3):
+            self.make_available()
+            job = queue.store.claim(60)
+            before = time.time()
+            queue._run_job(job)
+            queued = queue.store.file_job('file-1')
+            delays.append((queued['status'], round(queued['available_ts'] - before)))
+        self.assertEqual(self.handled, [1, 2, 3])
+        self.assertEqual(delays[:2], [('queued', 10), ('queued', 20)])
+        self.assertEqual(delays[2][0], 'failed')
+        self.assertEqual(self.exhausted, [])
+
+    def test_reclaimed_job_with_exhausted_attempts_fails_without_handler(self):
+        queue = self.make_queue(MAX_ATTEMPTS=1)
+        queue.enqueue('file-1', '/tmp/a.txt')
+        queue.store.claim(lease_seconds=-1)  # 工作者中斷（例如被 OOM 終止），租約過期
+        job = queue.store.claim(lease_seconds=60)
+        self.assertEqual(job['attempts'], 2)
+
+        queue._run_job(job)
+        self.assertEqual(self.handled, [])
+        self.assertEqual(self.exhausted, [('file-1', '超過最大重試次數')])
+        self.assertEqual(queue.store.file_job('file-1')['status'], 'failed')
+
+class _StatusError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class RateLimitErrorTests(SimpleTestCase):
+    """上下文生成的錯誤分類：只有 429 觸發限流退避，錯誤信息中恰好含有 429 的 4xx 不重試"""
+
+    def test_status_code_decides(self):
+        too_long = _StatusError("This model's maximum context length is 128000 tokens. "
+                                "However, your messages resulted in 134290 tokens.", status_code=400)
+        self.assertFalse(_is_rate_limit_error(too_long))
+        self.assertFalse(_is_retryable_error(too_long))
+        self.assertTrue(_is_rate_limit_error(_StatusError('Too Many Requests', status_code=429)))
+        self.assertTrue(_is_retryable_error(_StatusError('Bad Gateway', status_code=502)))
+
+    def test_without_status_code_uses_class_name(self):
+        RateLimitError = type('RateLimitError', (Exception,), {})
+        self.assertTrue(_is_rate_limit_error(RateLimitError('slow down')))
+        self.assertFalse(_is_rate_limit_error(ValueError('got 429 rows')))
+        self.assertTrue(_is_retryable_error(ConnectionError('reset')))
+
+class _ConcurrentWriteStream(io.BytesIO):
+    """讀取分片時模擬另一個 Web 進程先完成了同一偏移量的寫入"""
+
+    def __init__(self, data, session_id, received_bytes):
+        super().__init__(data)
+        self.session_id = session_id
+        self.received_bytes = received_bytes
+
+    def read(self, size=-1):
+        if self.received_bytes is not None:
+            UploadSession.objects.filter(id=self.session_id).update(received_bytes=self.received_bytes)
+            self.received_bytes = None
+        return super().read(size)
+
+class ChunkedUploadAppendTests(TestCase):
+    """分片寫入：received_bytes 以條件更新推進，跨進程的過期寫入者收到 UploadOffsetError"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.manager = ChunkedUploadManager(lambda *args, **kwargs: 'job', {'TEMP_DIR': self.temp_dir})
+        self.session = self.manager.init_session('a.txt', 8)
+
+    def test_append_advances_offset(self):
+        session = self.manager.append_part(self.session.id, 0, io.BytesIO(b'abcd'), 4)
+        self.assertEqual(session.received_bytes, 4)
+        session = self.manager.append_part(self.session.id, 2, io.BytesIO(b'cdef'), 4)
+        self.assertEqual(session.received_bytes, 6)
+        with open(self.manager.part_path(str(self.session.id)), 'rb') as part_file:
+            self.assertEqual(part_file.read(), b'abcdef')
+
+    def test_stale_writer_gets_offset_error(self):
+        stream = _ConcurrentWriteStream(b'abcd', self.session.id, 4)
+        with self.assertRaises(UploadOffsetError) as raised:
+            self.manager.append_part(self.session.id, 0, stream, 4)
+        self.assertEqual(raised.exception.expected_offset, 4)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.received_bytes, 4)
+
+class ParseBatchResponseTests(SimpleTestCase):
+    """批量上下文回答的解析：只保留本批有效的索引，格式錯誤時返回空結果由調用方回退"""
+
+    def test_valid_entries_inside_surrounding_text(self):
+        response = '```json\n{"3": " 第一章的請假規定 ", "4": "第二章"}\n```'
+        self.assertEqual(_parse_batch_response(response, [3, 4]), {3: '第一章的請假規定', 4: '第二章'})
+
+    def test_missing_and_empty_entries_are_omitted(self):
+        response = json.dumps({"0": "上下文", "1": "  ", "2": None})
+        self.assertEqual(_parse_batch_response(response, [0, 1, 2, 3]), {0: '上下文'})
+
+    def test_extra_and_out_of_range_indices_are_ignored(self):
+        response = json.dumps({"0": "a", "1": "b", "7": "c", "-1": "d", "C1": "e", "x": "f"})
+        self.assertEqual(_parse_batch_response(response, [0, 1]), {0: 'a', 1: 'b'})
+
+    def test_malformed_json_returns_nothing(self):
+        for response in ['', 'no json here', '{"0": "截斷的回答', '{"0": "a",}', '["a", "b"]', '}{']:
+            with self.subTest(response=response):
+                self.assertEqual(_parse_batch_response(response, [0]), {})
+
+class GroupChunksByWindowTests(SimpleTestCase):
+    """文本塊按共享窗口分組：每組不超過 batch_size，窗口覆蓋組內文本塊並受 window_chars 限制"""
+
+    def test_short_document_uses_whole_document(self):
+        spans = [(i * 10, i * 10 + 10) for i in range(5)]
+        groups = list(group_chunks_by_window('x' * 50, spans, 2, 100, 5))
+        self.assertEqual(groups, [(0, 50, [0, 1]), (0, 50, [2, 3]), (0, 50, [4])])
+
+    def test_long_document_windows_are_bounded(self):
+        document = 'x' * 30000
+        spans = [(i * 1000, i * 1000 + 1200) for i in range(29)]
+        groups = list(group_chunks_by_window(document, spans, 8, 6000, 500))
+        self.assertEqual([index for _, _, indices in groups for index in indices], list(range(len(spans))))
+        for window_start, window_end, indices in groups:
+            self.assertLessEqual(len(indices), 8)
+            self.assertLessEqual(window_end - window_start, 6000)
+            self.assertEqual(window_start, max(0, spans[indices[0]][0] - 500))
+            self.assertEqual(window_end, min(len(document), max(spans[index][1] for index in indices) + 500))
+
+class _ScriptedLLM:
+    """按順序返回預設回答的 LLM；逐塊提示（含 <chunk>）返回固定的上下文"""
+
+    def __init__(self, batch_responses):
+        self.batch_responses = list(batch_responses)
+        self.prompts = []
+
+    def predict(self, prompt):
+        self.prompts.append(prompt)
+        if '<chunk>' in prompt:
+            return '逐塊上下文'
+        return self.batch_responses.pop(0)
+
+class PredictBatchTests(SimpleTestCase):
+    """批量上下文生成的回退：缺失部分條目時以缺失的標記重試一次，仍缺失或格式錯誤時逐塊生成"""
+
+    def setUp(self):
+        # 超過 10000 字符，逐塊生成時只使用文本塊附近的窗口
+        self.document = ''.join(f'第{i}段內容。' * 600 for i in range(4))
+        step = len(self.document) // 4
+        self.spans = [(i * step, (i + 1) * step) for i in range(4)]
+
+    def run_batch(self, *responses):
+        self.llm = _ScriptedLLM(responses)
+        client = type('Client', (), {'llm': self.llm, 'llm_without_retries': self.llm})()
+        generator = ContextGenerator(client, {'MAX_RETRIES': 0})
+        return generator._predict_batch(self.document, 0, len(self.document), [0, 1, 2, 3], self.spans, None)
+
+    def markers(self, prompt):
+        return sorted(int(index) for index in re.findall(r'\[\[C(\d+)\]\]', prompt))
+
+    def single_prompts(self):
+        return [prompt for prompt in self.llm.prompts if '<chunk>' in prompt]
+
+    def test_complete_response_uses_one_call(self):
+        contexts = self.run_batch(json.dumps({str(i): f'上下文{i}' for i in range(4)}))
+        self.assertEqual(contexts, {i: f'上下文{i}' for i in range(4)})
+        self.assertEqual(len(self.llm.prompts), 1)
+
+    def test_missing_entries_are_retried_once_with_their_markers(self):
+        contexts = self.run_batch(json.dumps({"0": "a", "1": "b"}), json.dumps({"2": "c", "3": "d", "0": "ignored"}))
+        self.assertEqual(contexts, {0: 'a', 1: 'b', 2: 'c', 3: 'd'})
+        self.assertEqual(len(self.llm.prompts), 2)
+        self.assertEqual(self.markers(self.llm.prompts[1]), [2, 3])
+
+    def test_entries_still_missing_after_retry_fall_back_per_chunk(self):
+        contexts = self.run_batch(json.dumps({"0": "a", "1": "b"}), json.dumps({"2": "c"}))
+        self.assertEqual(contexts, {0: 'a', 1: 'b', 2: 'c', 3: '逐塊上下文'})
+        singles = self.single_prompts()
+        self.assertEqual(len(singles), 1)
+        # 逐塊生成只發送文本塊附近的有界窗口，而不是整個文檔
+        self.assertLess(len(singles[0]), len(self.document))
+        self.assertIn(self.document[self.spans[3][0]:self.spans[3][1]], singles[0])
+
+    def test_malformed_response_falls_back_per_chunk_without_retry(self):
+        contexts = self.run_batch('{"0": "a", "1": ')
+        self.assertEqual(contexts, {i: '逐塊上下文' for i in range(4)})
+        self.assertEqual(len(self.llm.prompts), 5)
+        self.assertEqual(len(self.single_prompts()), 4)
+
+    def test_single_missing_entry_falls_back_per_chunk(self):
+        contexts = self.run_batch(json.dumps({"0": "a", "1": "b", "2": "c"}))
+        self.assertEqual(contexts[3], '逐塊上下文')
+        self.assertEqual(len(self.llm.prompts), 2)
+
+def _random_text(rng, length):
+    pieces = ['員工', '請假', '規定', 'policy', 'leave', '第一條', '\n\n', '\n', '。', '！', '？', '；', '，', ' ', '  ']
+    return ''.join(rng.choice(pieces) for _ in range(length))
+
+def _random_pages(rng, count):
+    pages = []
+    for page in range(count):
+        lines = []
+        for section in range(rng.randint(1, 4)):
+            heading = rng.choice(['# 第{0}章', '## {0}.{1} 細則', '第{0}條', '{0}. 總則', ''])
+            lines.append(heading.format(page + 1, section + 1))
+            lines.append(_random_text(rng, rng.randint(20, 120)))
+        pages.append(Document(page_content='\n'.join(lines).strip() or '空白頁', metadata={'page': page}))
+    return pages
+
+class SplitterSpansTests(SimpleTestCase):
+    """按位置分割的結果必須與 RecursiveCharacterTextSplitter.split_text 一致，且位置正確"""
+
+    def test_matches_split_text(self):
+        rng = random.Random(20240601)
+        for case in range(500):
+            chunk_size = rng.choice([20, 50, 100, 300])
+            chunk_overlap = rng.choice([0, chunk_size // 10, chunk_size // 4])
+            document = _random_text(rng, rng.randint(0, 400))
+            splitter = create_text_splitter(chunk_size, chunk_overlap)
+            spans = _splitter_spans(document, splitter)
+            with self.subTest(case=case, chunk_size=chunk_size, chunk_overlap=chunk_overlap):
+                self.assertEqual([document[start:end] for start, end in spans], splitter.split_text(document))
+                self.assertEqual(spans, sorted(spans))
+
+    def test_repeated_chunks_keep_their_own_positions(self):
+        document = '\n\n'.join(['重複的條款內容。'] * 6)
+        spans = _splitter_spans(document, create_text_splitter(10, 0), base=100)
+        self.assertEqual(len(spans), 6)
+        self.assertEqual([start for start, _ in spans], [100 + i * 10 for i in range(6)])
+
+class StreamedChunkOffsetTests(SimpleTestCase):
+    """流式分割輸出的位置對應 "\n\n".join(所有頁面) 中的內容，頁碼為分塊起始位置所在的頁"""
+
+    def assert_offsets_and_pages(self, pages, chunks):
+        full_text = '\n\n'.join(page.page_content for page in pages)
+        page_starts = []
+        position = 0
+        for page in pages:
+            page_starts.append(position)
+            position += len(page.page_content) + 2
+        self.assertTrue(chunks)
+        for chunk in chunks:
+            self.assertEqual(full_text[chunk['start']:chunk['end']], chunk['content'])
+            page_index = bisect_right(page_starts, chunk['start']) - 1
+            self.assertEqual(chunk['page'], pages[page_index].metadata['page'])
+        starts = [chunk['start'] for chunk in chunks]
+        self.assertEqual(starts, sorted(starts))
+
+    def test_structured_chunks_across_windows(self):
+        rng = random.Random(7)
+        for case in range(20):
+            pages = _random_pages(rng, rng.randint(1, 40))
+            chunk_size = rng.choice([60, 150, 400])
+            chunks = list(iter_structured_chunks(iter(pages), chunk_size, create_text_splitter(chunk_size, chunk_size // 10)))
+            with self.subTest(case=case, chunk_size=chunk_size):
+                self.assert_offsets_and_pages(pages, chunks)
+
+    def test_plain_splitting_offsets(self):
+        pages = _random_pages(random.Random(11), 12)
+        settings = {'chunk_size': 80, 'chunk_overlap': 10, 'use_intelligent_splitting': False}
+        self.assert_offsets_and_pages(pages, list(iter_file_chunks(iter(pages), settings)))
+
+class CircuitBreakerTests(SimpleTestCase):
+    """斷路器狀態轉換：連續服務故障後打開，等待後只放行一個探測調用，4xx 與 429 不計為故障"""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('api.managers.llm_client.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    def fail(self, times=1, status_code=None):
+        for _ in range(times):
+            self.breaker.before_call(uuid4())
+            self.breaker.record_failure(_StatusError('failure', status_code=status_code))
+
+    def open_breaker(self):
+        self.fail(3, status_code=503)
+        self.assertEqual(self.breaker.state, CIRCUIT_OPEN)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CIRCUIT_CLOSED)
+        self.breaker.record_success()
+        self.fail(2, status_code=500)
+        self.assertEqual(self.breaker.state, CIRCUIT_CLOSED)
+        self.fail(1, status_code=502)
+        self.assertEqual(self.breaker.state, CIRCUIT_OPEN)
+        self.assertEqual(self.breaker.stats()['times_opened'], 1)
+
+    def test_open_breaker_rejects_calls_until_reset(self):
+        self.open_breaker()
+        self.now += 29
+        with self.assertRaises(LLMUnavailableError):
+            self.breaker.before_call(uuid4())
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_half_open_allows_a_single_probe(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.before_call(uuid4())
+        self.assertEqual(self.breaker.state, CIRCUIT_HALF_OPEN)
+        with self.assertRaises(LLMUnavailableError):
+            self.breaker.before_call(uuid4())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CIRCUIT_CLOSED)
+        self.assertEqual(self.breaker.consecutive_failures, 0)
+        self.breaker.before_call(uuid4())
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.now += 30
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CIRCUIT_OPEN)
+        self.assertEqual(self.breaker.stats()['times_opened'], 2)
+        with self.assertRaises(LLMUnavailableError):
+            self.breaker.before_call(uuid4())
+
+    def test_abandoned_probe_is_replaced_after_reset_seconds(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.before_call(uuid4())
+        self.now += 30
+        self.breaker.before_call(uuid4())
+        self.assertEqual(self.breaker.state, CIRCUIT_HALF_OPEN)
+
+    def test_client_errors_and_rate_limits_do_not_count(self):
+        self.fail(2, status_code=503)
+        for status_code in (400, 404, 429):
+            self.fail(1, status_code=status_code)
+            self.assertEqual(self.breaker.consecutive_failures, 0)
+        self.fail(2, status_code=503)
+        self.fail(5, status_code=429)
+        self.assertEqual(self.breaker.state, CIRCUIT_CLOSED)
+
+    def test_rate_limited_probe_closes_breaker(self):
+        # 429 表示服務可達，探測調用收到 429 時關閉斷路器，由限流器退避
+        self.open_breaker()
+        self.now += 30
+        self.fail(1, status_code=429)
+        self.assertEqual(self.breaker.state, CIRCUIT_CLOSED)
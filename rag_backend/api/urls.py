@@ -11,9 +11,25 @@ from .views import (
     ChatMessageViewSet,
     ConversationViewSet,
     knowledge_base_status,
+    ingestion_queue_status,
+    ingestion_batch_status,
+    context_cache_status,
+    answer_cache_status,
+    semantic_cache_status,
+    retrieval_cache_status,
+    llm_client_status,
+    reranker_status,
+    query_async,
+    batch_query,
+    regenerate_async,
+    dedup_report,
     vectorstore_maintenance,
     cancel_processing,
-    file_status
+    file_status,
+    upload_session_create,
+    upload_session_detail,
+    upload_session_part,
+    upload_session_finalize
 )
 
 # Create a router and register our viewsets with it.
@@ -31,14 +47,42 @@ urlpatterns = [
     path("file/<str:file_id>/cancel_processing/", cancel_processing, name="cancel-processing"),
     path("file/<str:file_id>/check_status/", file_status, name="file-status"),
     path("file/<str:file_id>/status/", file_status, name="file-status-compat"),
+    # 可續傳分片上傳端點（需在 file/<pk>/ 路由之前）
+    path("file/uploads/", upload_session_create, name="upload-session-create"),
+    path("file/uploads/<uuid:session_id>/", upload_session_detail, name="upload-session-detail"),
+    path("file/uploads/<uuid:session_id>/parts/", upload_session_part, name="upload-session-part"),
+    path("file/uploads/<uuid:session_id>/finalize/", upload_session_finalize, name="upload-session-finalize"),
     
     # 知識庫狀態端點
     path("knowledge_base/status/", knowledge_base_status, name="api-kb-status"),
+    # 攝取佇列狀態端點
+    path("ingestion/queue/", ingestion_queue_status, name="api-ingestion-queue"),
+    # 批量導入進度端點
+    path("ingestion/batch/<uuid:batch_id>/", ingestion_batch_status, name="api-ingestion-batch"),
+    # 上下文快取統計端點
+    path("ingestion/context_cache/", context_cache_status, name="api-context-cache"),
+    # 近似重複檢測報告端點
+    path("ingestion/dedup_report/", dedup_report, name="api-dedup-report"),
     # 向量庫維護端點
     path("admin/vectorstore/maintenance/", vectorstore_maintenance, name="api-vs-maintenance"),
     
     # User specific query endpoint
     path("query/", QueryView.as_view(), name="api-query"),
+    # 異步查詢與重新生成端點（ASGI 部署時使用）
+    path("query/async/", query_async, name="api-query-async"),
+    # 批量查詢端點（結果以 JSONL 流式返回）
+    path("query/batch/", batch_query, name="api-query-batch"),
+    path("chat_history/regenerate/async/", regenerate_async, name="api-regenerate-async"),
+    # 問答快取統計端點
+    path("query/answer_cache/", answer_cache_status, name="api-answer-cache"),
+    # 語義快取統計端點
+    path("query/semantic_cache/", semantic_cache_status, name="api-semantic-cache"),
+    # 檢索結果快取統計端點
+    path("query/retrieval_cache/", retrieval_cache_status, name="api-retrieval-cache"),
+    # LLM 客戶端（連接池與斷路器）狀態端點
+    path("llm/client/", llm_client_status, name="api-llm-client"),
+    # 重排序器狀態端點
+    path("llm/reranker/", reranker_status, name="api-llm-reranker"),
     # Settings endpoint
     path("setting/", SettingAPIView.as_view(), name="api-setting"),
     
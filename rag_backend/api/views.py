@@ -1,6 +1,7 @@
 # /home/ubuntu/manus_rag_refactor/backend_merged/api/views.py
 import uuid
 import os
+import json
 import logging
 from datetime import datetime
 
@@ -10,9 +11,12 @@ from rest_framework.response import Response
 from rest_framework.decorators import action, api_view
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.shortcuts import get_object_or_404
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.conf import settings # For MEDIA_ROOT
 
-from .models import File, Tag, ChatMessage, Setting as SettingModel, Conversation # 添加 Conversation 導入
+from .models import File, Tag, ChatMessage, Setting as SettingModel, Conversation, UploadSession # 添加 Conversation 導入
 from .serializers import (
     FileSerializer,
     FileUploadSerializer, 
@@ -21,17 +25,43 @@ from .serializers import (
     ConversationSerializer, # 添加 ConversationSerializer 導入
     SettingSerializer,
     QuerySerializer, # From user's original serializers
+    BatchQuerySerializer,
     FileTagsSerializer, # Added FileTagsSerializer
     StatusResponseSerializer,
     SuccessResponseSerializer,
     EmptySerializer,
     KnowledgeBaseStatusSerializer,
-    VectorstoreMaintenanceResponseSerializer
+    VectorstoreMaintenanceResponseSerializer,
+    IngestionQueueStatusSerializer,
+    ContextCacheStatsSerializer,
+    DedupReportSerializer,
+    BulkUploadSerializer,
+    BulkUploadResponseSerializer,
+    IngestionBatchStatusSerializer,
+    UploadSessionInitSerializer,
+    UploadSessionFinalizeSerializer,
+    UploadSessionSerializer,
+    IngestionEstimateSerializer,
+    AnswerCacheStatsSerializer,
+    SemanticCacheStatsSerializer,
+    RetrievalCacheStatsSerializer,
+    LLMClientStatsSerializer,
+    RerankerStatusSerializer
 )
 from .rag_instance import rag_manager_singleton # Use the singleton RAGManager
+from .managers.bulk_import import BulkImportError, batch_progress
+from .managers.chunked_upload import ChunkedUploadError, UploadOffsetError
+from .managers.corpus_version import get_corpus_version
+from .managers.llm_client import LLMUnavailableError
 
 logger = logging.getLogger(__name__)
 
+def _request_owner(request):
+    """攝取任務的提交者標識，用於用戶間的公平調度（未登入時使用客戶端 IP）"""
+    if request.user and request.user.is_authenticated:
+        return request.user.get_username()
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
 # Test endpoints (can be removed or kept for utility)
 @api_view(["GET"])
 def ping(request):
@@ -49,6 +79,8 @@ class FileViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == "upload_file": # Changed action name for clarity
             return FileUploadSerializer
+        if self.action == "bulk_upload":
+            return BulkUploadSerializer
         return FileSerializer
 
     @action(detail=False, methods=["post"], name="Upload File")
@@ -80,20 +112,10 @@ class FileViewSet(viewsets.ModelViewSet):
         file_id_str = str(file_instance.id)
 
         try:
-            # 在背景執行檔案處理 (這裡可以使用 Celery 或其他非同步方法)
-            # 為了簡化示例，我們仍然同步處理，但在實際環境中應該改為非同步
-            logger.info(f"Calling RAGManager to process file: {file_id_str} at {absolute_file_path}")
-            
-            # 使用 RAGManager 處理檔案，這會更新 RAG DB 和 Django DB
-            import threading
-            processing_thread = threading.Thread(
-                target=rag_manager_singleton.process_file,
-                args=(file_id_str, absolute_file_path),
-                daemon=True
-            )
-            processing_thread.start()
-            
-            logger.info(f"Background processing started for file: {file_id_str}")
+            # 加入持久化攝取佇列，由有界工作執行緒池在背景處理，重啟後未完成的任務會自動恢復
+            logger.info(f"Enqueueing file for processing: {file_id_str} at {absolute_file_path}")
+            job_id = rag_manager_singleton.enqueue_file(file_id_str, absolute_file_path, owner=_request_owner(request))
+            logger.info(f"Ingestion job {job_id} queued for file: {file_id_str}")
 
         except Exception as e:
             logger.exception(f"Failed to start processing for file {file_instance.id}: {e}")
@@ -104,6 +126,37 @@ class FileViewSet(viewsets.ModelViewSet):
         response_serializer = FileSerializer(file_instance, context={"request": request})
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["post"], name="Bulk Upload")
+    def bulk_upload(self, request, *args, **kwargs):
+        """
+        批量導入：上傳 zip/tar 壓縮包（archive），或由管理員指定伺服器目錄（directory）
+        
+        成員文件流式解出並分批寫入，攝取由佇列的工作執行緒池並行處理，
+        進度可通過 ingestion/batch/<batch_id>/ 查詢。
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        archive = serializer.validated_data.get("archive")
+        directory = serializer.validated_data.get("directory")
+        
+        if directory and not request.user.is_staff:
+            return Response({"error": "只有管理員可以導入伺服器目錄"}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            if archive:
+                logger.info(f"Bulk upload from archive: {archive.name} ({archive.size} bytes)")
+                result = rag_manager_singleton.bulk_importer.import_archive(archive, archive.name, _request_owner(request))
+            else:
+                logger.info(f"Bulk import from directory: {directory}")
+                result = rag_manager_singleton.bulk_importer.import_directory(directory, _request_owner(request))
+        except BulkImportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception(f"批量導入時出錯: {e}")
+            return Response({"error": f"批量導入時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response(BulkUploadResponseSerializer(result).data, status=status.HTTP_201_CREATED)
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         file_id_str = str(instance.id)
@@ -246,6 +299,10 @@ class QueryView(APIView):
                 "related_docs": related_docs,
                 "show_sources": show_sources
             }, status=status.HTTP_200_OK)
+        except LLMUnavailableError as e:
+            # 斷路器打開，LLM 服務暫時不可用
+            logger.warning(str(e))
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.exception(f"Error processing query: {e}")
             return Response({"error": f"Failed to process query: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -428,10 +485,218 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
                 "related_docs": related_docs,
                 "show_sources": show_sources
             }, status=status.HTTP_200_OK)
+        except LLMUnavailableError as e:
+            # 斷路器打開，LLM 服務暫時不可用
+            logger.warning(str(e))
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.exception(f"重新生成回答時出錯: {e}")
             return Response({"error": f"重新生成回答時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# 批量查詢視圖（離線評估與批量生成回答）
+@api_view(["POST"])
+def batch_query(request):
+    """
+    批量回答問題，結果按完成順序以 JSONL 流式返回（每行一個問題，index 為問題在請求中的序號）
+    
+    persist 為 true 時為本批創建一個對話並保存每個成功的回答，默認不寫入聊天記錄
+    """
+    serializer = BatchQuerySerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    questions = serializer.validated_data["questions"]
+    max_questions = rag_manager_singleton.batch_runner.config['MAX_QUESTIONS']
+    if len(questions) > max_questions:
+        return Response(
+            {"error": f"每批最多 {max_questions} 個問題，收到 {len(questions)} 個"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    show_sources = serializer.validated_data["show_sources"]
+    
+    try:
+        conversation = None
+        if serializer.validated_data["persist"]:
+            title = serializer.validated_data.get("title") or f"批量查詢（{len(questions)} 個問題）"
+            conversation = Conversation.objects.create(title=title)
+        
+        results = rag_manager_singleton.batch_query(
+            questions,
+            use_different_strategy=serializer.validated_data["use_different_strategy"],
+            max_concurrency=serializer.validated_data.get("max_concurrency")
+        )
+    except Exception as e:
+        logger.exception(f"批量查詢時出錯: {e}")
+        return Response({"error": f"批量查詢時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def stream():
+        for result in results:
+            if conversation is not None and 'answer' in result:
+                try:
+                    chat_message = ChatMessage.objects.create(
+                        conversation=conversation,
+                        user_message=result['question'],
+                        assistant_message=result['answer'],
+                        related_docs=result['related_docs'],
+                        show_sources=show_sources
+                    )
+                    result['id'] = str(chat_message.id)
+                    result['conversation_id'] = str(conversation.id)
+                except Exception as e:
+                    logger.exception(f"保存批量查詢結果時出錯: {e}")
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        if conversation is not None:
+            # 更新對話的最後修改時間
+            conversation.save()
+    
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+def _parse_json_body(request):
+    """解析異步視圖的 JSON 請求體，無效時返回 None"""
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+# 異步查詢視圖（ASGI 部署時使用，等待 LLM 回答期間不佔用工作執行緒）
+@csrf_exempt
+@require_POST
+async def query_async(request):
+    """
+    QueryView 的異步版本：檢索在有界執行緒池中執行，LLM 使用 ainvoke，對話與消息使用異步 ORM 寫入
+    """
+    data = _parse_json_body(request)
+    if data is None:
+        return JsonResponse({"error": "請求體必須是 JSON 對象"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = QuerySerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    question = serializer.validated_data["question"]
+    show_sources = serializer.validated_data.get("show_sources", True)
+    conversation_id = data.get("conversation_id")
+    
+    try:
+        answer, related_docs = await rag_manager_singleton.aquery(question)
+        
+        chat_message_data = {
+            'id': str(uuid.uuid4()),
+            'user_message': question,
+            'assistant_message': answer,
+            'related_docs': related_docs,
+            'show_sources': show_sources
+        }
+        
+        if conversation_id:
+            try:
+                conversation = await Conversation.objects.aget(id=conversation_id)
+            except Conversation.DoesNotExist:
+                return JsonResponse({"error": f"對話 {conversation_id} 不存在"}, status=status.HTTP_400_BAD_REQUEST)
+            chat_message = await ChatMessage.objects.acreate(**chat_message_data, conversation=conversation)
+            # 更新對話的最後修改時間
+            await conversation.asave()
+        else:
+            title = question[:50] + "..." if len(question) > 50 else question
+            conversation = await Conversation.objects.acreate(title=title)
+            chat_message = await ChatMessage.objects.acreate(**chat_message_data, conversation=conversation)
+        
+        return JsonResponse({
+            "id": str(chat_message.id),
+            "conversation_id": str(conversation.id),
+            "user_message": question,
+            "assistant_message": answer,
+            "related_docs": related_docs,
+            "show_sources": show_sources
+        }, status=status.HTTP_200_OK)
+    except LLMUnavailableError as e:
+        # 斷路器打開，LLM 服務暫時不可用
+        logger.warning(str(e))
+        return JsonResponse({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        logger.exception(f"Error processing query: {e}")
+        return JsonResponse({"error": f"Failed to process query: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 異步重新生成回答視圖（ASGI 部署時使用）
+@csrf_exempt
+@require_POST
+async def regenerate_async(request):
+    """
+    ChatMessageViewSet.regenerate 的異步版本，消息與對話的更新規則相同
+    """
+    data = _parse_json_body(request)
+    if data is None:
+        return JsonResponse({"error": "請求體必須是 JSON 對象"}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = QuerySerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    question = serializer.validated_data["question"]
+    chat_id = serializer.validated_data.get("id")
+    show_sources = serializer.validated_data.get("show_sources", True)
+    conversation_id = data.get("conversation_id")
+    
+    try:
+        answer, related_docs = await rag_manager_singleton.aquery(question, use_different_strategy=True)
+        
+        chat_message_data = {
+            'user_message': question,
+            'assistant_message': answer,
+            'related_docs': related_docs,
+            'show_sources': show_sources
+        }
+        title = question[:50] + "..." if len(question) > 50 else question
+        
+        chat_message = None
+        if chat_id:
+            chat_message = await ChatMessage.objects.select_related('conversation').filter(id=chat_id).afirst()
+        if chat_message is not None:
+            chat_message.assistant_message = answer
+            chat_message.related_docs = related_docs
+            chat_message.show_sources = show_sources
+            await chat_message.asave()
+            # 如果消息有關聯的對話，更新對話的修改時間
+            if chat_message.conversation:
+                await chat_message.conversation.asave()
+        elif conversation_id:
+            conversation = await Conversation.objects.filter(id=conversation_id).afirst()
+            if conversation is not None:
+                chat_message = await ChatMessage.objects.acreate(
+                    id=chat_id or str(uuid.uuid4()), conversation=conversation, **chat_message_data
+                )
+                await conversation.asave()
+            else:
+                # 找不到對話，創建新對話
+                conversation = await Conversation.objects.acreate(title=title)
+                chat_message = await ChatMessage.objects.acreate(
+                    id=chat_id or str(uuid.uuid4()), conversation=conversation, **chat_message_data
+                )
+        elif chat_id:
+            # 既找不到原消息也沒有提供對話ID，創建一個新獨立消息
+            chat_message = await ChatMessage.objects.acreate(id=str(uuid.uuid4()), **chat_message_data)
+        else:
+            # 都沒有提供，創建新對話
+            conversation = await Conversation.objects.acreate(title=title)
+            chat_message = await ChatMessage.objects.acreate(
+                id=str(uuid.uuid4()), conversation=conversation, **chat_message_data
+            )
+        
+        return JsonResponse({
+            "id": str(chat_message.id),
+            "conversation_id": str(chat_message.conversation_id) if chat_message.conversation_id else None,
+            "user_message": question,
+            "assistant_message": answer,
+            "related_docs": related_docs,
+            "show_sources": show_sources
+        }, status=status.HTTP_200_OK)
+    except LLMUnavailableError as e:
+        # 斷路器打開，LLM 服務暫時不可用
+        logger.warning(str(e))
+        return JsonResponse({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        logger.exception(f"重新生成回答時出錯: {e}")
+        return JsonResponse({"error": f"重新生成回答時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # Settings View (from my previous version, assuming it's needed)
 class SettingAPIView(generics.RetrieveUpdateAPIView):
     serializer_class = SettingSerializer
@@ -522,6 +787,158 @@ def knowledge_base_status(request):
         logger.exception(f"獲取知識庫狀態時出錯: {e}")
         return Response({"error": f"獲取知識庫狀態時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# 攝取佇列狀態視圖
+@api_view(["GET"])
+def ingestion_queue_status(request):
+    """
+    獲取攝取任務佇列的狀態（各狀態任務數、佇列深度與各階段佔用情況）
+    """
+    try:
+        serializer = IngestionQueueStatusSerializer(data=rag_manager_singleton.ingestion_queue.status())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取攝取佇列狀態時出錯: {e}")
+        return Response({"error": f"獲取攝取佇列狀態時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 批量導入進度視圖
+@api_view(["GET"])
+def ingestion_batch_status(request, batch_id):
+    """
+    獲取批量導入批次的匯總進度
+    """
+    try:
+        progress = batch_progress(batch_id)
+        if progress is None:
+            return Response({"error": "找不到該批次"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(IngestionBatchStatusSerializer(progress).data, status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.exception(f"獲取批量導入進度時出錯: {e}")
+        return Response({"error": f"獲取批量導入進度時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 上下文快取統計視圖
+@api_view(["GET"])
+def context_cache_status(request):
+    """
+    獲取文本塊上下文快取的統計信息（命中/未命中次數、條目數與大小）
+    """
+    try:
+        serializer = ContextCacheStatsSerializer(data=rag_manager_singleton.context_cache.stats())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取上下文快取統計時出錯: {e}")
+        return Response({"error": f"獲取上下文快取統計時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 問答快取統計視圖
+@api_view(["GET", "DELETE"])
+def answer_cache_status(request):
+    """
+    獲取問答快取的統計信息與當前知識庫版本；DELETE 清空快取
+    """
+    try:
+        if request.method == "DELETE":
+            rag_manager_singleton.answer_cache.clear()
+        serializer = AnswerCacheStatsSerializer(data={
+            **rag_manager_singleton.answer_cache.stats(),
+            'corpus_version': get_corpus_version(),
+        })
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取問答快取統計時出錯: {e}")
+        return Response({"error": f"獲取問答快取統計時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 語義快取統計視圖
+@api_view(["GET", "DELETE"])
+def semantic_cache_status(request):
+    """
+    獲取語義快取的命中率與抽檢得出的誤命中率；DELETE 清空快取
+    """
+    try:
+        if request.method == "DELETE":
+            rag_manager_singleton.semantic_cache.clear()
+        serializer = SemanticCacheStatsSerializer(data=rag_manager_singleton.semantic_cache.stats())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取語義快取統計時出錯: {e}")
+        return Response({"error": f"獲取語義快取統計時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 檢索結果快取統計視圖
+@api_view(["GET", "DELETE"])
+def retrieval_cache_status(request):
+    """
+    獲取檢索結果快取各階段的命中統計；DELETE 清空快取
+    """
+    try:
+        if request.method == "DELETE":
+            rag_manager_singleton.retrieval_cache.clear()
+        serializer = RetrievalCacheStatsSerializer(data=rag_manager_singleton.retrieval_cache.stats())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取檢索結果快取統計時出錯: {e}")
+        return Response({"error": f"獲取檢索結果快取統計時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# LLM 客戶端狀態視圖
+@api_view(["GET"])
+def llm_client_status(request):
+    """
+    獲取共用 LLM 客戶端的連接池配置與斷路器狀態
+    """
+    try:
+        serializer = LLMClientStatsSerializer(data=rag_manager_singleton.llm_client.stats())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取 LLM 客戶端狀態時出錯: {e}")
+        return Response({"error": f"獲取 LLM 客戶端狀態時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 重排序器狀態視圖
+@api_view(["GET"])
+def reranker_status(request):
+    """
+    獲取重排序器狀態（交叉編碼器不可用時顯示載入錯誤與實際使用的後備方式）
+    """
+    try:
+        serializer = RerankerStatusSerializer(data=rag_manager_singleton.llm_manager.reranker_status())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取重排序器狀態時出錯: {e}")
+        return Response({"error": f"獲取重排序器狀態時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 近似重複檢測報告視圖
+@api_view(["GET"])
+def dedup_report(request):
+    """
+    獲取攝取時近似重複文本塊檢測的報告（重複塊數與節省的存儲）
+    """
+    try:
+        serializer = DedupReportSerializer(data=rag_manager_singleton.deduplicator.report())
+        if serializer.is_valid():
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.exception(f"獲取去重報告時出錯: {e}")
+        return Response({"error": f"獲取去重報告時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # 向量庫維護視圖
 @api_view(["POST"])
 def vectorstore_maintenance(request):
@@ -550,6 +967,93 @@ def vectorstore_maintenance(request):
         logger.exception(f"向量庫維護失敗: {e}")
         return Response({'error': f'向量庫維護失敗: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# 可續傳分片上傳：創建會話
+@api_view(["POST"])
+def upload_session_create(request):
+    """
+    創建分片上傳會話
+    
+    之後以 PUT file/uploads/<id>/parts/?offset=N 上傳原始字節分片，
+    再以 POST file/uploads/<id>/finalize/ 提交 sha256 完成；創建時已提供 sha256 則最後一個分片寫入後自動完成。
+    """
+    serializer = UploadSessionInitSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        session = rag_manager_singleton.chunked_upload.init_session(
+            serializer.validated_data["filename"],
+            serializer.validated_data["total_size"],
+            serializer.validated_data.get("sha256", "")
+        )
+        return Response(UploadSessionSerializer(session, context={"request": request}).data, status=status.HTTP_201_CREATED)
+    except ChunkedUploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.exception(f"創建上傳會話時出錯: {e}")
+        return Response({"error": f"創建上傳會話時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 可續傳分片上傳：查詢（received_bytes 即續傳偏移量）或放棄會話
+@api_view(["GET", "DELETE"])
+def upload_session_detail(request, session_id):
+    """獲取上傳會話狀態，或放棄會話並刪除暫存文件"""
+    session = get_object_or_404(UploadSession, id=session_id)
+    if request.method == "GET":
+        return Response(UploadSessionSerializer(session, context={"request": request}).data, status=status.HTTP_200_OK)
+    try:
+        rag_manager_singleton.chunked_upload.abort(session_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    except ChunkedUploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.exception(f"放棄上傳會話時出錯: {e}")
+        return Response({"error": f"放棄上傳會話時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 可續傳分片上傳：寫入分片
+@api_view(["PUT"])
+def upload_session_part(request, session_id):
+    """
+    寫入一個分片，請求體為原始字節（application/octet-stream），偏移量由 offset 查詢參數給出
+    
+    請求體直接流式寫入暫存文件，不經過 request.data 解析；偏移量不連續時返回 409 與 expected_offset。
+    """
+    get_object_or_404(UploadSession, id=session_id)
+    try:
+        offset = int(request.query_params.get("offset", ""))
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return Response({"error": "offset 必須是整數"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        session = rag_manager_singleton.chunked_upload.append_part(
+            session_id, offset, request.stream, length, _request_owner(request)
+        )
+        return Response(UploadSessionSerializer(session, context={"request": request}).data, status=status.HTTP_200_OK)
+    except UploadOffsetError as e:
+        return Response({"error": str(e), "expected_offset": e.expected_offset}, status=status.HTTP_409_CONFLICT)
+    except ChunkedUploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.exception(f"寫入上傳分片時出錯: {e}")
+        return Response({"error": f"寫入上傳分片時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# 可續傳分片上傳：完成
+@api_view(["POST"])
+def upload_session_finalize(request, session_id):
+    """校驗 sha256 並完成上傳，創建的文件立即加入攝取佇列"""
+    get_object_or_404(UploadSession, id=session_id)
+    serializer = UploadSessionFinalizeSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        session = rag_manager_singleton.chunked_upload.finalize(
+            session_id, serializer.validated_data.get("sha256", ""), _request_owner(request)
+        )
+        return Response(UploadSessionSerializer(session, context={"request": request}).data, status=status.HTTP_201_CREATED)
+    except ChunkedUploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.exception(f"完成上傳時出錯: {e}")
+        return Response({"error": f"完成上傳時出錯: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # 文件取消處理路由
 @api_view(["POST"])
 def cancel_processing(request, file_id):
@@ -573,7 +1077,7 @@ def cancel_processing(request, file_id):
 # 文件狀態輪詢路由 - 專門用於前端檢查文件處理狀態
 @api_view(["GET"])
 def file_status(request, file_id):
-    """獲取單個文件的處理狀態，強制同步狀態"""
+    """獲取單個文件的處理狀態，強制同步狀態；排隊或處理中的文件附帶估計完成時間（ingestion）"""
     try:
         # 先嘗試從RAG管理器獲取最新狀態
         rag_file_info = None
@@ -599,8 +1103,16 @@ def file_status(request, file_id):
             logger.info(f"文件狀態已更新 {file_id}: 從 {old_status} 到 {file_obj.status}")
         
         # 返回文件的最新狀態
-        serializer = FileSerializer(file_obj, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response_data = dict(FileSerializer(file_obj, context={"request": request}).data)
+        response_data['ingestion'] = None
+        if file_obj.status in ['uploading', 'processing']:
+            try:
+                estimate = rag_manager_singleton.ingestion_queue.estimate(file_id)
+                if estimate:
+                    response_data['ingestion'] = IngestionEstimateSerializer(estimate).data
+            except Exception as e:
+                logger.error(f"估算文件 {file_id} 完成時間時出錯: {e}")
+        return Response(response_data, status=status.HTTP_200_OK)
     except File.DoesNotExist:
         return Response({"error": "文件不存在"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
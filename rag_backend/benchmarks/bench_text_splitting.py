@@ -0,0 +1,110 @@
+"""
+文本清洗與結構分割的微基準測試
+
+比較舊實現（逐頁 ' '.join(text.split()) 加最多三次 re.findall 的章節匹配）與
+document_parser 中單次掃描的實現。
+
+用法（在 rag_backend 目錄下）:
+    python benchmarks/bench_text_splitting.py --pages 2000 --repeat 3
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.managers.document_parser import clean_text, create_text_splitter, improved_text_spans
+
+SENTENCE = "本公司員工應遵守相關規定，請假須經主管核准並於系統中登記。"
+
+def legacy_clean(text: str) -> str:
+    """舊的逐頁清洗"""
+    return ' '.join(text.strip().split())
+
+def legacy_split(document: str, chunk_size: int, text_splitter) -> list:
+    """舊的 FileProcessor._improved_text_splitting"""
+    title_pattern = r'(^|\n)#+\s+.+?(?=\n#+\s+|\Z)'
+    title_chunks = re.findall(title_pattern, document, re.DOTALL)
+    if len(title_chunks) > 1:
+        return title_chunks
+
+    section_pattern = r'(^|\n)(?:\d+\.)+\s+.+?(?=\n(?:\d+\.)+\s+|\Z)'
+    section_chunks = re.findall(section_pattern, document, re.DOTALL)
+    if len(section_chunks) > 1:
+        return section_chunks
+
+    cn_section_pattern = r'(^|\n)第[一二三四五六七八九十百千]+[章節部分]\s*.+?(?=\n第[一二三四五六七八九十百千]+[章節部分]|\Z)'
+    cn_section_chunks = re.findall(cn_section_pattern, document, re.DOTALL)
+    if len(cn_section_chunks) > 1:
+        return cn_section_chunks
+
+    paragraphs = re.split(r'\n\s*\n', document)
+    chunks = []
+    current_chunk = ""
+    for para in paragraphs:
+        if not para.strip():
+            continue
+        if len(current_chunk) + len(para) < chunk_size:
+            current_chunk += "\n\n" + para if current_chunk else para
+        else:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = para
+    if current_chunk:
+        chunks.append(current_chunk)
+    if len(chunks) > 1 and all(len(chunk) >= 100 for chunk in chunks):
+        return chunks
+    return text_splitter.split_text(document)
+
+def make_pages(count: int, structured: bool, seed: int = 0) -> list:
+    """生成測試頁面：structured 為 True 時每頁包含「第X章」標題，否則只有段落"""
+    rng = random.Random(seed)
+    numerals = "一二三四五六七八九十"
+    pages = []
+    for index in range(count):
+        paragraphs = []
+        if structured:
+            paragraphs.append(f"第{numerals[index % 10]}章  規定 {index}")
+        for _ in range(rng.randint(3, 6)):
+            paragraphs.append("  ".join([SENTENCE] * rng.randint(2, 8)))
+        pages.append("\n\n\n".join(paragraphs) + "\n")
+    return pages
+
+def run(label: str, pages: list, chunk_size: int, chunk_overlap: int, repeat: int) -> None:
+    text_splitter = create_text_splitter(chunk_size, chunk_overlap)
+
+    def legacy():
+        document = "\n\n".join(legacy_clean(page) for page in pages)
+        return len(legacy_split(document, chunk_size, text_splitter))
+
+    def current():
+        document = "\n\n".join(clean_text(page) for page in pages)
+        return len(improved_text_spans(document, chunk_size, text_splitter))
+
+    total_chars = sum(len(page) for page in pages)
+    print(f"[{label}] {len(pages)} 頁，{total_chars / 1e6:.2f}M 字符")
+    for name, func in [('legacy', legacy), ('single-pass', current)]:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            chunks = func()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        print(f"  {name:<12} {best * 1000:9.1f} ms  {total_chars / best / 1e6:7.1f} M字符/秒  {chunks} 個分塊")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--chunk-overlap', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    run('章節標題', make_pages(args.pages, structured=True), args.chunk_size, args.chunk_overlap, args.repeat)
+    run('純段落', make_pages(args.pages, structured=False), args.chunk_size, args.chunk_overlap, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -169,3 +169,176 @@ SPECTACULAR_SETTINGS = {
 # This conflicts with MEDIA_ROOT if we want Django to manage uploads. 
 # Let's assume Django's FileField will use MEDIA_ROOT/uploads/ as per model.
 
+# 文件攝取任務佇列設定（api.managers.job_queue）
+RAG_INGESTION_QUEUE = {
+    'BACKEND': 'django',            # 'django': 使用 Django 資料庫；'sqlite': 使用下方獨立的 SQLite 檔案
+    'SQLITE_PATH': BASE_DIR / 'ingestion_queue.sqlite3',
+    'AUTOSTART': True,              # ASGI/WSGI 入口啟動時自動啟動工作執行緒；False 時由 manage.py run_ingestion_workers 執行任務
+    'WORKERS': 2,                   # 同時處理的文件數量
+    'STAGE_CONCURRENCY': {          # 各處理階段的並發上限
+        'parse': 2,                 # 載入、清洗與分割
+        'context': 1,               # LLM 上下文生成
+        'embed': 1,                 # 嵌入並寫入向量庫
+    },
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF_SECONDS': 30,    # 第 n 次重試前等待 RETRY_BACKOFF_SECONDS * 2^(n-1) 秒
+    'LEASE_SECONDS': 300,           # 執行中任務的租約，進程中斷後租約過期的任務會被重新領取
+    'POLL_INTERVAL_SECONDS': 2,
+    'EMBED_BATCH_SIZE': 256,        # 每批去重、生成上下文、嵌入並寫入向量庫的文本塊數，記憶體中同時只有一批；0 表示整個文件一批
+    # 調度：互動式單文件上傳優先於批量導入，同一優先級內執行中任務較少的提交者優先，再按文件大小短任務優先
+    'PRIORITY_AGING_SECONDS': 600,  # 等待超過此時間的批量任務提升為互動式優先級，避免飢餓；0 表示不提升
+    'ETA_SAMPLE_SIZE': 50,          # 估算完成時間時參考的最近成功任務數
+    'ETA_DEFAULT_OVERHEAD_SECONDS': 10,     # 沒有歷史任務時假設的每個文件固定耗時
+    'ETA_DEFAULT_BYTES_PER_SECOND': 50000,  # 沒有歷史任務時假設的處理速度
+}
+
+# 文件解析進程池設定（api.managers.document_parser）
+RAG_PARSER = {
+    'PROCESSES': 2,                 # 載入、清洗與分割所用的子進程數量，0 表示在 Web 進程內解析
+}
+
+# 上下文嵌入生成設定（api.managers.context_generator）
+RAG_CONTEXT_GENERATION = {
+    'CONCURRENCY': 4,               # 同時進行的 LLM 調用數量
+    'REQUESTS_PER_MINUTE': 500,     # 令牌桶限流：每分鐘請求數，0 表示不限制
+    'TOKENS_PER_MINUTE': 200000,    # 令牌桶限流：每分鐘令牌數，0 表示不限制
+    'EXPECTED_OUTPUT_TOKENS': 150,  # 估算每次調用的輸出令牌數
+    'MAX_RETRIES': 5,               # 收到 429、5xx 或連接錯誤時的最大重試次數（上下文生成不使用 SDK 重試，只有這一層）；用盡後文件處理失敗並由攝取佇列重試
+    'RETRY_BASE_SECONDS': 1,        # 指數退避基數（加完全抖動）
+    'RETRY_MAX_SECONDS': 60,
+    'CANCEL_CHECK_SECONDS': 2,      # 生成期間檢查取消狀態的間隔
+    'BATCH_MODE': True,             # 同一窗口的多個文本塊共用一次調用，回答為按索引的 JSON
+    'BATCH_SIZE': 16,               # 每次批量調用最多包含的文本塊數
+    'BATCH_WINDOW_CHARS': 24000,    # 批量調用共享的文檔窗口最大字符數
+    'WINDOW_MARGIN_CHARS': 2000,    # 窗口在文本塊前後額外保留的字符數
+}
+
+# 文本塊上下文快取設定（api.managers.context_cache）
+RAG_CONTEXT_CACHE = {
+    'ENABLED': True,
+    'PATH': BASE_DIR / 'context_cache.sqlite3',
+    'MAX_BYTES': 256 * 1024 * 1024,  # 超出後按最近最少使用淘汰
+    'EVICT_TO_RATIO': 0.9,           # 淘汰至 MAX_BYTES 的此比例
+}
+
+# 文件處理取消設定（api.managers.cancellation）
+RAG_CANCELLATION = {
+    'DB_CHECK_INTERVAL_SECONDS': 5,  # 處理中文件查詢資料庫取消狀態的最短間隔，用於感知其他進程發出的取消
+}
+
+# 攝取時的近似重複文本塊檢測（api.managers.dedup）
+RAG_DEDUP = {
+    'ENABLED': True,
+    'MODE': 'downweight',           # 'downweight': 保留但檢索時降低排名（修訂版文件只差幾個字也可能超過閾值，保留可避免新內容丟失）；'skip' / 'link': 丟棄重複塊（原始文件刪除時重新處理）
+    'THRESHOLD': 0.85,              # 估計的 Jaccard 相似度閾值
+    'NUM_PERM': 64,                 # MinHash 簽名長度
+    'BANDS': 16,                    # LSH 分段數（NUM_PERM 必須是其整數倍）
+    'SHINGLE_SIZE': 3,              # 每個詞組包含的 jieba 詞數
+    'DOWNWEIGHT': 0.5,              # downweight 模式下重複塊的排名權重
+    'PATH': BASE_DIR / 'dedup_index.sqlite3',
+}
+
+# 批量導入設定（api.managers.bulk_import）
+RAG_BULK_IMPORT = {
+    'MAX_FILES': 10000,                          # 單次導入的文件數上限
+    'MAX_TOTAL_BYTES': 10 * 1024 * 1024 * 1024,  # 單次導入解壓後的總大小上限
+    'BULK_CREATE_SIZE': 200,                     # 每累積多少個文件寫入一次資料庫並加入佇列
+    'ALLOWED_DIRECTORIES': [],                   # 管理員可導入的伺服器目錄，為空時禁用目錄導入
+}
+
+# 可續傳分片上傳設定（api.managers.chunked_upload）
+RAG_CHUNKED_UPLOAD = {
+    'TEMP_DIR': MEDIA_ROOT / 'upload_parts',   # 分片暫存目錄，與上傳目錄位於同一存儲下以便完成時直接重命名
+    'MAX_FILE_SIZE': 2 * 1024 * 1024 * 1024,   # 單個文件的大小上限
+    'MAX_PART_SIZE': 64 * 1024 * 1024,         # 單個分片的大小上限
+    'SESSION_TTL_HOURS': 24,                   # 超過此時間未更新的會話會被清理
+}
+
+# 問答快取設定（api.managers.answer_cache），鍵為規範化問題、檢索相關設置與知識庫版本
+RAG_ANSWER_CACHE = {
+    'ENABLED': True,
+    'TTL_SECONDS': 3600,                        # 條目有效期
+    'MAX_ENTRIES': 2000,                        # 記憶體層條目數上限（LRU 淘汰）
+    'MAX_BYTES': 64 * 1024 * 1024,              # 記憶體層大小上限
+    'PERSISTENT': False,                        # 啟用 SQLite 持久層（多個進程共用，重啟後保留）
+    'PATH': BASE_DIR / 'answer_cache.sqlite3',
+    'PERSISTENT_MAX_BYTES': 256 * 1024 * 1024,  # 持久層大小上限
+}
+
+# 語義問答快取（以問題嵌入的餘弦相似度匹配改寫過的問題）
+RAG_SEMANTIC_CACHE = {
+    'ENABLED': True,
+    'SIMILARITY_THRESHOLD': 0.92,      # 命中所需的最低相似度，調低可提高命中率但誤命中會增加
+    'MAX_ENTRIES': 5000,               # 條目數上限（LRU 淘汰）
+    'TTL_SECONDS': 24 * 3600,          # 條目有效期
+    'AUDIT_SAMPLE_RATE': 0.05,         # 命中後在背景重新檢索以抽檢誤命中的比例
+    'AUDIT_MIN_OVERLAP': 0.5,          # 重新檢索的文件與條目引用的文件重疊低於此比例時記為誤命中
+    'QUERY_EMBEDDING_MEMO_SIZE': 256,  # 記住的問題嵌入數量（語義快取與檢索共用）
+}
+
+# 檢索結果快取（候選檢索與重排序分階段保存，鍵包含知識庫版本）
+RAG_RETRIEVAL_CACHE = {
+    'ENABLED': True,
+    'TTL_SECONDS': 600,   # 條目有效期，覆蓋同一問題的重新生成與重複查詢
+    'MAX_ENTRIES': 1000,  # 條目數上限（LRU 淘汰）
+}
+
+# 文件元數據快取（查詢時批量解析來源文件名，本進程內的 File 變更會立即使條目失效）
+RAG_FILE_METADATA_CACHE = {
+    'TTL_SECONDS': 300,    # 條目有效期，限制其他進程修改文件後的過時時間
+    'MAX_ENTRIES': 10000,  # 條目數上限（LRU 淘汰）
+}
+
+# 提示上下文打包（按令牌預算放入文本塊，控制 LLM 延遲與費用）
+RAG_CONTEXT_PACKING = {
+    'ENABLED': True,
+    'MAX_CONTEXT_TOKENS': 3000,       # 上下文令牌數上限
+    'MODEL_CONTEXT_WINDOWS': {        # 各模型的上下文窗口，預算不會超過窗口扣除 max_tokens 後的剩餘
+        'gpt-3.5-turbo': 16385,
+        'gpt-4': 8192,
+        'gpt-4-turbo': 128000,
+        'gpt-4o': 128000,
+        'gpt-4o-mini': 128000,
+    },
+    'DEFAULT_CONTEXT_WINDOW': 8192,   # 未列出的模型使用的上下文窗口
+    'PROMPT_OVERHEAD_TOKENS': 300,    # 為提示模板預留的令牌數
+    'MIN_CHUNK_TOKENS': 64,           # 剩餘預算低於此值時不再截斷放入文本塊
+    'STRIP_CONTEXT_PREFIX': True,     # 去除上下文嵌入加在文本塊前、只用於檢索的上下文描述
+}
+
+# 重排序器（use_reranking 開啟時使用）
+RAG_RERANKER = {
+    'TYPE': 'cross_encoder',                  # cross_encoder：本地交叉編碼器批量打分；llm：逐個文檔調用 LLM 壓縮（舊行為）
+    'FALLBACK': 'llm',                        # 交叉編碼器不可用（未安裝 sentence-transformers 或模型載入失敗）時：llm 改用 LLM 壓縮；none 不重排序
+    'MODEL_NAME': 'BAAI/bge-reranker-base',
+    'INFERENCE_BACKEND': 'torch',             # torch、onnx 或 openvino（需要 sentence-transformers 的對應可選依賴）
+    'ONNX_FILE_NAME': '',                     # ONNX 模型文件，例如 int8 量化的 onnx/model_qint8_avx512.onnx
+    'CANDIDATES': 30,                         # 重排序前檢索的候選文本塊數量，重排序後保留 top_k 個
+    'BATCH_SIZE': 32,                         # 每批打分的 (問題, 文本塊) 對數量
+    'MAX_LENGTH': 512,                        # 每對輸入的最大令牌數，越短越快
+}
+
+# 異步查詢（query/async/ 與 chat_history/regenerate/async/，需以 ASGI 伺服器運行，如 uvicorn rag_backend.asgi:application）
+RAG_ASYNC_QUERY = {
+    'RETRIEVAL_WORKERS': 8,  # 執行檢索、重排序等阻塞步驟的執行緒數；等待 LLM 回答的請求不佔用執行緒
+}
+
+# 批量查詢（query/batch/ 與 RAGManager.batch_query）
+RAG_BATCH_QUERY = {
+    'MAX_QUESTIONS': 5000,   # 每個請求最多的問題數
+    'CHUNK_SIZE': 64,        # 每批一起嵌入與檢索的問題數，不宜超過 RAG_SEMANTIC_CACHE['QUERY_EMBEDDING_MEMO_SIZE']
+    'LLM_CONCURRENCY': 8,    # 同時進行的 LLM 調用數上限（受 API 速率限制約束）
+}
+
+# 共用的 LLM 客戶端（問答、上下文生成、查詢擴展與 LLM 重排序共用連接池）
+RAG_LLM_CLIENT = {
+    'HTTP2': True,                     # 需要 h2（pip install httpx[http2]），未安裝時使用 HTTP/1.1
+    'MAX_CONNECTIONS': None,           # 連接池上限，None 表示按上下文生成、批量查詢與異步查詢的並發數之和
+    'MAX_KEEPALIVE_CONNECTIONS': None, # 保持的空閒連接數，None 表示與 MAX_CONNECTIONS 相同
+    'KEEPALIVE_EXPIRY_SECONDS': 60,    # 空閒連接保留時間，重用連接可省去 TLS 握手
+    'CONNECT_TIMEOUT_SECONDS': 5,
+    'READ_TIMEOUT_SECONDS': 60,
+    'MAX_RETRIES': 2,                  # 連接錯誤、429 與 5xx 的重試次數（OpenAI SDK 指數退避，遵循 Retry-After）；上下文生成由 RAG_CONTEXT_GENERATION['MAX_RETRIES'] 控制
+    'CIRCUIT_FAILURE_THRESHOLD': 5,    # 連續失敗（連接錯誤、超時與 5xx，不含 429）多少次後打開斷路器，打開期間 LLM 調用立即失敗
+    'CIRCUIT_RESET_SECONDS': 30,       # 斷路器打開後多久放行一個探測調用
+}
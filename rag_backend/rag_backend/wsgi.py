@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rag_backend.settings")
 
 application = get_wsgi_application()
+
+# Web 進程負責執行攝取佇列的任務（AUTOSTART 為 False 時改由 manage.py run_ingestion_workers 執行）
+from api.rag_instance import start_ingestion_workers  # noqa: E402
+
+start_ingestion_workers()